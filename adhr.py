@@ -2,6 +2,7 @@ import json
 import os
 import google.generativeai as genai
 from PIL import Image
+import llm_backend
 
 # Configure Google Generative AI
 # Get API key from environment variable (set by app.py)
@@ -10,10 +11,15 @@ if not GOOGLE_API_KEY:
     print("ERROR: GOOGLE_API_KEY not found. Please ensure app.py is setting it from Streamlit secrets.")
     exit(1)
 genai.configure(api_key=GOOGLE_API_KEY)
-# Use Gemini 3 Pro with vision capabilities
-vision_model = genai.GenerativeModel(model_name="gemini-3-pro-preview")
 
-def extract_text_from_image(image_path):
+AADHAAR_KEYS = ["name", "dob", "gender", "aadhaar_number", "address"]
+AADHAAR_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "string"} for key in AADHAAR_KEYS},
+    "required": AADHAAR_KEYS,
+}
+
+def extract_text_from_image(image_path, config):
     """Use Gemini 2.0 Pro vision to extract and structure Aadhaar card data directly from image."""
     try:
         # Open image
@@ -39,20 +45,10 @@ IMPORTANT:
 Return ONLY a valid JSON object with these exact keys. No explanations, no markdown formatting.
 """
         
-        # Send image and prompt to Gemini
-        response = vision_model.generate_content([prompt, img])
-        
-        # Extract and clean the response
-        raw_output = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        cleaned_output = raw_output.strip().strip("`")
-        cleaned_output = cleaned_output.replace("```json", "").replace("```", "").strip()
-        if cleaned_output.lower().startswith("json"):
-            cleaned_output = cleaned_output[4:].strip()
-        
-        # Parse JSON
-        data = json.loads(cleaned_output)
+        # Send image and prompt to the vision model (Gemini online, Ollama offline) in JSON output mode
+        data = config.vision_backend().generate_json(
+            prompt, AADHAAR_SCHEMA, purpose="aadhaar_extraction", images=[img], use_cache=False
+        )
         
         print("✅ Gemini Vision extracted data successfully")
         return data
@@ -61,9 +57,9 @@ Return ONLY a valid JSON object with these exact keys. No explanations, no markd
         print(f"❌ Gemini Vision extraction failed: {e}")
         return {}
 
-def extract_and_process(image_path):
+def extract_and_process(image_path, config):
     print(f"📷 Processing Aadhaar image with Gemini Vision: {image_path}")
-    data = extract_text_from_image(image_path)
+    data = extract_text_from_image(image_path, config)
     
     if not data:
         print("❌ No data extracted from image.")
@@ -80,6 +76,6 @@ def extract_and_process(image_path):
 
 if __name__ == "__main__":
     IMAGE_PATH = input("Enter image path: ")
-    extract_and_process(IMAGE_PATH)
+    extract_and_process(IMAGE_PATH, llm_backend.LLMConfig.from_env())
 
 
@@ -4,7 +4,7 @@ from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import uvicorn
-import requests
+import http_client
 from datetime import datetime
 from supabase import create_client, Client
 
@@ -32,7 +32,7 @@ def get_geolocation(ip_address: str):
     if not ip_address or ip_address == "127.0.0.1":
         return {"city": "Local", "country": "N/A"}
     try:
-        response = requests.get(f"http://ip-api.com/json/{ip_address}", timeout=5)
+        response = http_client.get(f"http://ip-api.com/json/{ip_address}", timeout=5)
         response.raise_for_status()
         data = response.json()
         return {
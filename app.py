@@ -2,7 +2,6 @@ import streamlit as st
 import pandas as pd
 import json
 import os
-import requests
 import time
 from datetime import datetime
 import hashlib
@@ -13,6 +12,14 @@ import plotly.express as px
 import google.generativeai as genai
 from supabase import create_client, Client
 import ds_r1 , adhr
+import blueprint_index
+import taxonomy
+import llm_backend
+import ollama_manager
+import job_queue
+import job_ui
+import question_library
+import translation_memory
 import random 
 
 
@@ -31,7 +38,6 @@ if not GOOGLE_API_KEY or GOOGLE_API_KEY == "YOUR_API_KEY_HERE":
     st.stop()
 
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-3-flash-preview")
 
 # Set API key in environment for child modules
 os.environ['GOOGLE_API_KEY'] = GOOGLE_API_KEY
@@ -46,7 +52,6 @@ except (KeyError, FileNotFoundError):
     st.stop()
 
 # Ollama configuration for offline mode
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "gemma2"
 
 # --- Import your custom functions ---
@@ -63,10 +68,10 @@ except ImportError as e:
     st.error(f"Import error: {e}")
     # This allows the app to run without the files for initial setup.
     # A proper error will be shown if the user tries to generate a survey.
-    def generate_survey_design(query):
+    def generate_survey_design(query, **kwargs):
         st.error("`ds_r1.py` not found. Please add it to the project directory.")
         return None
-    def extract_and_process(image_path):
+    def extract_and_process(image_path, config):
         st.error("`adhr.py` not found. Please add it to the project directory.")
         return None
 
@@ -75,6 +80,8 @@ os.makedirs("survey_responses", exist_ok=True)
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("survey_jsons", exist_ok=True)
 os.makedirs("shareable_forms", exist_ok=True) 
+# Resume survey generation jobs interrupted by a restart
+job_queue.start_workers()
 DB_NAME = "survey_portal.db"
 CONFIG_FILE = "json_data/config.json"
 LANG_FILE = "json_data/lang.json"
@@ -94,45 +101,32 @@ def load_translations():
 
 TRANSLATIONS = load_translations()
 
-# --- OLLAMA HELPER FUNCTIONS FOR OFFLINE MODE ---
+# --- LLM HELPER FUNCTIONS (ONLINE / OFFLINE) ---
 
-def query_ollama(prompt, model_name="gemma2"):
-    """Query Ollama API for offline mode."""
+def get_session_config():
+    """LLM config (mode and model) selected in this session; passed to every LLM entry point and job."""
+    if st.session_state.get('llm_mode', 'online') == 'offline':
+        return llm_backend.LLMConfig('offline', st.session_state.get('ollama_model', OLLAMA_MODEL))
+    return llm_backend.LLMConfig('online')
+
+def get_session_backend(purpose=""):
+    """LLM backend for this session's config, routed by purpose."""
+    return get_session_config().backend(purpose)
+
+def generate_with_llm(prompt, purpose="", use_cache=True, schema=None, prefix=None):
+    """
+    Generate content using the selected LLM (online or offline); schema requests
+    JSON output, prefix is a prompt prefix shared by a series of calls.
+    """
     try:
-        response = requests.post(
-            OLLAMA_API_URL,
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if response.status_code == 200:
-            return response.json().get("response", "")
-        else:
-            st.error(f"Ollama API error: {response.status_code}")
-            return None
-    except requests.exceptions.ConnectionError:
-        st.error("Cannot connect to Ollama. Please ensure Ollama is running with 'ollama serve' and the model 'gemma2' is installed.")
-        return None
-    except Exception as e:
-        st.error(f"Ollama query error: {e}")
+        return get_session_backend(purpose).generate(prompt, purpose=purpose, use_cache=use_cache, schema=schema, prefix=prefix)
+    except llm_backend.LLMError as e:
+        st.error(str(e))
         return None
 
-def generate_with_llm(prompt):
-    """Generate content using the selected LLM (online or offline)."""
-    mode = st.session_state.get('llm_mode', 'online')
-    
-    if mode == 'offline':
-        return query_ollama(prompt)
-    else:
-        try:
-            response = model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            st.error(f"Gemini API error: {e}")
-            return None
+def stream_with_llm(prompt, purpose="", use_cache=True):
+    """Yields response tokens from the selected LLM as they arrive (for st.write_stream)."""
+    return get_session_backend(purpose).stream(prompt, purpose=purpose, use_cache=use_cache)
 
 # --- 1. CONFIG AND DATABASE MANAGEMENT ---
 
@@ -234,6 +228,7 @@ def get_user(username):
         return None
 
 def add_survey(title, description, status, json_path):
+    """Adds a new survey to the database and returns its ID."""
     try:
         data = {
             "title": title,
@@ -241,9 +236,13 @@ def add_survey(title, description, status, json_path):
             "status": status,
             "json_path": json_path
         }
-        supabase.table("surveys").insert(data).execute()
+        response = supabase.table("surveys").insert(data).execute()
+        if response.data:
+            return response.data[0]['id']
+        return None
     except Exception as e:
         print(f"Error adding survey: {e}")
+        return None
 
 def get_all_surveys():
     try:
@@ -343,73 +342,29 @@ def get_survey_results(survey_id):
 
 
 # --- 2. CORE BACKEND FUNCTIONS ---
-def create_unique_survey_name(query: str) -> str:
-    base_name = query.split()[0].lower().strip().replace("'", "")
-    return f"{base_name}_{int(time.time())}"
-
-def create_survey_json_iteratively(survey_name: str):
-    try:
-        with open(f"survey_responses/{survey_name}.txt", "r", encoding='utf-8') as f:
-            survey_description = f.read().strip()
-        df = pd.read_csv(f"survey_responses/{survey_name}.csv")
-    except FileNotFoundError as e:
-        st.error(f"Error: Design file not found: {e}.")
-        return None
-    
-    survey_questions = []
-    progress_bar = st.progress(0, text="Initializing LLM...")
-    for i, header in enumerate(df.columns):
-        progress_text = f"Generating question for '{header}'... ({i+1}/{len(df.columns)})"
-        st.toast(progress_text)
-        progress_bar.progress((i + 1) / len(df.columns), text=progress_text)
-        
-        try:
-            prompt = f"""Given a survey about '{survey_description}', generate a JSON object for a single survey question based on the data field '{header}'. The JSON object must have ONLY three keys: "question", "description", and "type" (choose from 'text', 'yes/no', or 'rating_1_10')."""
-            
-            response_text = generate_with_llm(prompt)
-            if not response_text:
-                raise Exception("LLM returned empty response")
-            
-            # Extract JSON from markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            question_json = json.loads(response_text)
-
-            if all(k in question_json for k in ["question", "description", "type"]):
-                survey_questions.append(question_json)
-            else:
-                st.warning(f"LLM returned incomplete data for '{header}'. Using a default question.")
-                survey_questions.append({
-                    "question": header.replace('_', ' ').title(),
-                    "description": "Please provide your input for this question.",
-                    "type": "text"
-                })
+def open_job(job):
+    """Continues a job after its latest finished stage: the column editor, or saving the generated survey."""
+    checkpoints = job["checkpoints"]
+    st.session_state.active_job_id = job["job_id"]
+    st.session_state.active_job_view = (job["stage"], job["status"])
+    if job["stage"] == "blueprint":
+        job_ui.open_blueprint_for_editing(job["query"], checkpoints["blueprint"])
+        return
+    questions = checkpoints["questions"]
+    if job["stage"] == "questions":
+        for warning in questions["warnings"]:
+            st.warning(warning)
+        survey_id = add_survey(job["query"].split('.')[0], checkpoints["blueprint"]["description"], 'Draft', questions["json_path"])
+        question_library.accept_survey(questions["json_path"])
+        if questions.get("script"):
+            # Fused mode: the script steps came with the questions, so write the script in the background
+            job_queue.advance(job["job_id"], "script", survey_id=survey_id)
+        else:
+            job_queue.finish(job["job_id"])
+    st.success(f"🎉 Survey created!")
+    for key in job_ui.JOB_VIEW_KEYS:
+        st.session_state.pop(key, None)
 
-        except Exception as e:
-            st.error(f"Failed to connect to Google Gemini API. Please check your API key.")
-            st.error(f"Error details: {e}")
-            return None 
-
-        except (json.JSONDecodeError, Exception) as e:
-            st.warning(f"Could not generate a valid question for '{header}': {e}. Using a default question.")
-            survey_questions.append({
-                "question": header.replace('_', ' ').title(),
-                "description": "Please provide your input for this question.",
-                "type": "text"
-            })
-
-    progress_bar.empty()
-    json_path = os.path.join("survey_jsons", f"{survey_name}.json")
-    with open(json_path, "w", encoding='utf-8') as f:
-        json.dump(survey_questions, f, indent=2, ensure_ascii=False)
-    return json_path, survey_description
-
-
-# --- Shareable Form Generation (HTML Only) ---
 def generate_html_form(survey_details):
     """Generates a standalone HTML form for a survey."""
     survey_id = survey_details['id']
@@ -562,8 +517,6 @@ def render_dashboard(t):
                     type="primary" if current_mode == 'online' else "secondary",
                     use_container_width=True):
             st.session_state.llm_mode = 'online'
-            # Pass the mode to ds_r1
-            os.environ['LLM_MODE'] = 'online'
             st.success("✅ Switched to Online Mode (Gemini API)")
             time.sleep(0.5)
             st.rerun()
@@ -573,8 +526,8 @@ def render_dashboard(t):
                     type="primary" if current_mode == 'offline' else "secondary",
                     use_container_width=True):
             st.session_state.llm_mode = 'offline'
-            # Pass the mode to ds_r1
-            os.environ['LLM_MODE'] = 'offline'
+            # Start loading the offline model now so the first generation does not pay for it
+            ollama_manager.start_warm_up(st.session_state.get('ollama_model', OLLAMA_MODEL))
             st.success("✅ Switched to Offline & Secure Mode (Ollama Gemma 3)")
             time.sleep(0.5)
             st.rerun()
@@ -583,8 +536,16 @@ def render_dashboard(t):
     mode_emoji = "🌐" if current_mode == 'online' else "🔒"
     mode_text = "Online (Gemini API)" if current_mode == 'online' else "Offline & Secure (Local Gemma 3)"
     st.markdown(f'<div class="mode-status">{mode_emoji} Current Mode: {mode_text}</div>', unsafe_allow_html=True)
+    if current_mode == 'offline':
+        # Keep the offline model resident while the app is in use
+        offline_model = st.session_state.get('ollama_model', OLLAMA_MODEL)
+        ollama_manager.start_warm_up(offline_model)
+        ollama_manager.warm_up_routed_models()
+        st.caption(ollama_manager.describe_state(offline_model))
     st.markdown('</div>', unsafe_allow_html=True)
     
+    job_ui.render_llm_performance(current_mode == 'offline')
+    
     st.markdown("---")
     
     # Get metrics from Supabase
@@ -711,6 +672,10 @@ def render_user_dashboard(t):
 def render_survey_management(t):
     st.title(f"📝 {t['nav_survey_management']}")
 
+    # --- Background survey job: follow progress, or continue after its last finished stage ---
+    if job_ui.render_active_job(open_job):
+        return
+
     # --- CSV Editing Stage ---
     if 'csv_editing_stage' in st.session_state and st.session_state.csv_editing_stage:
         st.subheader("Step 2: Review and Edit Survey Columns")
@@ -741,23 +706,33 @@ def render_survey_management(t):
                         df[add_name] = ""
                         st.session_state.editable_df = df
                         st.rerun()
+
+        # Typeahead suggestions from the taxonomy index (no LLM call)
+        st.subheader("Suggested Columns")
+        column_search = st.text_input("Search variables", placeholder="e.g. income, crop, toilet", key="column_search")
+        suggestions = taxonomy.suggest_columns(
+            column_search or st.session_state.query, exclude=st.session_state.editable_df.columns,
+            classifications=st.session_state.get('survey_classifications')
+        )
+        if suggestions:
+            suggested = st.selectbox("Suggestions", options=suggestions, key="column_suggestion")
+            if st.button("➕ Add Suggested Column"):
+                df = st.session_state.editable_df
+                df[suggested] = ""
+                st.session_state.editable_df = df
+                st.rerun()
+        else:
+            st.caption("No matching variables in the taxonomy.")
         
         st.markdown("---")
         if st.button("✅ Confirm Columns & Generate Questions", type="primary"):
             final_df = st.session_state.editable_df
             survey_name = st.session_state.survey_name
             final_df.to_csv(f"survey_responses/{survey_name}.csv", index=False)
-            
-            with st.spinner("Building survey questions with AI..."):
-                result = create_survey_json_iteratively(survey_name)
-            if result:
-                json_path, description = result
-                with st.spinner("Finalizing and saving survey..."):
-                    add_survey(st.session_state.query.split('.')[0], description, 'Draft', json_path)
-                st.success(f"🎉 Survey created!")
-                for key in ['csv_editing_stage', 'editable_df', 'survey_name', 'query']:
-                    del st.session_state[key]
-                st.rerun()
+            job_queue.advance(survey_name, "questions", columns=list(final_df.columns))
+            st.session_state.csv_editing_stage = False
+            st.session_state.pop('active_job_view', None)
+            st.rerun()
     
     # --- Original Survey Creation Form ---
     else:
@@ -768,23 +743,19 @@ def render_survey_management(t):
                 if st.form_submit_button(t['generate_survey_button']):
                     # --- Standard Generation Logic ---
                     if query.strip():
-                        with st.spinner("Generating Survey Blueprint..."):
-                            generate_survey_design(query)
-                        survey_name = create_unique_survey_name(query)
-                        try:
-                            os.rename("survey_responses/data.csv", f"survey_responses/{survey_name}.csv")
-                            os.rename("survey_responses/data.txt", f"survey_responses/{survey_name}.txt")
-                            
-                            st.session_state.editable_df = pd.read_csv(f"survey_responses/{survey_name}.csv")
-                            st.session_state.survey_name = survey_name
-                            st.session_state.query = query
-                            st.session_state.csv_editing_stage = True
+                        # Near-identical earlier query: offer its blueprint first
+                        match = blueprint_index.find_similar(query)
+                        if match:
+                            similarity, blueprint = match
+                            st.session_state.blueprint_match = {"query": query, "similarity": similarity, "blueprint": blueprint}
                             st.rerun()
-
-                        except FileNotFoundError:
-                            st.error("Error: Your function did not create 'data.csv' or 'data.txt'.")
+                        job_ui.start_survey_job(query, get_session_config())
                     else:
                         st.error("Please enter survey requirements.")
+            if 'blueprint_match' in st.session_state:
+                job_ui.render_blueprint_match(get_session_config())
+
+        job_ui.render_job_list()
     
     st.markdown("---")
     st.header(t['existing_surveys_header'])
@@ -802,8 +773,8 @@ def render_survey_management(t):
             
             with col1:
                 if st.button("🚀 Deploy", key=f"deploy_{selected_id}"):
-                    update_survey_status(selected_id, "Deployed")
-                    st.success(f"Survey {selected_id} has been deployed.")
+                    deploy_survey(selected_id, df_surveys[df_surveys['id'] == selected_id].iloc[0]['json_path'])
+                    st.success(f"Survey {selected_id} has been deployed; its translations are being built in the background.")
                     st.rerun()
             
             with col2:
@@ -877,7 +848,7 @@ def render_take_survey(t):
         with open(image_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
         with st.spinner("Processing Aadhaar card..."):
-            extract_and_process(image_path)
+            extract_and_process(image_path, get_session_config())
         try:
             with open("aadhaar_output.json", "r", encoding='utf-8') as f:
                 aadhaar_data = json.load(f)
@@ -896,6 +867,12 @@ def render_take_survey(t):
         except Exception as e:
             st.error(f"Failed to process Aadhaar data: {e}")
 
+def deploy_survey(survey_id, json_path):
+    """Marks the survey deployed and queues the job that builds its translated bundles (see translation_memory)."""
+    update_survey_status(survey_id, "Deployed")
+    question_library.accept_survey(json_path)
+    job_ui.start_translation_job(survey_id, json_path, get_session_config())
+
 def render_survey_form(survey_data, respondent_id, t):
     st.header(f"Survey: {survey_data['title']}")
     try:
@@ -905,22 +882,30 @@ def render_survey_form(survey_data, respondent_id, t):
         st.error("Survey JSON file not found.")
         return
 
+    # Translated texts come from the bundle built at deploy; answers keep the English question as key
+    bundle = translation_memory.load_bundle(survey_data['id'], st.session_state.get('language'))
+    if bundle and len(bundle['questions']) != len(questions):
+        bundle = None
+    shown_questions = bundle['questions'] if bundle else questions
+    labels = bundle['labels'] if bundle else translation_memory.FORM_LABELS
+
     with st.form(f"survey_form_{respondent_id}"):
         answers = {}
-        for q in questions:
-            question_text, q_type, description = q.get('question', ''), q.get('type', ''), q.get('description', '')
+        for q, shown in zip(questions, shown_questions):
+            question_text, q_type, description = q.get('question', ''), q.get('type', ''), shown.get('description', '')
             if any(kw in question_text.lower() for kw in ['name', 'gender', 'address']):
                 continue
-            st.subheader(question_text)
+            st.subheader(shown.get('question') or question_text)
             if description: st.caption(description)
             if q_type == 'yes/no':
-                answers[question_text] = st.radio("Select:", ["Yes", "No"], key=question_text, horizontal=True)
+                answers[question_text] = st.radio(labels['select'], ["Yes", "No"], key=question_text, horizontal=True,
+                                                  format_func=lambda option: labels[option.lower()])
             elif q_type == 'rating_1_10':
-                answers[question_text] = st.slider("Rating:", 1, 10, 5, key=question_text)
+                answers[question_text] = st.slider(labels['rating'], 1, 10, 5, key=question_text)
             else:
-                answers[question_text] = st.text_area("Answer:", key=question_text)
+                answers[question_text] = st.text_area(labels['answer'], key=question_text)
             st.markdown("---")
-        if st.form_submit_button("Submit Survey"):
+        if st.form_submit_button(labels['submit']):
             save_answers(respondent_id, answers)
             # Award random coins between 500-900
             coins_earned = random.randint(500, 900)
@@ -980,7 +965,7 @@ def render_data_quality(t):
                     with st.spinner("Step 1/2: Identifying key columns for summary..."):
                         all_columns = ", ".join(df_clean.columns)
                         prompt1 = f"From this list of survey columns, identify the 4 most insightful for a summary. Respond with only a comma-separated list of column names. Columns: {all_columns}"
-                        key_columns_str = generate_with_llm(prompt1)
+                        key_columns_str = generate_with_llm(prompt1, purpose="key_columns")
                         if not key_columns_str:
                             raise Exception("Failed to identify key columns")
                         key_columns = [col.strip() for col in key_columns_str.split(',') if col.strip() in df_clean.columns]
@@ -992,10 +977,8 @@ def render_data_quality(t):
                         
                         data_sample = df_clean[key_columns].head(20).to_string()
                         prompt2 = f"Analyze the following key data from a survey and provide a brief, high-level summary of the findings:\n\n{data_sample}"
-                        summary = generate_with_llm(prompt2)
-                        if summary:
-                            st.success(summary)
-                        else:
+                        summary = st.write_stream(stream_with_llm(prompt2, purpose="summary"))
+                        if not summary:
                             st.error("Failed to generate summary")
 
                 except Exception as e:
@@ -1024,7 +1007,7 @@ def render_settings(t):
 
 def logout():
     """Clears the session state to log the user out."""
-    for key in ['logged_in', 'role', 'username', 'language', 'csv_editing_stage', 'editable_df', 'survey_name', 'query']:
+    for key in ['logged_in', 'role', 'username', 'language', 'active_job_id', 'active_job_view', 'csv_editing_stage', 'editable_df', 'survey_name', 'survey_description', 'survey_classifications', 'query']:
         if key in st.session_state:
             del st.session_state[key]
     st.rerun()
@@ -396,7 +396,6 @@ import numpy as np
 from gtts import gTTS
 import json
 import sqlite3
-import requests
 import io
 import time
 import uuid
@@ -407,6 +406,10 @@ import hashlib
 import shutil
 from pathlib import Path
 import google.generativeai as genai
+import http_client
+import llm_backend
+import survey_generation
+import translation_memory
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -418,7 +421,6 @@ if not GOOGLE_API_KEY or GOOGLE_API_KEY == "YOUR_API_KEY_HERE":
     st.error("Please set GOOGLE_API_KEY in your .env file")
     st.stop()
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-3-flash-preview")
 
 # --- PROJECT SETUP & CONFIG ---
 # Create necessary directories
@@ -486,9 +488,10 @@ def text_to_speech(text, lang='en', slow=False):
             return None
 
 
-def generate_survey_script(questions_json, script_path):
+def generate_survey_script(questions_json, script_path, config):
     """
-    Generates a full conversational script from survey questions.
+    Generates a full conversational script from survey questions with the
+    session's LLM config.
     """
     script = []
     progress_bar = st.progress(0, text="Generating conversational script...")
@@ -496,29 +499,11 @@ def generate_survey_script(questions_json, script_path):
     for i, question_data in enumerate(questions_json):
         progress_bar.progress((i + 1) / len(questions_json), text=f"Generating script for question {i+1}/{len(questions_json)}...")
         try:
-            prompt = f"""
-            Create a JSON object for a conversational survey with three keys: "say", "explain", "question_key".
-            "say": A friendly way to ask the question.
-            "explain": A more detailed explanation.
-            "question_key": The original question text.
-            The output must be a single, valid JSON object.
-            Question Details: {json.dumps(question_data)}
-            """
-            response = model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Extract JSON from markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            script_part = json.loads(response_text)
-            if all(k in script_part for k in ["say", "explain", "question_key"]):
-                script.append(script_part)
-            else:
-                raise ValueError("LLM response missing keys.")
+            script_part = config.backend("script").generate_json(
+                survey_generation.build_script_suffix(question_data), survey_generation.SCRIPT_SCHEMA,
+                purpose="script", prefix=survey_generation.SCRIPT_PROMPT_PREFIX
+            )
+            script.append(script_part)
         except (ValueError, json.JSONDecodeError, Exception) as e:
             st.warning(f"Failed to generate script for a question ({e}). Using default.")
             script.append({
@@ -532,7 +517,7 @@ def generate_survey_script(questions_json, script_path):
         json.dump(script, f, indent=4)
     return script
 
-def extract_answer_from_text(question, text):
+def extract_answer_from_text(question, text, config):
     """Uses an LLM to extract a concise answer from transcribed text."""
     try:
         prompt = f"""
@@ -545,8 +530,9 @@ def extract_answer_from_text(question, text):
         User's Response: "{text}"
         Extracted Answer:
         """
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return config.backend("answer_extraction").generate(
+            prompt, purpose="answer_extraction", use_cache=False
+        )
     except Exception as e:
         st.warning(f"LLM extraction failed: {e}. Using raw text.")
         return text
@@ -610,6 +596,9 @@ def initialize_session_state():
     """Initializes all necessary session state variables."""
     if 'page' not in st.session_state:
         st.session_state.page = "setup"
+    if 'llm_config' not in st.session_state:
+        # Per session; LLM_MODE / OLLAMA_MODEL only provide the default
+        st.session_state.llm_config = llm_backend.LLMConfig.from_env()
     if 'survey_paused' not in st.session_state:
         st.session_state.survey_paused = False
     if 'avatar_state' not in st.session_state:
@@ -641,7 +630,7 @@ def render_setup_page():
                 'name': name, 'language': language,
                 'selected_survey': survey_options[selected_survey_title],
                 'session_id': str(uuid.uuid4()), 'page': 'survey',
-                'current_step': 0, 'recorded_answers': []
+                'current_step': 0, 'recorded_answers': [], 'script_notice': None
             })
             initialize_session_state() # Ensure all states are set for the new survey
 
@@ -655,11 +644,18 @@ def render_setup_page():
                 else:
                     json_path = st.session_state.selected_survey['json_path']
                     questions_json = json.loads(Path(json_path).read_text(encoding='utf-8'))
-                    script = generate_survey_script(questions_json, str(script_path))
+                    script = generate_survey_script(questions_json, str(script_path), st.session_state.llm_config)
 
                 if not script:
                     st.error("Could not load or generate the survey script.")
                     return
+                # Script translated at deploy (question_key stays English, so answers are saved alike)
+                bundle = translation_memory.load_bundle(survey_id, language)
+                if bundle and len(bundle['script']) == len(script):
+                    script = bundle['script']
+                elif language != translation_memory.SOURCE_LANGUAGE:
+                    # Not deployed yet, or its translations are still being (re)built
+                    st.session_state.script_notice = "The translated survey script is not ready yet, so the questions are asked in English."
 
                 st.session_state.script = script
                 with st.spinner("Preparing survey audio..."):
@@ -695,6 +691,9 @@ def render_survey_page():
     current_step_data = script[step_index]
     question_to_say = current_step_data['say']
 
+    if st.session_state.get('script_notice'):
+        st.warning(st.session_state.script_notice)
+
     # --- Main Display (CSS handles layout) ---
     st.subheader(f"Question {step_index + 1}/{len(script)}")
     
@@ -773,7 +772,7 @@ def render_processing_page():
             question_key = st.session_state.script[i]['question_key']
             result = model.transcribe(audio_path, fp16=False)
             transcribed_text = result["text"].strip()
-            extracted_answer = extract_answer_from_text(question_key, transcribed_text)
+            extracted_answer = extract_answer_from_text(question_key, transcribed_text, st.session_state.llm_config)
             final_answers[question_key] = extracted_answer
         except Exception as e:
             st.error(f"Could not process answer {i+1}: {e}")
@@ -788,7 +787,7 @@ def render_processing_page():
         with st.spinner("Submitting..."):
             try:
                 api_url = f"http://127.0.0.1:8000/submit/{st.session_state.selected_survey['id']}"
-                response = requests.post(api_url, json=final_answers)
+                response = http_client.post(api_url, json=final_answers)
                 response.raise_for_status()
                 st.success("Results submitted successfully!")
             except Exception as e:
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+import requests
+
+import llm_backend
+
+# --- BLUEPRINT INDEX CONFIGURATION ---
+# Past generate_survey_design results are embedded with a local Ollama model
+# so near-identical queries (same scheme, different district, ...) can reuse
+# an earlier blueprint instead of running the pipeline again.
+BLUEPRINT_INDEX_PATH = os.getenv("BLUEPRINT_INDEX_PATH", "blueprint_index.db")
+BLUEPRINT_INDEX_ENABLED = os.getenv("BLUEPRINT_INDEX_ENABLED", "1") != "0"
+BLUEPRINT_EMBED_MODEL = os.getenv("BLUEPRINT_EMBED_MODEL", "embeddinggemma:latest")
+BLUEPRINT_REUSE_THRESHOLD = float(os.getenv("BLUEPRINT_REUSE_THRESHOLD", "0.92"))
+BLUEPRINT_INDEX_MAX_ENTRIES = int(os.getenv("BLUEPRINT_INDEX_MAX_ENTRIES", "5000"))
+# embeddinggemma expects a task prefix; symmetric query-to-query matching uses this one.
+EMBED_PREFIX = "task: sentence similarity | query: "
+# After a failed embedding call (e.g. Ollama not running) skip the index for a while.
+UNAVAILABLE_RETRY_SECONDS = 60
+# Longest wait for the query's embedding when a survey is submitted; a slower
+# (e.g. still loading) embedding model just means no match, and the job starts.
+BLUEPRINT_LOOKUP_TIMEOUT = float(os.getenv("BLUEPRINT_LOOKUP_TIMEOUT", "3"))
+
+_lock = threading.Lock()
+_conn = None
+_matrix = None          # unit-length embeddings, one row per stored blueprint
+_row_ids = []
+_unavailable_until = 0.0
+_recent_embeddings = {}  # query -> vector, so indexing a just-searched query needs no second call
+_stats = {"lookups": 0, "matches": 0, "added": 0, "embed_failures": 0, "embed_timeouts": 0, "reused": 0}
+
+
+def _get_connection():
+    """Opens (once per process) the SQLite store and creates the table."""
+    global _conn
+    if _conn is None:
+        db_dir = os.path.dirname(BLUEPRINT_INDEX_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _conn = sqlite3.connect(BLUEPRINT_INDEX_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS blueprints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_query TEXT NOT NULL,
+                embed_model TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                blueprint TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+
+def _load_matrix():
+    """Loads every stored embedding for the current model into memory (once)."""
+    global _matrix, _row_ids
+    if _matrix is not None:
+        return
+    rows = _get_connection().execute(
+        "SELECT id, embedding FROM blueprints WHERE embed_model = ? ORDER BY id", (BLUEPRINT_EMBED_MODEL,)
+    ).fetchall()
+    _row_ids = [row_id for row_id, _ in rows]
+    if rows:
+        _matrix = np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+    else:
+        _matrix = np.zeros((0, 0), dtype=np.float32)
+
+
+def _embed(query, timeout=(2, 30)):
+    """
+    Unit-length embedding of a query, or None if the embedding model is
+    unavailable or does not answer within timeout ((connect, read) seconds).
+    """
+    global _unavailable_until
+    with _lock:
+        cached = _recent_embeddings.get(query)
+        if cached is not None:
+            return cached
+        if time.time() < _unavailable_until:
+            return None
+    # The embedding call itself runs without the lock.
+    try:
+        backend = llm_backend.get_backend("offline", BLUEPRINT_EMBED_MODEL)
+        vector = np.asarray(backend.embed([EMBED_PREFIX + query], timeout=timeout)[0], dtype=np.float32)
+    except (llm_backend.LLMError, KeyError, IndexError, ValueError) as e:
+        if isinstance(e.__cause__, requests.exceptions.ReadTimeout):
+            # Reachable but slow (e.g. loading the model): try again on the next call
+            with _lock:
+                _stats["embed_timeouts"] += 1
+            print(f"Blueprint index embedding timed out after {timeout[1]}s")
+            return None
+        with _lock:
+            _unavailable_until = time.time() + UNAVAILABLE_RETRY_SECONDS
+            _stats["embed_failures"] += 1
+        print(f"Blueprint index unavailable: {e}")
+        return None
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return None
+    vector = vector / norm
+    with _lock:
+        if len(_recent_embeddings) >= 64:
+            _recent_embeddings.pop(next(iter(_recent_embeddings)))
+        _recent_embeddings[query] = vector
+    return vector
+
+
+def find_similar(query, threshold=None):
+    """
+    Returns (similarity, blueprint) for the most similar stored query if its
+    cosine similarity is at least threshold (BLUEPRINT_REUSE_THRESHOLD), else None.
+    blueprint has user_query, classifications, description, excel_headings, model_used.
+    Called while the user waits, so the embedding gets at most BLUEPRINT_LOOKUP_TIMEOUT.
+    """
+    if not BLUEPRINT_INDEX_ENABLED or not query.strip():
+        return None
+    threshold = BLUEPRINT_REUSE_THRESHOLD if threshold is None else threshold
+    vector = _embed(query, timeout=(1, BLUEPRINT_LOOKUP_TIMEOUT))
+    if vector is None:
+        return None
+    with _lock:
+        _stats["lookups"] += 1
+        _load_matrix()
+        if not len(_row_ids) or _matrix.shape[1] != vector.shape[0]:
+            return None
+        scores = _matrix @ vector
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        if similarity < threshold:
+            return None
+        row = _get_connection().execute(
+            "SELECT blueprint FROM blueprints WHERE id = ?", (_row_ids[best],)
+        ).fetchone()
+        _stats["matches"] += 1
+    return (round(similarity, 4), json.loads(row[0])) if row else None
+
+
+def add_blueprint(query, response_data):
+    """Indexes a finished (error-free, non-empty) blueprint. Never raises."""
+    global _matrix
+    if not BLUEPRINT_INDEX_ENABLED or response_data.get("error") or not response_data.get("excel_headings"):
+        return
+    vector = _embed(query)
+    if vector is None:
+        return
+    blueprint = {
+        "user_query": query,
+        "classifications": response_data.get("classifications", {}),
+        "description": response_data.get("description", ""),
+        "excel_headings": response_data.get("excel_headings", []),
+        "model_used": response_data.get("model_used"),
+    }
+    try:
+        with _lock:
+            _load_matrix()
+            conn = _get_connection()
+            # Re-running the same query replaces its previous blueprint.
+            conn.execute("DELETE FROM blueprints WHERE user_query = ? AND embed_model = ?", (query, BLUEPRINT_EMBED_MODEL))
+            cursor = conn.execute(
+                "INSERT INTO blueprints (user_query, embed_model, embedding, blueprint, created_at) VALUES (?, ?, ?, ?, ?)",
+                (query, BLUEPRINT_EMBED_MODEL, vector.astype(np.float32).tobytes(),
+                 json.dumps(blueprint, ensure_ascii=False), time.time())
+            )
+            conn.execute(
+                "DELETE FROM blueprints WHERE id NOT IN (SELECT id FROM blueprints ORDER BY id DESC LIMIT ?)",
+                (BLUEPRINT_INDEX_MAX_ENTRIES,)
+            )
+            conn.commit()
+            _stats["added"] += 1
+            # Rebuild lazily on the next lookup (rows may have been replaced or trimmed).
+            _matrix = None
+    except sqlite3.Error as e:
+        print(f"Could not index blueprint: {e}")
+        return
+    print(f"Indexed blueprint {cursor.lastrowid} for '{query}'")
+
+
+def add_blueprint_async(query, response_data):
+    """
+    add_blueprint in a background thread, so finishing a survey design never
+    waits for the embedding. Not a daemon thread: a command-line run still
+    indexes its blueprint before the process exits.
+    """
+    threading.Thread(target=add_blueprint, args=(query, dict(response_data)), name="blueprint-index-add").start()
+
+
+def record_reuse():
+    """Counts a stored blueprint that the user accepted."""
+    with _lock:
+        _stats["reused"] += 1
+
+
+def get_index_stats():
+    """Lookup / match / reuse counters for this process plus the number of stored blueprints."""
+    with _lock:
+        stats = dict(_stats)
+        try:
+            stats["entries"] = _get_connection().execute("SELECT COUNT(*) FROM blueprints").fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = None
+    return stats
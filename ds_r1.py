@@ -1,12 +1,20 @@
 
 import sys
-import requests
 import json
 from datetime import datetime
 import os
 import csv
 import re
+import time
+import uuid
 import google.generativeai as genai
+import json_extract
+import llm_backend
+import prompt_log
+import llm_concurrency
+import llm_streaming
+import taxonomy
+import blueprint_index
 
 # Configure Google Generative AI
 # Get API key from environment variable (set by app.py)
@@ -15,16 +23,36 @@ if not GOOGLE_API_KEY:
     print("ERROR: GOOGLE_API_KEY not found. Please ensure app.py is setting it from Streamlit secrets.")
     sys.exit(1)
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-3-flash-preview")
 
 # Ollama configuration for offline mode
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "gemma2"
 
+# Stream tokens from the LLM as they arrive (set LLM_STREAMING=0 to disable).
+# JSON stages stop reading as soon as a complete JSON value has been received.
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") != "0"
+
 # Load classification data from JSON
 with open("json_data/classify.json", "r", encoding="utf-8") as f:
     CLASSIFY_DATA = json.load(f)
 
+# JSON schemas for the structured-output stages (also used to validate the replies).
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "classifications": {
+            "type": "object",
+            "properties": {
+                category: {"type": "string", "enum": list(options)}
+                for category, options in CLASSIFY_DATA.items()
+            },
+            "required": list(CLASSIFY_DATA),
+        },
+    },
+    "required": ["classifications"],
+}
+HEADINGS_SCHEMA = {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 1}
+
 # UTF-8 support for Windows
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
@@ -33,51 +61,23 @@ if sys.platform == "win32":
 os.makedirs("survey_responses", exist_ok=True)
 os.makedirs("prompt_logs", exist_ok=True)
 
-# --- OLLAMA HELPER FUNCTIONS FOR OFFLINE MODE ---
-
-def query_ollama(prompt, model_name="gemma2"):
-    """Query Ollama API for offline mode."""
-    try:
-        response = requests.post(
-            OLLAMA_API_URL,
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if response.status_code == 200:
-            return response.json().get("response", "")
-        else:
-            print(f"Ollama API error: {response.status_code}")
-            return None
-    except requests.exceptions.ConnectionError:
-        print("Cannot connect to Ollama. Please ensure Ollama is running with 'ollama serve' and the model 'gemma2' is installed.")
-        return None
-    except Exception as e:
-        print(f"Ollama query error: {e}")
-        return None
-
-def get_llm_mode():
-    """Get the current LLM mode from environment variable."""
-    return os.environ.get('LLM_MODE', 'online')
-
 def get_timestamp():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
-def log_prompt(prompt, model_name, purpose):
-    """Log all prompts with timestamps"""
+def log_prompt(prompt, model_name, purpose, **telemetry):
+    """
+    Log a prompt with timestamp plus any telemetry fields (latency_ms, ttft_ms,
+    prompt_tokens, ...). LLM calls made through llm_backend are logged
+    automatically with full telemetry; use this for anything else.
+    """
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "model": model_name,
         "purpose": purpose,
-        "prompt": prompt
+        "prompt": prompt,
+        **telemetry
     }
-    
-    log_filename = f"prompt_logs/prompts_{datetime.now().strftime('%Y%m%d')}.jsonl"
-    with open(log_filename, "a", encoding="utf-8") as log_file:
-        log_file.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+    prompt_log.log_record(log_entry)
 
 def generate_filename_base(user_query):
     """Generate filename base from query text"""
@@ -94,25 +94,6 @@ def save_response(data, filename):
         json.dump(data, f, indent=2, ensure_ascii=False)
     print(f"Saved response to {filename}")
 
-def extract_json_from_response(response_text):
-    """Robust JSON extraction from LLM response"""
-    try:
-        if '```json' in response_text:
-            start = response_text.index('```json') + len('```json')
-            end = response_text.index('```', start)
-            json_str = response_text[start:end].strip()
-        elif '```' in response_text:
-            start = response_text.index('```') + len('```')
-            end = response_text.index('```', start)
-            json_str = response_text[start:end].strip()
-        else:
-            json_str = response_text.strip()
-        
-        return json.loads(json_str)
-    except (ValueError, json.JSONDecodeError) as e:
-        print(f"JSON extraction error: {e}")
-        return None
-
 def generate_classification_prompt(user_query):
     prompt = f"""
 Classify this survey query: "{user_query}"
@@ -151,41 +132,9 @@ RULES:
 """
     return prompt
 
-def get_variable_examples(classifications):
-    """Get relevant variable examples from classification data"""
-    examples = []
-    
-    # Get level-based examples
-    level = classifications.get("level_based")
-    if level and level in CLASSIFY_DATA["level_based"]:
-        examples.extend(CLASSIFY_DATA["level_based"][level]["data_variables"][:3])
-    
-    # Get methodology-based examples
-    method = classifications.get("methodology_based")
-    if method and method in CLASSIFY_DATA["methodology_based"]:
-        examples.extend(CLASSIFY_DATA["methodology_based"][method]["data_variables"][:3])
-    
-    # Get sectoral examples
-    sector = classifications.get("sectoral")
-    if sector and sector in CLASSIFY_DATA["sectoral"]:
-        sector_data = CLASSIFY_DATA["sectoral"][sector]["data_variables"]
-        if isinstance(sector_data, dict):
-            # Flatten nested structure
-            for sublist in sector_data.values():
-                examples.extend(sublist[:2])
-        else:
-            examples.extend(sector_data[:5])
-    
-    # Get purpose-based examples
-    purpose = classifications.get("purpose_based")
-    if purpose and purpose in CLASSIFY_DATA["purpose_based"]:
-        examples.extend(CLASSIFY_DATA["purpose_based"][purpose]["data_variables"][:3])
-    
-    return examples[:15]  # Return top 15 examples
-
 def generate_headings_prompt(user_query, classifications):
-    # Get relevant variable examples
-    variable_examples = get_variable_examples(classifications)
+    # Variables from the taxonomy index that best match the query, then the classified options' examples
+    variable_examples = taxonomy.get_index().relevant_variables(user_query, classifications)
     
     # Get survey purpose description
     purpose_desc = ""
@@ -267,106 +216,191 @@ Output ONLY the description text.
 """
     return prompt
 
-def query_llm(prompt, model_name="gemini-3-flash-preview", purpose=""):
-    # Log the prompt with timestamp
-    log_prompt(prompt, model_name, purpose)
-    
-    # Check mode and query appropriate LLM
-    mode = get_llm_mode()
-    
-    if mode == 'offline':
-        print(f"Querying Ollama (Offline Mode) for {purpose}...")
-        response_text = query_ollama(prompt, OLLAMA_MODEL)
-        if response_text is None:
-            raise Exception("Ollama query failed. Please ensure Ollama is running.")
-        return response_text
+def get_query_backend(model_name, purpose, config):
+    """
+    Backend for config (llm_backend.LLMConfig) and purpose: the purpose's
+    routed model (llm_routing), else the config's model, falling back to
+    OLLAMA_MODEL offline / model_name online.
+    """
+    if config.mode == 'offline':
+        backend = config.backend(purpose, OLLAMA_MODEL)
+        print(f"Querying Ollama (Offline Mode, {backend.model_name}) for {purpose}...")
+        return backend
+    backend = config.backend(purpose, model_name)
+    print(f"Querying Gemini (Online Mode, {backend.model_name}) for {purpose}...")
+    return backend
+
+def query_llm(prompt, model_name="gemini-3-flash-preview", purpose="", use_cache=True,
+              json_output=False, on_text=None, schema=None, *, config):
+    """
+    Queries the LLM backend of config. With streaming enabled, on_text(text_so_far)
+    is called as tokens arrive and json_output stages stop at the first complete
+    JSON object/array instead of waiting for the full response. schema switches
+    the backend to structured (JSON) output.
+    """
+    # The backend logs the prompt with telemetry
+    backend = get_query_backend(model_name, purpose, config)
+    try:
+        if LLM_STREAMING:
+            tokens = backend.stream(prompt, purpose=purpose, use_cache=use_cache, json_output=json_output, schema=schema)
+            response_text = llm_streaming.collect_stream(tokens, on_text=on_text).strip()
+        else:
+            response_text = backend.generate(prompt, purpose=purpose, use_cache=use_cache, schema=schema)
+    except llm_backend.LLMError as e:
+        raise Exception(str(e))
+    if not response_text:
+        raise Exception(f"{backend.label} returned an empty response.")
+    return response_text
+
+def query_llm_json(prompt, schema, model_name="gemini-3-flash-preview", purpose="", *, config):
+    """
+    Queries the LLM in structured-output mode and returns the schema-valid JSON
+    value. Unusable replies are dropped from the cache and regenerated up to
+    json_extract.JSON_MAX_RETRIES times before giving up.
+    """
+    for attempt in range(json_extract.JSON_MAX_RETRIES + 1):
+        response_text = query_llm(prompt, model_name, purpose=purpose, schema=schema, config=config)
+        value = json_extract.parse_json(response_text, schema, purpose)
+        if value is not None:
+            return value
+        get_query_backend(model_name, purpose, config).invalidate(prompt, purpose, schema)
+        if attempt < json_extract.JSON_MAX_RETRIES:
+            json_extract.record_retry(purpose)
+    raise ValueError(f"Failed to extract valid {purpose} JSON")
+
+def run_timed_stage(timings, stage, prompt, model_name, on_text=None, schema=None, *, config):
+    """
+    Runs one LLM stage (purpose == stage name) and records its wall-clock time.
+    Stages with a schema return the parsed JSON value instead of text.
+    """
+    start = time.perf_counter()
+    try:
+        if schema:
+            return query_llm_json(prompt, schema, model_name, purpose=stage, config=config)
+        return query_llm(prompt, model_name, purpose=stage, on_text=on_text, config=config)
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 3)
+
+def write_headings_csv(excel_headings, csv_filename):
+    """Writes the CSV template (headings + 5 empty rows), or an empty file if there are no headings."""
+    if excel_headings:
+        with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(excel_headings)
+            for _ in range(5):
+                writer.writerow([''] * len(excel_headings))
+        print(f"\nCreated CSV template: {csv_filename}")
     else:
-        # Query the Gemini API (Online Mode)
-        print(f"Querying Gemini (Online Mode) for {purpose}...")
-        try:
-            response = model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            raise Exception(f"Gemini API error: {str(e)}")
-
-def generate_survey_design(user_query, model_name="gemini-3-flash-preview", save_output=True):
-    # Ensure survey_responses directory exists
-    os.makedirs("survey_responses", exist_ok=True)
-    
-    # Create placeholder files immediately to ensure they exist
-    # These will be overwritten with actual content later
-    with open("survey_responses/data.txt", 'w', encoding='utf-8') as f:
-        f.write("Generating survey description...")
-    with open("survey_responses/data.csv", 'w', newline='', encoding='utf-8') as f:
-        f.write("")
-    
-    # Generate filename base using the prediction model
-    filename_base = generate_filename_base(user_query)
-    timestamp = datetime.now().strftime("%H%M%S")
-    unique_id = "data"
-    
+        # Create empty CSV if no headings
+        with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
+            csvfile.write("")
+        print(f"\nCreated empty CSV template: {csv_filename}")
+
+def new_job_id(user_query=""):
+    """Unique ID for one blueprint generation; its artifacts are survey_responses/<job_id>.{txt,csv,json}."""
+    base = generate_filename_base(user_query).lower() or "survey"
+    return f"{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+def save_job_artifacts(response_data):
+    """Writes a finished job's description (.txt), CSV template and full result (.json) once."""
+    job_id = response_data["job_id"]
+    txt_filename = f"survey_responses/{job_id}.txt"
+    with open(txt_filename, 'w', encoding='utf-8') as file:
+        file.write(response_data["description"])
+    response_data["files"]["txt"] = txt_filename
+    csv_filename = f"survey_responses/{job_id}.csv"
+    write_headings_csv(response_data["excel_headings"], csv_filename)
+    response_data["files"]["csv"] = csv_filename
+    json_filename = f"survey_responses/{job_id}.json"
+    response_data["files"]["json"] = json_filename
+    save_response(response_data, json_filename)
+
+def reuse_blueprint(user_query, blueprint, similarity=None, save_output=True, job_id=None):
+    """
+    Uses a stored blueprint (a blueprint_index match) for a new query instead of
+    running the pipeline. Returns the same response_data as generate_survey_design.
+    """
     response_data = {
+        "job_id": job_id or new_job_id(user_query),
+        "timestamp": datetime.now().isoformat(),
+        "user_query": user_query,
+        "classifications": blueprint.get("classifications", {}),
+        "description": blueprint.get("description", ""),
+        "excel_headings": blueprint.get("excel_headings", []),
+        "model_used": blueprint.get("model_used"),
+        "reused_from": {"user_query": blueprint.get("user_query"), "similarity": similarity},
+        "timings": {"total": 0.0},
+        "files": {}
+    }
+    if save_output:
+        os.makedirs("survey_responses", exist_ok=True)
+        save_job_artifacts(response_data)
+    print(f"Reused blueprint of '{blueprint.get('user_query')}' for '{user_query}'")
+    return response_data
+
+def generate_survey_design(user_query, model_name="gemini-3-flash-preview", save_output=True, on_description_text=None,
+                           job_id=None, *, config):
+    """
+    Runs the blueprint pipeline (classification -> description + headings) as
+    one job. The description and headings are returned in memory; with
+    save_output the job's artifacts are written once to
+    survey_responses/<job_id>.{txt,csv,json}, so concurrent jobs never share a
+    file. on_description_text(text_so_far) receives the description as it
+    streams in. config (llm_backend.LLMConfig) selects the backend for every
+    stage.
+    """
+    response_data = {
+        "job_id": job_id or new_job_id(user_query),
         "timestamp": datetime.now().isoformat(),
         "user_query": user_query,
         "classifications": {},
         "description": "",
         "excel_headings": [],
-        "model_used": model_name,
+        "model_used": config.model or (OLLAMA_MODEL if config.mode == 'offline' else model_name),
+        "timings": {},
         "files": {}
     }
+    job_id = response_data["job_id"]
+    timings = response_data["timings"]
+    pipeline_start = time.perf_counter()
+    if save_output:
+        os.makedirs("survey_responses", exist_ok=True)
     
     try:
-        # 1. Generate classifications
+        # 1. Generate classifications (locally when the query is unambiguous)
         print("\nGenerating classifications...")
-        classification_prompt = generate_classification_prompt(user_query)
-        classification_response = query_llm(
-            classification_prompt, 
-            model_name,
-            purpose="classification"
-        )
-        classification_data = extract_json_from_response(classification_response)
-        
-        if not classification_data:
-            raise ValueError("Failed to extract valid classification JSON")
-            
-        classifications = classification_data.get("classifications", {})
+        classification_start = time.perf_counter()
+        classifications = taxonomy.fast_classify(user_query)
+        if classifications is not None:
+            timings["classification"] = round(time.perf_counter() - classification_start, 6)
+            response_data["classification_source"] = "local"
+            print("Classification answered by the local taxonomy classifier")
+        else:
+            classification_prompt = generate_classification_prompt(user_query)
+            classification_data = run_timed_stage(
+                timings, "classification", classification_prompt, model_name, schema=CLASSIFICATION_SCHEMA, config=config
+            )
+            classifications = classification_data["classifications"]
+            response_data["classification_source"] = "llm"
         response_data["classifications"] = classifications
         print("\nClassification Results:")
         print(json.dumps(classifications, indent=2, ensure_ascii=False))
         
-        # 2. Generate description using LLM
-        print("\nGenerating description...")
-        description_prompt = generate_description_prompt(user_query, classifications)
-        response_data["description"] = query_llm(
-            description_prompt, 
-            model_name,
-            purpose="description"
-        ).strip()
-        print(f"\n{response_data['description']}")
-        with open("survey_responses/data.txt", 'w', newline='', encoding='utf-8') as file:
-            file.write(response_data["description"])
-            
-
-        # 3. Generate Excel headings
-        print("\nGenerating Excel headings...")
-        headings_prompt = generate_headings_prompt(user_query, classifications)
-        headings_response = query_llm(
-            headings_prompt, 
-            model_name,
-            purpose="headings"
+        # 2 & 3. Description and Excel headings depend only on the classification,
+        # so both prompts run concurrently.
+        print("\nGenerating description and Excel headings...")
+        stage_prompts = [
+            ("description", generate_description_prompt(user_query, classifications), on_description_text, None),
+            ("headings", generate_headings_prompt(user_query, classifications), None, HEADINGS_SCHEMA)
+        ]
+        description_response, excel_headings = llm_concurrency.run_concurrently(
+            lambda stage: run_timed_stage(timings, stage[0], stage[1], model_name, on_text=stage[2], schema=stage[3], config=config),
+            stage_prompts,
+            llm_concurrency.backend_for_mode(config.mode)
         )
-        
-        # Extract JSON array from response
-        headings_str = headings_response.strip()
-        if headings_str.startswith('[') and headings_str.endswith(']'):
-            excel_headings = json.loads(headings_str)
-        else:
-            start = headings_str.find('[')
-            end = headings_str.find(']', start) + 1
-            if start != -1 and end != 0:
-                excel_headings = json.loads(headings_str[start:end])
-            else:
-                excel_headings = []
+
+        response_data["description"] = description_response.strip()
+        print(f"\n{response_data['description']}")
         
         response_data["excel_headings"] = excel_headings[:15]
         print("\nGenerated Excel Headings:")
@@ -374,62 +408,33 @@ def generate_survey_design(user_query, model_name="gemini-3-flash-preview", save
             print(f"{i}. {heading}")
 
         # 4. Save results
+        timings["total"] = round(time.perf_counter() - pipeline_start, 3)
         if save_output:
-            json_filename = f"survey_responses/{unique_id}.json"
-            save_response(response_data, json_filename)
-            response_data["files"]["json"] = json_filename
-            
-            # Always create CSV file, even if headings are empty
-            csv_filename = f"survey_responses/{unique_id}.csv"
-            if response_data["excel_headings"]:
-                with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerow(response_data["excel_headings"])
-                    for _ in range(5):
-                        writer.writerow([''] * len(response_data["excel_headings"]))
-                response_data["files"]["csv"] = csv_filename
-                print(f"\nCreated CSV template: {csv_filename}")
-            else:
-                # Create empty CSV if no headings
-                with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    csvfile.write("")
-                response_data["files"]["csv"] = csv_filename
-                print(f"\nCreated empty CSV template: {csv_filename}")
+            save_job_artifacts(response_data)
+        blueprint_index.add_blueprint_async(user_query, response_data)
+        print("\nStage timings (s): " + ", ".join(f"{k}={v}" for k, v in timings.items()))
 
         print("\n" + "="*50)
         print(f"SURVEY DESIGN COMPLETE FOR: '{user_query}'")
-        print(f"Files saved with base name: {unique_id}")
+        print(f"Job ID: {job_id}")
         print("="*50)
 
     except Exception as e:
         error_msg = f"Error: {str(e)}"
         print(error_msg)
         response_data["error"] = error_msg
-        
-        # Ensure files are created even on error
-        try:
-            # Create data.txt with error message
-            with open("survey_responses/data.txt", 'w', encoding='utf-8') as file:
-                file.write(f"Error generating survey: {error_msg}")
-            
-            # Create data.csv with error message
-            with open("survey_responses/data.csv", 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(["Error"])
-                writer.writerow([error_msg])
-        except Exception as file_error:
-            print(f"Failed to create error files: {str(file_error)}")
+        timings["total"] = round(time.perf_counter() - pipeline_start, 3)
         
         # Save error information
         if save_output:
-            error_filename = f"survey_responses/error_{unique_id}.json"
+            error_filename = f"survey_responses/error_{job_id}.json"
             save_response(response_data, error_filename)
         
     return response_data
 
 def main():
     user_query = input("Enter your survey query: ").strip()
-    generate_survey_design(user_query)
+    generate_survey_design(user_query, config=llm_backend.LLMConfig.from_env())
     
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@ import streamlit as st
 import pandas as pd
 import json
 import os
-import requests
 import time
 from datetime import datetime
 import hashlib
@@ -13,6 +12,14 @@ import plotly.express as px
 import google.generativeai as genai
 from supabase import create_client, Client
 import ds_r1 , adhr
+import blueprint_index
+import llm_backend
+import taxonomy
+import ollama_manager
+import job_queue
+import job_ui
+import question_library
+import translation_memory
 import random 
 
 
@@ -31,7 +38,6 @@ if not GOOGLE_API_KEY or GOOGLE_API_KEY == "YOUR_API_KEY_HERE":
     st.stop()
 
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-3-flash-preview")
 
 # Set API key in environment for child modules
 os.environ['GOOGLE_API_KEY'] = GOOGLE_API_KEY
@@ -46,7 +52,6 @@ except (KeyError, FileNotFoundError):
     st.stop()
 
 # Ollama configuration for offline mode
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "gemma2"
 
 # --- Import your custom functions ---
@@ -63,10 +68,10 @@ except ImportError as e:
     st.error(f"Import error: {e}")
     # This allows the app to run without the files for initial setup.
     # A proper error will be shown if the user tries to generate a survey.
-    def generate_survey_design(query):
+    def generate_survey_design(query, **kwargs):
         st.error("`ds_r1.py` not found. Please add it to the project directory.")
         return None
-    def extract_and_process(image_path):
+    def extract_and_process(image_path, config):
         st.error("`adhr.py` not found. Please add it to the project directory.")
         return None
 
@@ -76,6 +81,8 @@ os.makedirs("uploads", exist_ok=True)
 os.makedirs("survey_jsons", exist_ok=True)
 os.makedirs("shareable_forms", exist_ok=True)
 os.makedirs("survey_scripts", exist_ok=True) # Directory for new script format
+# Resume survey generation jobs interrupted by a restart
+job_queue.start_workers()
 DB_NAME = "survey_portal.db"
 CONFIG_FILE = "json_data/config.json"
 LANG_FILE = "json_data/lang.json"
@@ -95,49 +102,32 @@ def load_translations():
 
 TRANSLATIONS = load_translations()
 
-# --- OLLAMA HELPER FUNCTIONS FOR OFFLINE MODE ---
+# --- LLM HELPER FUNCTIONS (ONLINE / OFFLINE) ---
 
-def query_ollama(prompt, model_name=None):
-    """Query Ollama API for offline mode."""
-    # Use selected model from session state, fallback to gemma3:latest
-    if model_name is None:
-        model_name = st.session_state.get('ollama_model', 'gemma3:latest')
-    
+def get_session_config():
+    """LLM config (mode and Ollama model) selected in this session; passed to every LLM entry point and job."""
+    if st.session_state.get('llm_mode', 'online') == 'offline':
+        return llm_backend.LLMConfig('offline', st.session_state.get('ollama_model', 'gemma3:latest'))
+    return llm_backend.LLMConfig('online')
+
+def get_session_backend(purpose=""):
+    """LLM backend for this session's config, routed by purpose."""
+    return get_session_config().backend(purpose)
+
+def generate_json_with_llm(prompt, schema, purpose="", use_cache=True, prefix=None):
+    """Parsed, schema-valid JSON from the selected LLM, or None (with the error shown) on failure."""
     try:
-        response = requests.post(
-            OLLAMA_API_URL,
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if response.status_code == 200:
-            return response.json().get("response", "")
-        else:
-            st.error(f"Ollama API error: {response.status_code}")
-            return None
-    except requests.exceptions.ConnectionError:
-        st.error(f"Cannot connect to Ollama. Please ensure Ollama is running with 'ollama serve' and the model '{model_name}' is installed.")
-        return None
-    except Exception as e:
-        st.error(f"Ollama query error: {e}")
+        return get_session_backend(purpose).generate_json(prompt, schema, purpose=purpose, use_cache=use_cache, prefix=prefix)
+    except llm_backend.LLMError as e:
+        st.error(str(e))
         return None
 
-def generate_with_llm(prompt):
-    """Generate content using the selected LLM (online or offline)."""
-    mode = st.session_state.get('llm_mode', 'online')
-    
-    if mode == 'offline':
-        return query_ollama(prompt)
-    else:
-        try:
-            response = model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            st.error(f"Gemini API error: {e}")
-            return None
+def stream_with_llm(prompt, purpose="", use_cache=True):
+    """
+    Yields response tokens from the selected LLM as they arrive (for
+    st.write_stream); the "chat" purpose routes to the large model (Gemini Pro online).
+    """
+    return get_session_backend(purpose).stream(prompt, purpose=purpose, use_cache=use_cache)
 
 # --- 1. CONFIG AND DATABASE MANAGEMENT ---
 
@@ -353,115 +343,43 @@ def get_survey_results(survey_id):
 
 
 # --- 2. CORE BACKEND FUNCTIONS ---
-def create_unique_survey_name(query: str) -> str:
-    base_name = query.split()[0].lower().strip().replace("'", "")
-    return f"{base_name}_{int(time.time())}"
-
-def create_survey_json_iteratively(survey_name: str):
-    try:
-        with open(f"survey_responses/{survey_name}.txt", "r", encoding='utf-8') as f:
-            survey_description = f.read().strip()
-        df = pd.read_csv(f"survey_responses/{survey_name}.csv")
-    except FileNotFoundError as e:
-        st.error(f"Error: Design file not found: {e}.")
-        return None, None
-
-    survey_questions = []
-    progress_bar = st.progress(0, text="Initializing LLM...")
-    for i, header in enumerate(df.columns):
-        progress_text = f"Generating question for '{header}'... ({i+1}/{len(df.columns)})"
-        st.toast(progress_text)
-        progress_bar.progress((i + 1) / len(df.columns), text=progress_text)
-
-        try:
-            prompt = f"""Given a survey about '{survey_description}', generate a JSON object for a single survey question based on the data field '{header}'. The JSON object must have ONLY three keys: "question", "description", and "type" (choose from 'text', 'yes/no', or 'rating_1_10')."""
-            response = model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Extract JSON from markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            question_json = json.loads(response_text)
-
-            if all(k in question_json for k in ["question", "description", "type"]):
-                survey_questions.append(question_json)
-            else:
-                st.warning(f"LLM returned incomplete data for '{header}'. Using a default question.")
-                survey_questions.append({"question": header.replace('_', ' ').title(), "description": "Please provide your input for this question.", "type": "text"})
-        except Exception as e:
-            st.error(f"Failed to connect to Google Gemini API. Error: {e}")
-            return None, None
-        except (json.JSONDecodeError, Exception) as e:
-            st.warning(f"Could not generate a valid question for '{header}': {e}. Using a default question.")
-            survey_questions.append({"question": header.replace('_', ' ').title(), "description": "Please provide your input for this question.", "type": "text"})
-
-    progress_bar.empty()
-    json_path = os.path.join("survey_jsons", f"{survey_name}.json")
-    with open(json_path, "w", encoding='utf-8') as f:
-        json.dump(survey_questions, f, indent=2, ensure_ascii=False)
-    return json_path, survey_description
-
-def create_conversational_script(survey_id, survey_name):
-    """Generates a conversational script and saves it using the survey ID."""
-    original_json_path = os.path.join("survey_jsons", f"{survey_name}.json")
-    script_json_path = os.path.join("survey_scripts", f"script_{survey_id}.json")
-
-    try:
-        with open(original_json_path, 'r', encoding='utf-8') as f:
-            questions = json.load(f)
-    except Exception as e:
-        st.error(f"Could not read original survey JSON: {e}")
-        return None, None
-
-    script = []
-    progress_bar = st.progress(0, text="Initializing script generation...")
-    for i, question_data in enumerate(questions):
-        progress_text = f"Generating script for question {i+1}/{len(questions)}..."
-        st.toast(progress_text)
-        progress_bar.progress((i + 1) / len(questions), text=progress_text)
-
-        try:
-            prompt = f"""
-            You are creating a single step for a conversational survey. Based on the following question details, create a JSON object with three keys:
-            1. "say": A friendly, conversational way to ask this question.
-            2. "explain": A slightly more detailed explanation of the question if the user asks for one.
-            3. "question_key": The original question text to use as a key for saving the answer.
-            The final output must be a single, valid JSON object for this one question.
-            Question Details: {json.dumps(question_data)}
-            """
-            response = model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Extract JSON from markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
-            
-            script_part = json.loads(response_text)
-
-            if all(k in script_part for k in ["say", "explain", "question_key"]):
-                script.append(script_part)
-            else:
-                raise ValueError("LLM response did not contain required keys.")
-        except (ValueError, json.JSONDecodeError, Exception) as e:
-            st.warning(f"Failed to generate script for a question ({e}). Using default format.")
-            script.append({
-                "say": question_data['question'],
-                "explain": question_data.get('description', 'No further details.'),
-                "question_key": question_data['question']
-            })
-
-    progress_bar.empty()
-    with open(script_json_path, "w", encoding='utf-8') as f:
-        json.dump(script, f, indent=2, ensure_ascii=False)
-
-    return script_json_path, script
+def open_job(job):
+    """Restores the creation step after a job's latest finished stage from its checkpoints."""
+    checkpoints = job["checkpoints"]
+    st.session_state.active_job_id = job["job_id"]
+    st.session_state.active_job_view = (job["stage"], job["status"])
+    if job["stage"] == "blueprint":
+        job_ui.open_blueprint_for_editing(job["query"], checkpoints["blueprint"])
+        return
+    questions = checkpoints["questions"]
+    description = checkpoints["blueprint"]["description"]
+    survey_id = job["params"].get("survey_id")
+    if survey_id is None:
+        survey_id = add_survey(
+            title=job["query"].split('.')[0],
+            description=description,
+            status='Draft',
+            json_path=questions["json_path"]
+        )
+        if survey_id is not None:
+            job_queue.set_params(job["job_id"], survey_id=survey_id)
+    if "script" not in checkpoints and questions.get("script"):
+        # Fused mode: the script steps came with the questions, so write the script right away
+        job_queue.advance(job["job_id"], "script", survey_id=survey_id)
+        st.session_state.pop('active_job_view', None)
+        st.rerun()
+    st.session_state.survey_name = job["job_id"]
+    st.session_state.query = job["query"]
+    st.session_state.survey_id = survey_id
+    st.session_state.json_path = questions["json_path"]
+    st.session_state.description = description
+    st.session_state.question_warnings = questions["warnings"]
+    if "script" in checkpoints:
+        st.session_state.script_path = checkpoints["script"]["script_path"]
+        st.session_state.script_data = checkpoints["script"]["script"]
+    st.session_state.csv_editing_stage = False
+    st.session_state.question_review_stage = True
+    st.rerun()
 
 # --- Shareable Form Generation (HTML Only) ---
 def generate_html_form(survey_details):
@@ -610,7 +528,6 @@ def render_dashboard(t):
                         type="primary" if current_mode == 'online' else "secondary",
                         use_container_width=True):
                 st.session_state.llm_mode = 'online'
-                os.environ['LLM_MODE'] = 'online'
                 st.success("✅ Switched to Online Mode (Gemini API)")
                 time.sleep(0.5)
                 st.rerun()
@@ -620,7 +537,9 @@ def render_dashboard(t):
                         type="primary" if current_mode == 'offline' else "secondary",
                         use_container_width=True):
                 st.session_state.llm_mode = 'offline'
-                os.environ['LLM_MODE'] = 'offline'
+                offline_model = st.session_state.get('ollama_model', 'gemma3:latest')
+                # Start loading the model now so the first generation does not pay for it
+                ollama_manager.start_warm_up(offline_model)
                 st.success("✅ Switched to Offline & Secure Mode (Ollama)")
                 time.sleep(0.5)
                 st.rerun()
@@ -656,10 +575,21 @@ def render_dashboard(t):
             )
             
             if selected_model != st.session_state.ollama_model:
+                previous_model = st.session_state.ollama_model
                 st.session_state.ollama_model = selected_model
-                os.environ['OLLAMA_MODEL'] = selected_model
+                ollama_manager.switch_model(previous_model, selected_model)
                 st.success(f"✅ Model changed to: {selected_model}")
                 st.rerun()
+            
+            # Keep the selected model resident while the dashboard is in use
+            ollama_manager.start_warm_up(st.session_state.ollama_model)
+            ollama_manager.warm_up_routed_models()
+            col_state, col_refresh = st.columns([4, 1])
+            with col_state:
+                st.caption(ollama_manager.describe_state(st.session_state.ollama_model))
+            with col_refresh:
+                if st.button("🔄 Check", key="ollama_state_refresh"):
+                    st.rerun()
         
         # Display current mode status with animation
         mode_emoji = "🌐" if current_mode == 'online' else "🔒"
@@ -667,6 +597,8 @@ def render_dashboard(t):
         st.markdown(f'<div class="mode-status">{mode_emoji} Current Mode: {mode_text}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
         
+        job_ui.render_llm_performance(current_mode == 'offline')
+        
         st.markdown("---")
     
     try:
@@ -802,6 +734,10 @@ def render_user_dashboard(t):
 def render_survey_management(t):
     st.title(f"📝 {t['nav_survey_management']}")
 
+    # --- Background survey job: follow progress, or show the step its last stage finished ---
+    if job_ui.render_active_job(open_job):
+        return
+
     # --- STAGE 1: CSV Editing ---
     if st.session_state.get('csv_editing_stage', False):
         st.subheader("Step 2: Review and Edit Survey Columns")
@@ -832,28 +768,32 @@ def render_survey_management(t):
                         st.session_state.editable_df = df
                         st.rerun()
 
+        # Typeahead suggestions from the taxonomy index (no LLM call)
+        st.subheader("Suggested Columns")
+        column_search = st.text_input("Search variables", placeholder="e.g. income, crop, toilet", key="column_search")
+        suggestions = taxonomy.suggest_columns(
+            column_search or st.session_state.query, exclude=st.session_state.editable_df.columns,
+            classifications=st.session_state.get('survey_classifications')
+        )
+        if suggestions:
+            suggested = st.selectbox("Suggestions", options=suggestions, key="column_suggestion")
+            if st.button("➕ Add Suggested Column"):
+                df = st.session_state.editable_df
+                df[suggested] = ""
+                st.session_state.editable_df = df
+                st.rerun()
+        else:
+            st.caption("No matching variables in the taxonomy.")
+
         st.markdown("---")
         if st.button("✅ Confirm Columns & Generate Questions", type="primary"):
             final_df = st.session_state.editable_df
             survey_name = st.session_state.survey_name
             final_df.to_csv(f"survey_responses/{survey_name}.csv", index=False)
-            with st.spinner("Building survey questions with AI..."):
-                json_path, description = create_survey_json_iteratively(survey_name)
-
-            if json_path:
-                with st.spinner("Saving initial survey draft..."):
-                    new_survey_id = add_survey(
-                        title=st.session_state.query.split('.')[0],
-                        description=description,
-                        status='Draft',
-                        json_path=json_path
-                    )
-                st.session_state.survey_id = new_survey_id
-                st.session_state.json_path = json_path
-                st.session_state.description = description
-                st.session_state.csv_editing_stage = False
-                st.session_state.question_review_stage = True
-                st.rerun()
+            job_queue.advance(survey_name, "questions", columns=list(final_df.columns))
+            st.session_state.csv_editing_stage = False
+            st.session_state.pop('active_job_view', None)
+            st.rerun()
 
     # --- STAGE 2: Question Review and Script Generation ---
     elif st.session_state.get('question_review_stage', False):
@@ -861,6 +801,8 @@ def render_survey_management(t):
         json_path = st.session_state.json_path
         with open(json_path, 'r', encoding='utf-8') as f:
             questions = json.load(f)
+        for warning in st.session_state.get('question_warnings', []):
+            st.warning(warning)
 
         col1, col2 = st.columns(2)
         with col1:
@@ -875,17 +817,9 @@ def render_survey_management(t):
             st.markdown("#### Conversational Script")
             if 'script_data' not in st.session_state:
                 if st.button("Generate Conversational Script"):
-                    with st.spinner("Generating script... this may take a moment."):
-                        script_path, script_data = create_conversational_script(
-                            survey_id=st.session_state.survey_id,
-                            survey_name=st.session_state.survey_name
-                        )
-                        if script_path and script_data:
-                            # Script saved locally in survey_scripts folder
-                            st.session_state.script_path = script_path
-                            st.session_state.script_data = script_data
-                            st.success(f"Script saved to {script_path}")
-                            st.rerun()
+                    # Runs in the background; the script is shown once the job's script stage finishes
+                    job_queue.advance(st.session_state.survey_name, "script", survey_id=st.session_state.survey_id)
+                    st.rerun()
             else:
                 with st.container(height=400):
                     for s in st.session_state.script_data:
@@ -895,12 +829,23 @@ def render_survey_management(t):
 
         st.markdown("---")
         st.subheader("Finalize Survey")
-        if st.button("✅ Finish and Return to List", type="primary"):
-            st.success("🎉 Survey creation process complete!")
-            for key in ['csv_editing_stage', 'editable_df', 'survey_name', 'query', 'question_review_stage', 'json_path', 'description', 'script_path', 'script_data', 'survey_id']:
-                if key in st.session_state:
-                    del st.session_state[key]
-            st.rerun()
+        col_edit, col_finish = st.columns(2)
+        with col_edit:
+            if st.button("✏️ Edit Columns"):
+                # Back to the column editor; on confirm only new or renamed columns are regenerated
+                columns = job_queue.get_job(st.session_state.survey_name)["params"]["columns"]
+                st.session_state.editable_df = pd.DataFrame([[""] * len(columns)] * 5, columns=columns)
+                for key in ['script_path', 'script_data', 'question_warnings']:
+                    st.session_state.pop(key, None)
+                st.session_state.question_review_stage = False
+                st.session_state.csv_editing_stage = True
+                st.rerun()
+        with col_finish:
+            if st.button("✅ Finish and Return to List", type="primary"):
+                st.success("🎉 Survey creation process complete!")
+                job_queue.finish(st.session_state.survey_name)
+                question_library.accept_survey(st.session_state.json_path)
+                job_ui.close_job_view()
 
     # --- STAGE 0: Initial Creation Form ---
     else:
@@ -909,21 +854,19 @@ def render_survey_management(t):
                 query = st.text_area(t['generate_survey_prompt'], height=150)
                 if st.form_submit_button(t['generate_survey_button']):
                     if query.strip():
-                        with st.spinner("Generating Survey Blueprint..."):
-                            generate_survey_design(query)
-                        survey_name = create_unique_survey_name(query)
-                        try:
-                            os.rename("survey_responses/data.csv", f"survey_responses/{survey_name}.csv")
-                            os.rename("survey_responses/data.txt", f"survey_responses/{survey_name}.txt")
-                            st.session_state.editable_df = pd.read_csv(f"survey_responses/{survey_name}.csv")
-                            st.session_state.survey_name = survey_name
-                            st.session_state.query = query
-                            st.session_state.csv_editing_stage = True
+                        # Near-identical earlier query: offer its blueprint first
+                        match = blueprint_index.find_similar(query)
+                        if match:
+                            similarity, blueprint = match
+                            st.session_state.blueprint_match = {"query": query, "similarity": similarity, "blueprint": blueprint}
                             st.rerun()
-                        except FileNotFoundError:
-                            st.error("Error: Your function did not create 'data.csv' or 'data.txt'.")
+                        job_ui.start_survey_job(query, get_session_config())
                     else:
                         st.error("Please enter survey requirements.")
+            if 'blueprint_match' in st.session_state:
+                job_ui.render_blueprint_match(get_session_config())
+
+        job_ui.render_job_list()
 
         st.markdown("---")
         st.header(t['existing_surveys_header'])
@@ -939,8 +882,8 @@ def render_survey_management(t):
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
                     if st.button("🚀 Deploy", key=f"deploy_{selected_id}"):
-                        update_survey_status(selected_id, "Deployed")
-                        st.success(f"Survey {selected_id} has been deployed.")
+                        deploy_survey(selected_id, df_surveys[df_surveys['id'] == selected_id].iloc[0]['json_path'])
+                        st.success(f"Survey {selected_id} has been deployed; its translations are being built in the background.")
                         st.rerun()
                 with col2:
                     survey_details = df_surveys[df_surveys['id'] == selected_id].iloc[0].to_dict()
@@ -1055,7 +998,7 @@ def render_take_survey(t):
         with open(image_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
         with st.spinner("Processing Aadhaar card..."):
-            extract_and_process(image_path)
+            extract_and_process(image_path, get_session_config())
         try:
             with open("aadhaar_output.json", "r", encoding='utf-8') as f:
                 aadhaar_data = json.load(f)
@@ -1074,6 +1017,12 @@ def render_take_survey(t):
         except Exception as e:
             st.error(f"Failed to process Aadhaar data: {e}")
 
+def deploy_survey(survey_id, json_path):
+    """Marks the survey deployed and queues the job that builds its translated bundles (see translation_memory)."""
+    update_survey_status(survey_id, "Deployed")
+    question_library.accept_survey(json_path)
+    job_ui.start_translation_job(survey_id, json_path, get_session_config())
+
 def render_survey_form(survey_data, respondent_id, t):
     st.header(f"Survey: {survey_data['title']}")
     try:
@@ -1083,22 +1032,30 @@ def render_survey_form(survey_data, respondent_id, t):
         st.error("Survey JSON file not found.")
         return
 
+    # Translated texts come from the bundle built at deploy; answers keep the English question as key
+    bundle = translation_memory.load_bundle(survey_data['id'], st.session_state.get('language'))
+    if bundle and len(bundle['questions']) != len(questions):
+        bundle = None
+    shown_questions = bundle['questions'] if bundle else questions
+    labels = bundle['labels'] if bundle else translation_memory.FORM_LABELS
+
     with st.form(f"survey_form_{respondent_id}"):
         answers = {}
-        for q in questions:
-            question_text, q_type, description = q.get('question', ''), q.get('type', ''), q.get('description', '')
+        for q, shown in zip(questions, shown_questions):
+            question_text, q_type, description = q.get('question', ''), q.get('type', ''), shown.get('description', '')
             if any(kw in question_text.lower() for kw in ['name', 'gender', 'address']):
                 continue
-            st.subheader(question_text)
+            st.subheader(shown.get('question') or question_text)
             if description: st.caption(description)
             if q_type == 'yes/no':
-                answers[question_text] = st.radio("Select:", ["Yes", "No"], key=question_text, horizontal=True)
+                answers[question_text] = st.radio(labels['select'], ["Yes", "No"], key=question_text, horizontal=True,
+                                                  format_func=lambda option: labels[option.lower()])
             elif q_type == 'rating_1_10':
-                answers[question_text] = st.slider("Rating:", 1, 10, 5, key=question_text)
+                answers[question_text] = st.slider(labels['rating'], 1, 10, 5, key=question_text)
             else:
-                answers[question_text] = st.text_area("Answer:", key=question_text)
+                answers[question_text] = st.text_area(labels['answer'], key=question_text)
             st.markdown("---")
-        if st.form_submit_button("Submit Survey"):
+        if st.form_submit_button(labels['submit']):
             save_answers(respondent_id, answers)
             # Award random coins between 500-900
             coins_earned = random.randint(500, 900)
@@ -1116,6 +1073,28 @@ def render_user_management(t):
     else:
         st.info("No users found.")
 
+VISUALIZATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "visualizations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["pie", "bar", "line", "table"]},
+                    "title": {"type": "string"},
+                    "column": {"type": "string"},
+                    "x_column": {"type": "string"},
+                    "y_column": {"type": "string"},
+                    "columns": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["type", "title"],
+            },
+        },
+    },
+    "required": ["visualizations"],
+}
+
 @st.cache_data(ttl=3600)  # Cache for 1 hour
 def generate_visualization_config(survey_id, columns_json):
     """Generate visualization configuration using Gemini LLM and cache it."""
@@ -1157,16 +1136,9 @@ Data columns:
 
 Return ONLY the JSON object, no markdown formatting, no explanation."""
 
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Extract JSON from response
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in response_text:
-            response_text = response_text.split('```')[1].split('```')[0].strip()
-        
-        viz_config = json.loads(response_text)
+        viz_config = generate_json_with_llm(prompt, VISUALIZATION_SCHEMA, purpose="visualization_config", use_cache=False)
+        if viz_config is None:
+            raise ValueError("LLM did not return a valid visualization config")
         return viz_config
     except Exception as e:
         st.error(f"Error generating visualization config: {e}")
@@ -1324,40 +1296,37 @@ def render_data_quality(t):
             if st.button("📊 Summarize Data", key=f"summarize_{survey_id}"):
                 prompt = f"Summarize the key findings from this survey data:\n\n{df_clean.head(20).to_string()}"
                 st.session_state[chat_key].append({"role": "user", "content": "Summarize the survey data"})
-                with st.spinner("Analyzing..."):
-                    try:
-                        ai_model = genai.GenerativeModel(model_name="gemini-3-pro-preview")
-                        response = ai_model.generate_content(prompt)
-                        st.session_state[chat_key].append({"role": "assistant", "content": response.text})
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error: {e}")
+                try:
+                    with st.chat_message("assistant", avatar="🤖"):
+                        answer = st.write_stream(stream_with_llm(prompt, purpose="chat", use_cache=False))
+                    st.session_state[chat_key].append({"role": "assistant", "content": answer})
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error: {e}")
         
         with col2:
             if st.button("📈 Key Insights", key=f"insights_{survey_id}"):
                 prompt = f"Identify the top 3 key insights from this survey data:\n\n{df_clean.describe().to_string()}\n\nSample data:\n{df_clean.head(10).to_string()}"
                 st.session_state[chat_key].append({"role": "user", "content": "What are the key insights?"})
-                with st.spinner("Analyzing..."):
-                    try:
-                        ai_model = genai.GenerativeModel(model_name="gemini-3-pro-preview")
-                        response = ai_model.generate_content(prompt)
-                        st.session_state[chat_key].append({"role": "assistant", "content": response.text})
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error: {e}")
+                try:
+                    with st.chat_message("assistant", avatar="🤖"):
+                        answer = st.write_stream(stream_with_llm(prompt, purpose="chat", use_cache=False))
+                    st.session_state[chat_key].append({"role": "assistant", "content": answer})
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error: {e}")
         
         with col3:
             if st.button("🔍 Recommendations", key=f"recommendations_{survey_id}"):
                 prompt = f"Based on this survey data, provide actionable recommendations:\n\n{df_clean.head(20).to_string()}"
                 st.session_state[chat_key].append({"role": "user", "content": "Give me recommendations"})
-                with st.spinner("Analyzing..."):
-                    try:
-                        ai_model = genai.GenerativeModel(model_name="gemini-3-pro-preview")
-                        response = ai_model.generate_content(prompt)
-                        st.session_state[chat_key].append({"role": "assistant", "content": response.text})
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error: {e}")
+                try:
+                    with st.chat_message("assistant", avatar="🤖"):
+                        answer = st.write_stream(stream_with_llm(prompt, purpose="chat", use_cache=False))
+                    st.session_state[chat_key].append({"role": "assistant", "content": answer})
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error: {e}")
         
         # Display chat history
         if st.session_state[chat_key]:
@@ -1410,14 +1379,13 @@ Previous conversation:
 
 Answer the user's question based on the survey data above. Be specific, use data to support your answers, and provide actionable insights."""
                     
-                    with st.spinner("🤖 Sarvekshan AI is thinking..."):
-                        try:
-                            ai_model = genai.GenerativeModel(model_name="gemini-3-pro-preview")
-                            response = ai_model.generate_content(full_prompt)
-                            st.session_state[chat_key].append({"role": "assistant", "content": response.text})
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error: {e}")
+                    try:
+                        with st.chat_message("assistant", avatar="🤖"):
+                            answer = st.write_stream(stream_with_llm(full_prompt, purpose="chat", use_cache=False))
+                        st.session_state[chat_key].append({"role": "assistant", "content": answer})
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error: {e}")
                 else:
                     st.warning("Please enter a question")
         
@@ -1434,8 +1402,8 @@ def logout():
     """Clears the session state to log the user out."""
     keys_to_clear = [
         'logged_in', 'role', 'username', 'language',
-        'csv_editing_stage', 'editable_df', 'survey_name', 'query',
-        'question_review_stage', 'json_path', 'description',
+        'active_job_id', 'active_job_view', 'csv_editing_stage', 'editable_df', 'survey_name', 'survey_description', 'survey_classifications', 'query',
+        'question_review_stage', 'question_warnings', 'json_path', 'description',
         'script_path', 'script_data', 'survey_id'
     ]
     for key in keys_to_clear:
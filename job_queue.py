@@ -0,0 +1,489 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+import llm_backend
+import llm_concurrency
+import question_library
+import survey_generation
+import translation_memory
+
+# --- JOB QUEUE CONFIGURATION ---
+# Survey creation runs as a background job per survey: the blueprint, question
+# and script stages each run on a worker thread and store their result as a
+# checkpoint in SQLite, so a browser refresh or an app restart never loses a
+# finished stage and the Streamlit script run is never blocked on the LLM.
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "survey_jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often idle workers look for queued jobs (submit wakes them immediately).
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# A running job without a heartbeat for this long is considered orphaned (its
+# process died) and is queued again, at most JOB_MAX_ATTEMPTS times.
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# While a stage runs, its worker refreshes the job's updated_at this often, so
+# a long LLM call (retries, backoff, slow models) never looks stale.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+# Progress updates are written at most this often per job.
+PROGRESS_WRITE_INTERVAL = 1.0
+
+STAGES = ("blueprint", "questions", "script")
+# Single-stage job that builds a deployed survey's translated bundles.
+TRANSLATION_STAGE = "translation"
+# queued / running: a stage is pending or in progress; waiting: the last
+# requested stage finished and the job waits for the user; done / failed: final.
+ACTIVE_STATUSES = ("queued", "running")
+
+_lock = threading.Lock()
+_conn = None
+_wake = threading.Event()
+_workers = []
+
+
+class JobFailedError(RuntimeError):
+    """Raised by a stage whose result is unusable; the job is marked failed with this message."""
+
+
+def _get_connection():
+    """Opens (once per process) the shared SQLite connection and creates the tables."""
+    global _conn
+    if _conn is None:
+        db_dir = os.path.dirname(JOB_QUEUE_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _conn = sqlite3.connect(JOB_QUEUE_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                params TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                preview TEXT
+            )
+        """)
+        try:
+            # Databases created before the live preview column existed.
+            _conn.execute("ALTER TABLE jobs ADD COLUMN preview TEXT")
+        except sqlite3.OperationalError:
+            pass
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_checkpoints (
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, stage)
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at)")
+        _conn.commit()
+    return _conn
+
+
+def _row_to_job(row, checkpoints):
+    job_id, query, params, stage, status, progress, message, error, attempts, created_at, updated_at, preview = row
+    return {
+        "job_id": job_id, "query": query, "params": json.loads(params), "stage": stage,
+        "status": status, "progress": progress, "message": message, "error": error,
+        "attempts": attempts, "created_at": created_at, "updated_at": updated_at,
+        "preview": preview, "checkpoints": checkpoints,
+    }
+
+
+# --- PUBLIC API ---
+def submit(job_id, query, stage=STAGES[0], **params):
+    """
+    Queues a new job at stage (a survey job starts at the blueprint stage) and
+    returns its ID. params are stored with the job and passed to every stage
+    (the session's llm_backend.LLMConfig.to_params(), and optionally a stored
+    blueprint to reuse).
+    """
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT INTO jobs (job_id, query, params, stage, status, message, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', 'Waiting for a worker...', ?, ?)",
+            (job_id, query, json.dumps(params, ensure_ascii=False), stage, now, now)
+        )
+        conn.commit()
+    start_workers()
+    _wake.set()
+    return job_id
+
+
+def submit_translation(survey_id, json_path, **params):
+    """Queues a job that (re)builds the translated bundles of a deployed survey; returns its ID."""
+    return submit(
+        f"translate_{survey_id}_{int(time.time())}_{uuid.uuid4().hex[:6]}", f"Translations of survey {survey_id}",
+        stage=TRANSLATION_STAGE, survey_id=survey_id, json_path=json_path, **params
+    )
+
+
+def _translation_params(survey_id):
+    """Params of the survey's latest translation job (i.e. it was deployed), or None."""
+    with _lock:
+        rows = _get_connection().execute(
+            "SELECT params FROM jobs WHERE stage = ? ORDER BY created_at DESC", (TRANSLATION_STAGE,)
+        ).fetchall()
+    for (params,) in rows:
+        params = json.loads(params)
+        if params.get("survey_id") == survey_id:
+            return params
+    return None
+
+
+def advance(job_id, stage, **params):
+    """
+    Queues the next stage of a job with extra params (e.g. the confirmed
+    columns). Checkpoints of this and later stages are dropped, since they
+    were built from the previous inputs.
+    """
+    later_stages = STAGES[STAGES.index(stage):]
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT params FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown job '{job_id}'")
+        merged = {**json.loads(row[0]), **params}
+        conn.execute(
+            f"DELETE FROM job_checkpoints WHERE job_id = ? AND stage IN ({','.join('?' * len(later_stages))})",
+            (job_id, *later_stages)
+        )
+        conn.execute(
+            "UPDATE jobs SET params = ?, stage = ?, status = 'queued', progress = 0, message = 'Waiting for a worker...', "
+            "error = NULL, attempts = 0, updated_at = ? WHERE job_id = ?",
+            (json.dumps(merged, ensure_ascii=False), stage, time.time(), job_id)
+        )
+        conn.commit()
+    start_workers()
+    _wake.set()
+
+
+def retry(job_id):
+    """Queues a failed job's stage again; earlier stages resume from their checkpoints."""
+    _set_status(job_id, "queued", message="Waiting for a worker...", error=None, reset_attempts=True)
+    start_workers()
+    _wake.set()
+
+
+def finish(job_id):
+    """Marks a job as complete (the user is done with it)."""
+    _set_status(job_id, "done", message="Complete")
+
+
+def set_params(job_id, **params):
+    """Stores extra params on a job (e.g. the survey ID it was saved under)."""
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT params FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        conn.execute(
+            "UPDATE jobs SET params = ? WHERE job_id = ?",
+            (json.dumps({**json.loads(row[0]), **params}, ensure_ascii=False), job_id)
+        )
+        conn.commit()
+
+
+def get_job(job_id):
+    """The job with its params and stage checkpoints ({stage: result}), or None."""
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        checkpoints = {
+            stage: json.loads(result)
+            for stage, result in conn.execute(
+                "SELECT stage, result FROM job_checkpoints WHERE job_id = ?", (job_id,)
+            )
+        }
+    return _row_to_job(row, checkpoints)
+
+
+def list_jobs(statuses=None, limit=20):
+    """Most recently updated jobs (without checkpoints), optionally filtered by status."""
+    sql = "SELECT * FROM jobs"
+    args = []
+    if statuses:
+        sql += f" WHERE status IN ({','.join('?' * len(statuses))})"
+        args.extend(statuses)
+    sql += " ORDER BY updated_at DESC LIMIT ?"
+    args.append(limit)
+    with _lock:
+        rows = _get_connection().execute(sql, args).fetchall()
+    return [_row_to_job(row, {}) for row in rows]
+
+
+def get_queue_stats():
+    """Job counts by status plus the number of worker threads in this process."""
+    with _lock:
+        rows = _get_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    return {"workers": len(_workers), **{status: count for status, count in rows}}
+
+
+# --- WORKERS ---
+def _set_status(job_id, status, progress=None, message=None, error=None, reset_attempts=False, preview=None):
+    fields = ["status = ?", "updated_at = ?", "message = ?", "error = ?", "preview = ?"]
+    args = [status, time.time(), message, error, preview]
+    if progress is not None:
+        fields.append("progress = ?")
+        args.append(progress)
+    if reset_attempts:
+        fields.append("attempts = 0")
+    with _lock:
+        conn = _get_connection()
+        conn.execute(f"UPDATE jobs SET {', '.join(fields)} WHERE job_id = ?", (*args, job_id))
+        conn.commit()
+
+
+def _requeue_stale(conn):
+    """Queues running jobs whose worker stopped its heartbeat (e.g. the app was restarted)."""
+    cutoff = time.time() - JOB_STALE_SECONDS
+    conn.execute(
+        "UPDATE jobs SET status = 'failed', error = 'Job was interrupted too many times', updated_at = ? "
+        "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+        (time.time(), cutoff, JOB_MAX_ATTEMPTS)
+    )
+    conn.execute(
+        "UPDATE jobs SET status = 'queued', message = 'Resuming after an interruption...' "
+        "WHERE status = 'running' AND updated_at < ?",
+        (cutoff,)
+    )
+
+
+def _claim():
+    """Marks the oldest queued job as running and returns it, or None if there is none."""
+    with _lock:
+        conn = _get_connection()
+        _requeue_stale(conn)
+        conn.commit()
+        for (job_id,) in conn.execute(
+            "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY updated_at LIMIT 5"
+        ).fetchall():
+            # The status check makes the claim atomic across processes sharing the database.
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                "WHERE job_id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            ).rowcount
+            conn.commit()
+            if claimed:
+                break
+        else:
+            return None
+    return get_job(job_id)
+
+
+def _heartbeat(job_id, stop):
+    """Keeps a running job's updated_at fresh until stop is set."""
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            with _lock:
+                conn = _get_connection()
+                conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ? AND status = 'running'", (time.time(), job_id))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Job {job_id}: heartbeat failed: {e}")
+
+
+def _run(job):
+    job_id, stage = job["job_id"], job["stage"]
+    last_write = [0.0]
+
+    def report(progress, message, preview=None):
+        # preview is partial output (e.g. the streaming description) shown while the stage runs.
+        now = time.monotonic()
+        if now - last_write[0] >= PROGRESS_WRITE_INTERVAL or progress >= 1:
+            last_write[0] = now
+            _set_status(job_id, "running", progress=progress, message=message, preview=preview)
+
+    if stage in job["checkpoints"]:
+        # The stage finished before a restart interrupted the status update.
+        result = job["checkpoints"][stage]
+    else:
+        print(f"Job {job_id}: running stage '{stage}'")
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat), name=f"job-heartbeat-{job_id}", daemon=True).start()
+        try:
+            result = STAGE_HANDLERS[stage](job, report)
+        except Exception as e:
+            print(f"Job {job_id}: stage '{stage}' failed: {e}")
+            _set_status(job_id, "failed", message=f"Stage '{stage}' failed", error=str(e))
+            return
+        finally:
+            stop_heartbeat.set()
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO job_checkpoints (job_id, stage, result, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, stage, json.dumps(result, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+    status = "done" if stage in (STAGES[-1], TRANSLATION_STAGE) else "waiting"
+    _set_status(job_id, status, progress=1.0, message=f"Stage '{stage}' complete")
+
+
+def _worker_loop():
+    while True:
+        try:
+            job = _claim()
+        except sqlite3.Error as e:
+            print(f"Job queue error: {e}")
+            job = None
+        if job is None:
+            _wake.wait(JOB_POLL_SECONDS)
+            _wake.clear()
+            continue
+        _run(job)
+
+
+def start_workers():
+    """Starts the worker threads (once per process); interrupted jobs are picked up again."""
+    with _lock:
+        if _workers:
+            return
+        for i in range(max(1, JOB_WORKERS)):
+            worker = threading.Thread(target=_worker_loop, name=f"survey-job-worker-{i}", daemon=True)
+            _workers.append(worker)
+            worker.start()
+
+
+# --- SURVEY STAGES ---
+# Each stage takes (job, report) and returns a JSON-serialisable checkpoint.
+def _backend(params, purpose):
+    return llm_backend.LLMConfig.from_params(params).backend(purpose)
+
+
+def run_blueprint_stage(job, report):
+    """Classification, description and headings (or a reused stored blueprint) for the job's query."""
+    import ds_r1  # configures Gemini from GOOGLE_API_KEY on import, which the app sets first
+
+    params = job["params"]
+    report(0.05, "Designing the survey blueprint...")
+    if params.get("blueprint"):
+        response_data = ds_r1.reuse_blueprint(
+            job["query"], params["blueprint"], params.get("similarity"), job_id=job["job_id"]
+        )
+    else:
+        response_data = ds_r1.generate_survey_design(
+            job["query"],
+            on_description_text=lambda text: report(0.5, "Writing the survey description...", preview=text),
+            job_id=job["job_id"],
+            config=llm_backend.LLMConfig.from_params(params)
+        )
+    if response_data.get("error") or not response_data.get("excel_headings"):
+        raise JobFailedError(response_data.get("error") or "No survey columns were generated")
+    return response_data
+
+
+def run_questions_stage(job, report):
+    """
+    One question per confirmed column; writes survey_jsons/<job_id>.json.
+    Questions already in that file (from before a column edit) are reused,
+    then the question library fills recurring columns; only the rest reach
+    the LLM. In fused mode their script steps are kept in the checkpoint
+    ("script") for the script stage.
+    """
+    params = job["params"]
+    description = job["checkpoints"]["blueprint"]["description"]
+    json_path = os.path.join("survey_jsons", f"{job['job_id']}.json")
+    try:
+        with open(json_path, "r", encoding='utf-8') as f:
+            previous_questions = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        previous_questions = None
+    previous_columns = {q.get("column") for q in previous_questions or [] if isinstance(q, dict)}
+    sector = (job["checkpoints"]["blueprint"].get("classifications") or {}).get("sectoral")
+    library_questions = question_library.lookup(
+        [column for column in params["columns"] if column not in previous_columns], sector
+    )
+
+    def generate_fn(prompt, purpose="", use_cache=True, schema=None, prefix=None):
+        return _backend(params, purpose).generate(prompt, purpose=purpose, use_cache=use_cache, schema=schema, prefix=prefix)
+
+    questions, warnings = survey_generation.generate_questions(
+        params["columns"], description, generate_fn,
+        llm_concurrency.backend_for_mode(llm_backend.LLMConfig.from_params(params).mode),
+        on_progress=lambda done, total, message: report(done / total, message),
+        previous_questions=previous_questions,
+        library_questions=library_questions
+    )
+    questions, script = survey_generation.split_script_steps(questions)
+    os.makedirs("survey_jsons", exist_ok=True)
+    with open(json_path, "w", encoding='utf-8') as f:
+        json.dump(questions, f, indent=2, ensure_ascii=False)
+    result = {"json_path": json_path, "questions": questions, "warnings": warnings}
+    if any(script):
+        result["script"] = script
+    return result
+
+
+def run_script_stage(job, report):
+    """
+    Conversational script for the job's questions; writes
+    survey_scripts/script_<survey_id>.json. Steps generated together with the
+    questions (fused mode) or already in that file for an unchanged question
+    are used as-is; only the remaining questions get a script call.
+    """
+    params = job["params"]
+    questions = job["checkpoints"]["questions"]["questions"]
+    script = list(job["checkpoints"]["questions"].get("script") or [None] * len(questions))
+    script_path = os.path.join("survey_scripts", f"script_{params.get('survey_id') or job['job_id']}.json")
+    try:
+        with open(script_path, "r", encoding='utf-8') as f:
+            previous_steps = {s["question_key"]: s for s in json.load(f) if isinstance(s, dict) and s.get("question_key")}
+    except (OSError, json.JSONDecodeError, TypeError):
+        previous_steps = {}
+    for i, question_data in enumerate(questions):
+        if script[i] is None:
+            script[i] = previous_steps.get(question_data["question"])
+
+    def generate_json_fn(prompt, schema, purpose="", prefix=None):
+        return _backend(params, purpose).generate_json(prompt, schema, purpose=purpose, prefix=prefix)
+
+    missing = [i for i, step in enumerate(script) if step is None]
+    generated, warnings = survey_generation.generate_script(
+        [questions[i] for i in missing], generate_json_fn,
+        on_progress=lambda done, total, message: report(done / total, message)
+    )
+    for i, step in zip(missing, generated):
+        script[i] = step
+    os.makedirs("survey_scripts", exist_ok=True)
+    with open(script_path, "w", encoding='utf-8') as f:
+        json.dump(script, f, indent=2, ensure_ascii=False)
+    # A survey deployed before its script was (re)written needs its bundles rebuilt with the new script.
+    translation_params = params.get("survey_id") and _translation_params(params["survey_id"])
+    if translation_params:
+        submit_translation(**translation_params)
+    return {"script_path": script_path, "script": script, "warnings": warnings}
+
+
+def run_translation_stage(job, report):
+    """Translated bundles (see translation_memory) of the deployed survey params["survey_id"]."""
+    params = job["params"]
+    paths = translation_memory.build_bundles(
+        params["survey_id"], params["json_path"], _backend(params, "translation").generate_json,
+        on_progress=lambda done, total, message: report(done / total, message)
+    )
+    return {"bundles": paths}
+
+
+STAGE_HANDLERS = {
+    "blueprint": run_blueprint_stage,
+    "questions": run_questions_stage,
+    "script": run_script_stage,
+    TRANSLATION_STAGE: run_translation_stage,
+}
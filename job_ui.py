@@ -0,0 +1,217 @@
+import time
+import uuid
+
+import pandas as pd
+import streamlit as st
+
+import blueprint_index
+import http_client
+import job_queue
+import json_extract
+import llm_cache
+import llm_resilience
+import llm_routing
+import ollama_manager
+import ollama_pool
+import ollama_prefix
+import prompt_log
+import question_library
+import taxonomy
+import translation_memory
+
+# --- SURVEY JOB UI ---
+# Streamlit helpers shared by app.py and history.py to start survey jobs
+# (job_queue), follow their progress and reopen them. Each app supplies its
+# own open_job(job), which restores its creation step from the checkpoints.
+# Both dashboards also share the LLM performance panel at the end.
+
+# Session keys of the survey creation steps, cleared when a job view is closed.
+JOB_VIEW_KEYS = [
+    'active_job_id', 'active_job_view', 'csv_editing_stage', 'editable_df', 'survey_name', 'survey_description',
+    'survey_classifications', 'query', 'question_review_stage', 'question_warnings', 'json_path', 'description',
+    'script_path', 'script_data', 'survey_id',
+]
+
+
+def create_unique_survey_name(query: str) -> str:
+    """Job ID of a new survey; unique even for identical queries submitted at the same second."""
+    base_name = query.split()[0].lower().strip().replace("'", "")
+    return f"{base_name}_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+
+
+def start_survey_job(query, config, blueprint=None, similarity=None):
+    """
+    Queues a background job that designs the survey for query (or reuses a
+    stored blueprint) with the session's llm_backend.LLMConfig and follows it.
+    """
+    params = config.to_params()
+    if blueprint:
+        params.update(blueprint=blueprint, similarity=similarity)
+    st.session_state.active_job_id = job_queue.submit(create_unique_survey_name(query), query, **params)
+    st.session_state.pop('active_job_view', None)
+    st.rerun()
+
+
+def start_translation_job(survey_id, json_path, config):
+    """
+    Queues the background job that translates a deployed survey into the
+    other languages (rebuilt whenever its script stage finishes later on).
+    """
+    job_queue.submit_translation(survey_id, json_path, **config.to_params())
+
+
+def open_blueprint_for_editing(query, response_data):
+    """Opens the column editor on a job's in-memory description and headings."""
+    if not response_data or response_data.get("error") or not response_data.get("excel_headings"):
+        st.error(f"Error: Survey blueprint generation failed. {(response_data or {}).get('error', '')}")
+        return
+    headings = response_data["excel_headings"]
+    st.session_state.editable_df = pd.DataFrame([[""] * len(headings)] * 5, columns=headings)
+    st.session_state.survey_description = response_data["description"]
+    st.session_state.survey_classifications = response_data.get("classifications")
+    st.session_state.survey_name = response_data["job_id"]
+    st.session_state.query = query
+    st.session_state.csv_editing_stage = True
+    st.rerun()
+
+
+def close_job_view():
+    """Leaves the survey creation steps; the job itself keeps running (or stays resumable)."""
+    for key in JOB_VIEW_KEYS:
+        st.session_state.pop(key, None)
+    st.rerun()
+
+
+def render_job_progress(job):
+    """Progress of a queued or running job; polls until its current stage finishes."""
+    st.subheader(f"Generating survey: {job['query'][:80]}")
+    st.progress(min(max(job['progress'], 0.0), 1.0), text=f"{job['stage'].title()}: {job['message'] or ''}")
+    if job.get('preview'):
+        # Partial output of the running stage, e.g. the survey description as it streams in
+        st.markdown(job['preview'])
+    st.caption("Generation runs in the background. You can leave this page and reopen the job from the survey list later.")
+    if st.button("↩️ Back to Survey List", key="job_progress_back"):
+        close_job_view()
+    time.sleep(job_queue.JOB_POLL_SECONDS)
+    st.rerun()
+
+
+def render_failed_job(job):
+    st.error(f"Survey generation failed at the {job['stage']} stage: {job['error']}")
+    col_retry, col_back = st.columns(2)
+    with col_retry:
+        if st.button("🔁 Retry", type="primary", key="job_retry"):
+            job_queue.retry(job["job_id"])
+            st.rerun()
+    with col_back:
+        if st.button("↩️ Back to Survey List", key="job_failed_back"):
+            close_job_view()
+
+
+def render_active_job(open_job):
+    """
+    Follows the session's active job: its progress while a stage runs, the
+    retry view if it failed, else open_job(job) once per finished stage.
+    Returns True when the page should show nothing else.
+    """
+    job_id = st.session_state.get('active_job_id')
+    job = job_queue.get_job(job_id) if job_id else None
+    if job is None:
+        return False
+    if job['status'] in job_queue.ACTIVE_STATUSES:
+        render_job_progress(job)
+        return True
+    if job['status'] == 'failed':
+        render_failed_job(job)
+        return True
+    if st.session_state.get('active_job_view') != (job['stage'], job['status']):
+        open_job(job)
+    return False
+
+
+def render_job_list():
+    """
+    Survey jobs that are still running or waiting for the user, each with an
+    Open button; translation jobs (nothing to open) get a Retry button if they failed.
+    """
+    jobs = job_queue.list_jobs(statuses=("queued", "running", "waiting", "failed"))
+    if not jobs:
+        return
+    st.subheader("Surveys in Progress")
+    for job in jobs:
+        col_info, col_open = st.columns([4, 1])
+        with col_info:
+            st.write(f"**{job['query'][:80]}** | {job['stage']} | {job['status']}")
+            if job['status'] in job_queue.ACTIVE_STATUSES:
+                st.progress(min(max(job['progress'], 0.0), 1.0), text=job['message'] or "")
+        with col_open:
+            if job['stage'] == job_queue.TRANSLATION_STAGE:
+                if job['status'] == 'failed' and st.button("Retry", key=f"retry_job_{job['job_id']}"):
+                    job_queue.retry(job['job_id'])
+                    st.rerun()
+            elif st.button("Open", key=f"open_job_{job['job_id']}"):
+                st.session_state.active_job_id = job['job_id']
+                st.session_state.pop('active_job_view', None)
+                st.rerun()
+
+
+def render_blueprint_match(config):
+    """Offers the stored blueprint of a near-identical earlier query instead of regenerating."""
+    match = st.session_state.blueprint_match
+    blueprint = match["blueprint"]
+    st.info(f"♻️ A very similar survey was designed before ({match['similarity']:.0%} similar): \"{blueprint['user_query']}\"")
+    st.caption("Columns: " + ", ".join(blueprint.get("excel_headings", [])))
+    col_reuse, col_fresh = st.columns(2)
+    with col_reuse:
+        if st.button("♻️ Use this blueprint", type="primary", key="reuse_blueprint"):
+            del st.session_state.blueprint_match
+            blueprint_index.record_reuse()
+            start_survey_job(match["query"], config, blueprint, match["similarity"])
+    with col_fresh:
+        if st.button("🆕 Generate a new blueprint", key="fresh_blueprint"):
+            del st.session_state.blueprint_match
+            start_survey_job(match["query"], config)
+
+
+# --- LLM PERFORMANCE ---
+def render_llm_performance(offline):
+    """Expander with the process-wide LLM stats (cache, connections, jobs, fast paths, ...) for the dashboards."""
+    with st.expander("📈 LLM Performance"):
+        col_cache, col_http, col_log, col_resilience, col_taxonomy = st.columns(5)
+        with col_cache:
+            st.caption("Response cache")
+            st.json(llm_cache.get_cache_stats())
+        with col_http:
+            st.caption("HTTP connection pool")
+            st.json(http_client.get_http_stats())
+        with col_log:
+            st.caption("Prompt log writer")
+            st.json(prompt_log.get_log_stats())
+            st.caption("Survey job queue")
+            st.json(job_queue.get_queue_stats())
+        with col_resilience:
+            st.caption("Retries & circuit breakers")
+            st.json(llm_resilience.get_resilience_stats())
+            st.caption("Structured output (JSON parsing)")
+            st.json(json_extract.get_json_stats()["total"])
+        with col_taxonomy:
+            st.caption("Classification fast path")
+            st.json(taxonomy.get_fast_path_stats())
+            st.caption("Blueprint reuse index")
+            st.json(blueprint_index.get_index_stats())
+            st.caption("Question library")
+            st.json(question_library.get_library_stats())
+            st.caption("Translation memory")
+            st.json(translation_memory.get_translation_stats())
+            st.caption("Model routing (purpose -> model)")
+            st.json(llm_routing.get_routing_stats())
+        if offline:
+            st.caption("Models loaded in Ollama")
+            st.json([
+                {"host": m.get("host"), "name": m.get("name"), "expires_at": m.get("expires_at"), "size_vram": m.get("size_vram")}
+                for m in ollama_manager.get_loaded_models()
+            ])
+            st.caption("Ollama endpoint pool")
+            st.json(ollama_pool.get_pool_stats())
+            st.caption("Shared prompt prefix reuse")
+            st.json(ollama_prefix.get_prefix_stats())
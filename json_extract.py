@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import threading
+
+# --- STRUCTURED OUTPUT CONFIGURATION ---
+# Every JSON-producing LLM call is made in the backend's structured-output mode
+# (Gemini response_mime_type / Ollama "format" schema) and parsed here. A reply
+# that still fails to parse or validate is regenerated up to this many times.
+JSON_MAX_RETRIES = int(os.getenv("LLM_JSON_MAX_RETRIES", "1"))
+
+_decoder = json.JSONDecoder()
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\r?\n?(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"'})
+_PY_TYPES = {
+    "object": dict, "array": list, "string": str,
+    "integer": int, "number": (int, float), "boolean": bool,
+}
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+class JSONExtractError(ValueError):
+    """Raised when no JSON value of the expected type can be recovered from a response."""
+
+
+def _count(purpose, counter):
+    with _stats_lock:
+        counters = _stats.setdefault(purpose or "(none)", {
+            "parsed": 0, "repaired": 0, "parse_failures": 0, "validation_failures": 0, "retries": 0
+        })
+        counters[counter] += 1
+
+
+def _candidate_texts(text):
+    """The contents of the first ``` fence (the closing fence may be missing), then the whole text."""
+    match = _FENCE.search(text)
+    if match:
+        yield match.group(1)
+    yield text
+
+
+def _close_truncated(text):
+    """Closes the open strings / arrays / objects of a response that was cut off mid-value."""
+    stack = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _repairs(text):
+    """Progressively more invasive fixes for common LLM JSON mistakes."""
+    fixed = _TRAILING_COMMA.sub(r"\1", text.translate(_SMART_QUOTES))
+    yield fixed
+    yield _TRAILING_COMMA.sub(r"\1", _close_truncated(fixed))
+
+
+def extract_json(text, expect=None):
+    """
+    Returns (value, repaired) for the first JSON value in an LLM response,
+    skipping markdown fences and surrounding chatter. expect ("object" or
+    "array") restricts which value is picked up. Small defects (trailing
+    commas, smart quotes, a cut-off ending) are repaired. Raises
+    JSONExtractError if nothing usable is found.
+    """
+    if not text:
+        raise JSONExtractError("empty response")
+    openers = {"object": "{", "array": "["}.get(expect, "{[")
+    for candidate in _candidate_texts(text):
+        starts = [i for i, ch in enumerate(candidate) if ch in openers][:8]
+        for start in starts:
+            try:
+                return _decoder.raw_decode(candidate, start)[0], False
+            except json.JSONDecodeError:
+                pass
+            for repaired in _repairs(candidate[start:]):
+                try:
+                    return _decoder.raw_decode(repaired)[0], True
+                except json.JSONDecodeError:
+                    continue
+    raise JSONExtractError(f"no JSON {expect or 'value'} found in response")
+
+
+def _coerce(value, schema):
+    """Normalises enum strings to their canonical spelling (case / surrounding whitespace)."""
+    if isinstance(value, str) and schema.get("enum"):
+        wanted = value.strip().lower()
+        for option in schema["enum"]:
+            if isinstance(option, str) and option.lower() == wanted:
+                return option
+        return value
+    if isinstance(value, dict) and "properties" in schema:
+        properties = schema["properties"]
+        return {k: _coerce(v, properties[k]) if k in properties else v for k, v in value.items()}
+    if isinstance(value, list) and "items" in schema:
+        return [_coerce(item, schema["items"]) for item in value]
+    return value
+
+
+def validate(value, schema, path="$"):
+    """
+    Checks a value against the JSON Schema subset used for LLM output (type,
+    enum, required, properties, items, minItems, maxItems, minLength).
+    Returns a list of error messages; empty means valid.
+    """
+    expected = schema.get("type")
+    if expected:
+        py_type = _PY_TYPES[expected]
+        if not isinstance(value, py_type) or (isinstance(value, bool) and expected != "boolean"):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, str) and len(value.strip()) < schema.get("minLength", 0):
+        errors.append(f"{path}: string is too short")
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing key '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], sub_schema, f"{path}.{key}"))
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def conform(value, schema):
+    """
+    Normalises value to schema (see _coerce) and validates it, as parse_json
+    does, for values parsed elsewhere (e.g. the items of a batched reply).
+    Returns (value, errors).
+    """
+    value = _coerce(value, schema)
+    return value, validate(value, schema)
+
+
+def parse_json(text, schema=None, purpose=""):
+    """
+    Extracts and validates the JSON value in an LLM response. Returns the value,
+    or None if it cannot be parsed or does not match schema (counted per purpose).
+    """
+    schema = schema or {}
+    try:
+        value, repaired = extract_json(text, schema.get("type") if schema.get("type") in ("object", "array") else None)
+    except JSONExtractError as e:
+        _count(purpose, "parse_failures")
+        print(f"JSON extraction failed for {purpose or 'response'}: {e}")
+        return None
+    value, errors = conform(value, schema)
+    if errors:
+        _count(purpose, "validation_failures")
+        print(f"JSON for {purpose or 'response'} did not match its schema: {'; '.join(errors[:3])}")
+        return None
+    _count(purpose, "repaired" if repaired else "parsed")
+    return value
+
+
+def record_retry(purpose=""):
+    """Counts a regeneration caused by an unusable JSON response."""
+    _count(purpose, "retries")
+
+
+def get_json_stats():
+    """Per-purpose parse counters for this process, with overall failure and retry rates."""
+    with _stats_lock:
+        stats = {purpose: dict(counters) for purpose, counters in _stats.items()}
+    totals = {"parsed": 0, "repaired": 0, "parse_failures": 0, "validation_failures": 0, "retries": 0}
+    for counters in stats.values():
+        for key in totals:
+            totals[key] += counters[key]
+    attempts = totals["parsed"] + totals["repaired"] + totals["parse_failures"] + totals["validation_failures"]
+    totals["failure_rate"] = (totals["parse_failures"] + totals["validation_failures"]) / attempts if attempts else 0.0
+    totals["retry_rate"] = totals["retries"] / attempts if attempts else 0.0
+    return {"total": totals, "by_purpose": stats}
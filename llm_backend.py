@@ -0,0 +1,534 @@
+import os
+import io
+import copy
+import json
+import base64
+import asyncio
+import threading
+
+import requests
+import google.generativeai as genai
+
+import http_client
+import json_extract
+import llm_cache
+import llm_resilience
+import llm_routing
+import llm_streaming
+import ollama_pool
+import ollama_prefix
+import prompt_log
+
+# --- BACKEND CONFIGURATION ---
+# genai.configure(api_key=...) is done by the entry-point modules (app.py, ds_r1.py, ...).
+DEFAULT_GEMINI_MODEL = "gemini-3-flash-preview"
+DEFAULT_GEMINI_VISION_MODEL = "gemini-3-pro-preview"
+DEFAULT_OLLAMA_MODEL = "gemma2"
+DEFAULT_OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "gemma3:latest")
+# Requests are balanced over every host in OLLAMA_HOSTS (see ollama_pool); this is the first one.
+OLLAMA_BASE_URL = ollama_pool.OLLAMA_HOSTS[0]
+OLLAMA_API_URL = f"{OLLAMA_BASE_URL}/api/generate"
+# Sent with every Ollama request so the model stays loaded between calls of an active session.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def _cache_variant(schema, options):
+    """Request settings besides the prompt that change the response, for the llm_cache key (the timeout does not)."""
+    return {"schema": schema, "max_tokens": options.get("max_tokens"), "temperature": options.get("temperature")}
+
+
+class LLMError(Exception):
+    """Any failure talking to an LLM backend (connection, API or empty-response errors)."""
+
+
+class LLMBackend:
+    """
+    Common interface for all LLM access. Subclasses implement _generate and
+    _stream; caching, rate limiting / retries / circuit breaking
+    (llm_resilience), error wrapping and telemetry (prompt_log) live here so
+    they apply to every call site. Prompts that carry images are never cached.
+    Passing a JSON schema switches the backend to its structured-output mode.
+    Generation budgets (max tokens, temperature, timeout) come from the
+    purpose's llm_routing route, with the per-purpose overrides in budgets
+    (set on the backend copy of an LLMConfig). A prefix is the part of the prompt shared by
+    a series of calls; backends that can reuse its evaluation (Ollama) send it
+    separately, the others simply prepend it.
+    """
+    name = "base"
+    label = "LLM"
+    budgets = None
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    # --- sync entry points ---
+    def generate(self, prompt, purpose="", images=None, use_cache=True, schema=None, prefix=None):
+        """Returns the full response text (stripped). Raises LLMError on failure."""
+        full_prompt = (prefix or "") + prompt
+        record = prompt_log.LLMCallRecord(self.name, self.model_name, purpose, full_prompt)
+        options = llm_routing.generation_options(self.name, self.model_name, purpose, self.budgets)
+
+        def call_fn():
+            record.cache_hit = False
+            return self._call(lambda: llm_resilience.call_with_retries(
+                self.name, self.model_name,
+                lambda: self._generate(prompt, images, record.usage, schema, options, prefix), self.label
+            ))
+
+        try:
+            if images:
+                response_text = call_fn()
+            else:
+                response_text = llm_cache.cached_llm_call(
+                    self.name, self.model_name, purpose, full_prompt, call_fn, use_cache=use_cache,
+                    variant=_cache_variant(schema, options)
+                )
+        except Exception as e:
+            record.finish(None, error=e)
+            raise
+        record.finish(response_text)
+        return response_text
+
+    def generate_json(self, prompt, schema, purpose="", images=None, use_cache=True, prefix=None):
+        """
+        Generates in structured-output mode and returns the parsed, schema-valid
+        value. An unusable reply is dropped from the cache and regenerated up to
+        json_extract.JSON_MAX_RETRIES times; after that LLMError is raised.
+        """
+        for attempt in range(json_extract.JSON_MAX_RETRIES + 1):
+            response_text = self.generate(prompt, purpose, images, use_cache, schema=schema, prefix=prefix)
+            value = json_extract.parse_json(response_text, schema, purpose)
+            if value is not None:
+                return value
+            self.invalidate((prefix or "") + prompt, purpose, schema)
+            if attempt < json_extract.JSON_MAX_RETRIES:
+                json_extract.record_retry(purpose)
+        raise LLMError(f"{self.label} returned invalid JSON for {purpose or 'the prompt'}.")
+
+    def invalidate(self, prompt, purpose="", schema=None):
+        """Removes the cached response of this prompt (generated with schema) so the next call regenerates it."""
+        options = llm_routing.generation_options(self.name, self.model_name, purpose, self.budgets)
+        llm_cache.delete_response(self.name, self.model_name, purpose, prompt, _cache_variant(schema, options))
+
+    def stream(self, prompt, purpose="", use_cache=True, json_output=False, schema=None, prefix=None):
+        """
+        Yields response tokens as they arrive. json_output (implied by schema)
+        stops the stream at the first complete JSON object/array. Raises
+        LLMError on failure. A stream closed before it finishes is logged with
+        outcome "cancelled".
+        """
+        full_prompt = (prefix or "") + prompt
+        record = prompt_log.LLMCallRecord(self.name, self.model_name, purpose, full_prompt, streamed=True)
+        options = llm_routing.generation_options(self.name, self.model_name, purpose, self.budgets)
+
+        def token_stream():
+            record.cache_hit = False
+            tokens = self._wrap_stream_errors(llm_resilience.stream_with_retries(
+                self.name, self.model_name, lambda: self._stream(prompt, record.usage, schema, options, prefix), self.label
+            ))
+            return llm_streaming.stop_at_complete_json(tokens) if json_output or schema else tokens
+
+        tokens = llm_cache.cached_llm_stream(
+            self.name, self.model_name, purpose, full_prompt, token_stream, use_cache=use_cache,
+            variant=_cache_variant(schema, options)
+        )
+        parts = []
+        outcome, error = "cancelled", None
+        try:
+            for token in tokens:
+                record.mark_first_token()
+                parts.append(token)
+                yield token
+            outcome = None
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            tokens.close()
+            record.finish("".join(parts).strip(), outcome=outcome, error=error)
+
+    # --- asyncio entry points (sync SDK calls run in a worker thread) ---
+    async def agenerate(self, prompt, purpose="", images=None, use_cache=True, schema=None, prefix=None):
+        return await asyncio.to_thread(self.generate, prompt, purpose, images, use_cache, schema, prefix)
+
+    async def astream(self, prompt, purpose="", use_cache=True, json_output=False, schema=None, prefix=None):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+
+        def pump():
+            try:
+                for token in self.stream(prompt, purpose, use_cache, json_output, schema, prefix):
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        worker = loop.run_in_executor(None, pump)
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await worker
+
+    # --- helpers ---
+    def _call(self, fn):
+        try:
+            return fn()
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(self._describe_error(e)) from e
+
+    def _wrap_stream_errors(self, tokens):
+        try:
+            yield from tokens
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(self._describe_error(e)) from e
+
+    def _describe_error(self, error):
+        if isinstance(error, llm_resilience.CircuitOpenError):
+            return str(error)
+        return f"{self.label} error: {error}"
+
+    def _generate(self, prompt, images, usage, schema=None, options=None, prefix=None):
+        """
+        Returns the response text; reported token counts go into usage.
+        options holds the route's max_tokens / temperature / timeout (None = default).
+        """
+        raise NotImplementedError
+
+    def _stream(self, prompt, usage, schema=None, options=None, prefix=None):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini (text and vision) through google.generativeai."""
+    name = "gemini"
+    label = "Gemini API"
+
+    def __init__(self, model_name=DEFAULT_GEMINI_MODEL):
+        super().__init__(model_name)
+        self.client = genai.GenerativeModel(model_name=model_name)
+
+    def _generate(self, prompt, images, usage, schema=None, options=None, prefix=None):
+        prompt = (prefix or "") + prompt
+        contents = [prompt, *images] if images else prompt
+        response = self.client.generate_content(
+            contents,
+            generation_config=gemini_generation_config(schema, options),
+            request_options=gemini_request_options(options)
+        )
+        llm_streaming.record_gemini_usage(response, usage)
+        return response.text.strip()
+
+    def _stream(self, prompt, usage, schema=None, options=None, prefix=None):
+        return llm_streaming.stream_gemini(
+            self.client, (prefix or "") + prompt, usage,
+            generation_config=gemini_generation_config(schema, options),
+            request_options=gemini_request_options(options)
+        )
+
+
+class OllamaBackend(LLMBackend):
+    """
+    Local Ollama servers (text, and images for multimodal models such as
+    gemma3). Each request goes to an endpoint picked by the ollama_pool.
+    """
+    name = "ollama"
+    label = "Ollama"
+
+    def __init__(self, model_name=DEFAULT_OLLAMA_MODEL, pool=None):
+        super().__init__(model_name)
+        self.pool = pool or ollama_pool.get_pool()
+
+    def _generate(self, prompt, images, usage, schema=None, options=None, prefix=None):
+        mode = ollama_prefix.get_mode(self.model_name) if prefix and not images else "off"
+
+        def post(base_url):
+            nonlocal mode
+            mode, path, fields = self._prefixed_fields(base_url, mode, prompt, prefix)
+            payload = {
+                "model": self.model_name,
+                **fields,
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            }
+            if schema:
+                payload["format"] = schema
+            model_options = ollama_options(options)
+            if model_options:
+                payload["options"] = model_options
+            if images:
+                payload["images"] = [encode_image(image) for image in images]
+            response = http_client.post(f"{base_url}{path}", json=payload, timeout=ollama_timeout(options))
+            if response.status_code != 200:
+                raise llm_streaming.OllamaAPIError(f"Ollama API error: {response.status_code}", response.status_code)
+            return response.json()
+
+        body = self.pool.request(self.model_name, post)
+        llm_streaming.record_ollama_usage(body, usage)
+        if prefix:
+            usage["prefix_mode"] = mode
+            ollama_prefix.record_call(mode, usage)
+        return ollama_prefix.response_text(body).strip()
+
+    def _stream(self, prompt, usage, schema=None, options=None, prefix=None):
+        mode = ollama_prefix.get_mode(self.model_name) if prefix else "off"
+
+        def stream_from(base_url):
+            nonlocal mode
+            mode, path, fields = self._prefixed_fields(base_url, mode, prompt, prefix)
+            yield from llm_streaming.stream_ollama(
+                f"{base_url}{path}", self.model_name, fields.get("prompt"), usage,
+                keep_alive=OLLAMA_KEEP_ALIVE, format=schema,
+                options=ollama_options(options), timeout=ollama_timeout(options),
+                messages=fields.get("messages"), context=fields.get("context")
+            )
+            if prefix:
+                usage["prefix_mode"] = mode
+                ollama_prefix.record_call(mode, usage)
+
+        return self.pool.stream(self.model_name, stream_from)
+
+    def _prefixed_fields(self, base_url, mode, prompt, prefix):
+        """
+        (mode, API path, prompt fields) for a call, priming the prefix context
+        first in context mode (which falls back to off without a context).
+        """
+        context = None
+        if mode == "context":
+            context = ollama_prefix.get_context(self.model_name, prefix, lambda: self._prime_context(base_url, prefix))
+            if context is None:
+                mode = "off"
+        return (mode, *ollama_prefix.request_fields(mode, prompt, prefix, context))
+
+    def _prime_context(self, base_url, prefix):
+        """Evaluates prefix once; returns (context tokens, prefill ms)."""
+        response = http_client.post(f"{base_url}/api/generate", json={
+            "model": self.model_name,
+            "prompt": prefix,
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"num_predict": 1}
+        })
+        if response.status_code != 200:
+            raise llm_streaming.OllamaAPIError(f"Ollama API error: {response.status_code}", response.status_code)
+        body = response.json()
+        usage = {}
+        llm_streaming.record_ollama_usage(body, usage)
+        return body.get("context"), usage.get("prefill_ms")
+
+    def embed(self, texts, timeout=(2, 30)):
+        """
+        Embedding vectors for a list of texts via /api/embed (e.g. embeddinggemma).
+        No caching or retries: callers treat a failure as "no embeddings available".
+        """
+        def post(base_url):
+            response = http_client.post(
+                f"{base_url}/api/embed",
+                json={"model": self.model_name, "input": list(texts), "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                raise llm_streaming.OllamaAPIError(f"Ollama API error: {response.status_code}", response.status_code)
+            return response.json()["embeddings"]
+
+        try:
+            return self.pool.request(self.model_name, post)
+        except Exception as e:
+            raise LLMError(self._describe_error(e)) from e
+
+    def _describe_error(self, error):
+        if isinstance(error, requests.exceptions.ConnectionError):
+            return (f"Cannot connect to Ollama. Please ensure Ollama is running with 'ollama serve' "
+                    f"and the model '{self.model_name}' is installed.")
+        return super()._describe_error(error)
+
+
+# Keys of our JSON schemas that Gemini's response_schema understands.
+GEMINI_SCHEMA_KEYS = {"type", "enum", "items", "properties", "required", "description", "nullable"}
+
+
+def gemini_response_schema(schema):
+    """Copy of a JSON schema with only the keys Gemini's response_schema accepts."""
+    converted = {k: v for k, v in schema.items() if k in GEMINI_SCHEMA_KEYS}
+    if "items" in converted:
+        converted["items"] = gemini_response_schema(converted["items"])
+    if "properties" in converted:
+        converted["properties"] = {k: gemini_response_schema(v) for k, v in converted["properties"].items()}
+    return converted
+
+
+def gemini_generation_config(schema, options=None):
+    """
+    generation_config for a Gemini call: JSON MIME type + response schema when
+    schema is set, plus the route's token cap and temperature. None if empty.
+    """
+    config = {}
+    if schema:
+        config.update(response_mime_type="application/json", response_schema=gemini_response_schema(schema))
+    options = options or {}
+    if options.get("max_tokens"):
+        config["max_output_tokens"] = options["max_tokens"]
+    if options.get("temperature") is not None:
+        config["temperature"] = options["temperature"]
+    return config or None
+
+
+def gemini_request_options(options):
+    """request_options (per-call timeout) for a Gemini call, or None."""
+    if options and options.get("timeout"):
+        return {"timeout": options["timeout"]}
+    return None
+
+
+def ollama_options(options):
+    """Ollama model options (num_predict, temperature) for a route budget, or None."""
+    options = options or {}
+    model_options = {}
+    if options.get("max_tokens"):
+        model_options["num_predict"] = options["max_tokens"]
+    if options.get("temperature") is not None:
+        model_options["temperature"] = options["temperature"]
+    return model_options or None
+
+
+def ollama_timeout(options):
+    """(connect, read) timeout for an Ollama request; the read part is the route's timeout."""
+    read_timeout = (options or {}).get("timeout") or http_client.HTTP_READ_TIMEOUT
+    return (http_client.HTTP_CONNECT_TIMEOUT, read_timeout)
+
+
+def encode_image(image):
+    """Base64-encodes a PIL image, raw bytes or a file path for Ollama's images field."""
+    if isinstance(image, (bytes, bytearray)):
+        data = bytes(image)
+    elif isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            data = f.read()
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+    return base64.b64encode(data).decode("ascii")
+
+
+# --- BACKEND REGISTRY ---
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(mode, model_name=None, budgets=None):
+    """
+    Returns the shared backend for an app mode ('online' -> Gemini,
+    'offline' -> Ollama) and model; instances are reused across calls.
+    budgets ({purpose: {"max_tokens": ..., ...}}) override the llm_routing
+    budgets on a copy of the backend that shares its client.
+    """
+    backend_cls = OllamaBackend if mode == "offline" else GeminiBackend
+    if model_name is None:
+        model_name = DEFAULT_OLLAMA_MODEL if mode == "offline" else DEFAULT_GEMINI_MODEL
+    key = (backend_cls.name, model_name)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = backend_cls(model_name)
+        if not budgets:
+            return _backends[key]
+        budget_key = key + (json.dumps(budgets, sort_keys=True),)
+        if budget_key not in _backends:
+            backend = copy.copy(_backends[key])
+            backend.budgets = budgets
+            _backends[budget_key] = backend
+        return _backends[budget_key]
+
+
+def get_installed_ollama_models():
+    """Names of the models installed on any reachable Ollama endpoint (empty if none is up)."""
+    return ollama_pool.get_pool().installed_models()
+
+
+def get_routed_backend(mode, purpose, model_name=None, budgets=None):
+    """
+    Backend for one call purpose: the llm_routing tier model for that purpose,
+    or model_name (the mode's default if None). Offline tier models are only
+    used when they are installed.
+    """
+    default_model = model_name or (DEFAULT_OLLAMA_MODEL if mode == "offline" else DEFAULT_GEMINI_MODEL)
+    routed_model = llm_routing.route_model(mode, purpose, default_model)
+    if mode == "offline" and routed_model != default_model and routed_model not in get_installed_ollama_models():
+        routed_model = default_model
+    llm_routing.record_route(purpose, routed_model)
+    return get_backend(mode, routed_model, budgets)
+
+
+def get_vision_backend(mode, model_name=None, budgets=None):
+    """Backend for image + text prompts (Aadhaar extraction); model_name must be multimodal."""
+    if model_name is None:
+        model_name = DEFAULT_OLLAMA_VISION_MODEL if mode == "offline" else DEFAULT_GEMINI_VISION_MODEL
+    return get_backend(mode, model_name, budgets)
+
+
+# --- REQUEST-SCOPED CONFIGURATION ---
+_env_config = None
+
+class LLMConfig:
+    """
+    LLM settings of one session or job: mode ('online' / 'offline'), the
+    model selected for that mode (None = the caller's or the mode's default),
+    the multimodal model for image prompts (None = the mode's vision default)
+    and per-purpose budget overrides ({purpose: {"max_tokens": ...}}). Every
+    LLM entry point takes one instead of reading process-wide settings, so
+    concurrent sessions can use different backends.
+    """
+
+    def __init__(self, mode="online", model=None, budgets=None, vision_model=None):
+        self.mode = mode if mode in ("online", "offline") else "online"
+        self.model = model or None
+        self.budgets = budgets or {}
+        self.vision_model = vision_model or None
+
+    def backend(self, purpose="", default_model=None):
+        """Routed backend for purpose; default_model is used when the config names no model."""
+        return get_routed_backend(self.mode, purpose, self.model or default_model, self.budgets)
+
+    def vision_backend(self):
+        """Backend for image prompts: the config's vision model with its budgets."""
+        return get_vision_backend(self.mode, self.vision_model, self.budgets)
+
+    def to_params(self):
+        """JSON-serialisable form, e.g. for job parameters."""
+        return {"llm_mode": self.mode, "llm_model": self.model, "llm_budgets": self.budgets,
+                "llm_vision_model": self.vision_model}
+
+    @classmethod
+    def from_params(cls, params):
+        """Config stored by to_params (jobs queued before it carry only llm_mode / ollama_model)."""
+        mode = params.get("llm_mode", "online")
+        model = params.get("llm_model") or (params.get("ollama_model") if mode == "offline" else None)
+        return cls(mode, model, params.get("llm_budgets"), params.get("llm_vision_model"))
+
+    @classmethod
+    def from_env(cls):
+        """
+        Default for command-line use: LLM_MODE, OLLAMA_MODEL and
+        OLLAMA_VISION_MODEL, read once per process (the same config is
+        returned on every later call, so treat it as read-only).
+        """
+        global _env_config
+        if _env_config is None:
+            mode = os.getenv("LLM_MODE", "online")
+            offline = mode == "offline"
+            _env_config = cls(mode, os.getenv("OLLAMA_MODEL") if offline else None,
+                              vision_model=os.getenv("OLLAMA_VISION_MODEL") if offline else None)
+        return _env_config
+
+    def __repr__(self):
+        return (f"LLMConfig(mode={self.mode!r}, model={self.model!r}, budgets={self.budgets!r}, "
+                f"vision_model={self.vision_model!r})")
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# --- CACHE CONFIGURATION ---
+# All limits can be overridden through environment variables.
+CACHE_DB_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def _get_connection():
+    """Opens (once per process) the shared SQLite connection and creates the table."""
+    global _conn
+    if _conn is None:
+        db_dir = os.path.dirname(CACHE_DB_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                cache_key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                purpose TEXT,
+                response TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_accessed ON llm_responses (last_accessed)")
+        _conn.commit()
+    return _conn
+
+
+def make_cache_key(backend, model_name, purpose, prompt, variant=None):
+    """
+    Content-addressed key: (backend, model, purpose) plus a hash of the prompt
+    and of variant, the other request settings that change the response
+    (e.g. the JSON schema and generation options), so requests that differ
+    only in those never share an entry.
+    """
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    raw = json.dumps([backend, model_name, purpose or "", prompt_hash, variant], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(backend, model_name, purpose, prompt, variant=None):
+    """Returns the cached response text, or None on a miss or an expired entry."""
+    if not CACHE_ENABLED:
+        return None
+    key = make_cache_key(backend, model_name, purpose, prompt, variant)
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute(
+            "SELECT response, created_at FROM llm_responses WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        response, created_at = row
+        if now - created_at > CACHE_TTL_SECONDS:
+            conn.execute("DELETE FROM llm_responses WHERE cache_key = ?", (key,))
+            conn.commit()
+            _stats["misses"] += 1
+            _stats["evictions"] += 1
+            return None
+        conn.execute(
+            "UPDATE llm_responses SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+            (now, key)
+        )
+        conn.commit()
+        _stats["hits"] += 1
+        return response
+
+
+def store_response(backend, model_name, purpose, prompt, response_text, variant=None):
+    """Saves a response and evicts expired / least recently used entries over the caps."""
+    if not CACHE_ENABLED or not response_text:
+        return
+    key = make_cache_key(backend, model_name, purpose, prompt, variant)
+    now = time.time()
+    size_bytes = len(response_text.encode("utf-8"))
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            """INSERT OR REPLACE INTO llm_responses
+               (cache_key, backend, model, purpose, response, size_bytes, created_at, last_accessed, hit_count)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)""",
+            (key, backend, model_name, purpose or "", response_text, size_bytes, now, now)
+        )
+        _stats["stores"] += 1
+        _evict(conn, now)
+        conn.commit()
+
+
+def delete_response(backend, model_name, purpose, prompt, variant=None):
+    """Drops one cached response (e.g. one that turned out to be unusable)."""
+    if not CACHE_ENABLED:
+        return
+    key = make_cache_key(backend, model_name, purpose, prompt, variant)
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM llm_responses WHERE cache_key = ?", (key,))
+        conn.commit()
+
+
+def _evict(conn, now):
+    """Drops expired rows first, then the least recently used rows until under both caps."""
+    cursor = conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+    _stats["evictions"] += cursor.rowcount
+
+    count, total_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_responses"
+    ).fetchone()
+    if count <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+        return
+
+    rows = conn.execute(
+        "SELECT cache_key, size_bytes FROM llm_responses ORDER BY last_accessed ASC"
+    ).fetchall()
+    to_delete = []
+    for cache_key, size in rows:
+        if count <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+            break
+        to_delete.append((cache_key,))
+        count -= 1
+        total_bytes -= size
+    conn.executemany("DELETE FROM llm_responses WHERE cache_key = ?", to_delete)
+    _stats["evictions"] += len(to_delete)
+
+
+def cached_llm_call(backend, model_name, purpose, prompt, call_fn, use_cache=True, variant=None):
+    """
+    Returns the cached response for this prompt (and variant) if present,
+    otherwise calls call_fn() and caches its (non-empty) result. Errors from
+    call_fn propagate.
+    """
+    if use_cache:
+        cached = get_cached_response(backend, model_name, purpose, prompt, variant)
+        if cached is not None:
+            print(f"LLM cache hit ({backend}/{model_name}) for {purpose or 'prompt'}")
+            return cached
+    response_text = call_fn()
+    if use_cache and response_text:
+        store_response(backend, model_name, purpose, prompt, response_text, variant)
+    return response_text
+
+
+def cached_llm_stream(backend, model_name, purpose, prompt, stream_fn, use_cache=True, variant=None):
+    """
+    Streaming counterpart of cached_llm_call: yields the cached response in one
+    piece on a hit, otherwise yields tokens from stream_fn() and caches the
+    full text once the stream finishes normally.
+    """
+    if use_cache:
+        cached = get_cached_response(backend, model_name, purpose, prompt, variant)
+        if cached is not None:
+            print(f"LLM cache hit ({backend}/{model_name}) for {purpose or 'prompt'}")
+            yield cached
+            return
+    parts = []
+    for token in stream_fn():
+        parts.append(token)
+        yield token
+    if use_cache:
+        store_response(backend, model_name, purpose, prompt, "".join(parts).strip(), variant)
+
+
+def clear_cache():
+    """Removes every cached response."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM llm_responses")
+        conn.commit()
+
+
+def get_cache_stats():
+    """Hit/miss counters for this process plus the current on-disk footprint."""
+    with _lock:
+        conn = _get_connection()
+        count, total_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_responses"
+        ).fetchone()
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = count
+    stats["size_bytes"] = total_bytes
+    return stats
@@ -0,0 +1,105 @@
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Streamlit is optional here: when available, worker threads inherit the
+# script-run context so st.* calls made inside LLM helpers keep working.
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+# --- CONCURRENCY LIMITS ---
+# Maximum LLM calls in flight per backend, shared by every session in the process.
+# A local Ollama server serialises most work, so it gets a much smaller limit.
+MAX_IN_FLIGHT = {
+    "gemini": int(os.getenv("LLM_MAX_IN_FLIGHT_GEMINI", "8")),
+    "ollama": int(os.getenv("LLM_MAX_IN_FLIGHT_OLLAMA", "2")),
+}
+DEFAULT_MAX_IN_FLIGHT = 4
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+# The backend semaphore whose slot the current worker thread holds, if any.
+_held = threading.local()
+
+
+def backend_for_mode(mode):
+    """Maps the app's 'online'/'offline' mode to the backend name used for limits and caching."""
+    return "ollama" if mode == "offline" else "gemini"
+
+
+def get_max_in_flight(backend):
+    return max(1, MAX_IN_FLIGHT.get(backend, DEFAULT_MAX_IN_FLIGHT))
+
+
+def get_backend_semaphore(backend):
+    """Process-wide semaphore that caps concurrent calls to one backend."""
+    with _semaphores_lock:
+        if backend not in _semaphores:
+            _semaphores[backend] = threading.BoundedSemaphore(get_max_in_flight(backend))
+        return _semaphores[backend]
+
+
+@contextmanager
+def released_slot():
+    """
+    Gives up the calling thread's in-flight slot (if it holds one) for the
+    duration of the block, e.g. a retry backoff sleep, so other calls can run
+    meanwhile; the slot is taken back before the block's caller continues.
+    """
+    semaphore = getattr(_held, "semaphore", None)
+    if semaphore is None:
+        yield
+        return
+    semaphore.release()
+    try:
+        yield
+    finally:
+        semaphore.acquire()
+
+
+def run_concurrently(fn, items, backend, on_complete=None):
+    """
+    Runs fn(item) for every item with at most MAX_IN_FLIGHT[backend] calls in
+    flight. Results are returned in input order. on_complete(index, result, done)
+    is called from the calling thread as each call finishes, so it is safe to
+    update Streamlit widgets from it. The first exception cancels pending work
+    and is re-raised.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    semaphore = get_backend_semaphore(backend)
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def init_worker():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    def run_one(item):
+        with semaphore:
+            _held.semaphore = semaphore
+            try:
+                return fn(item)
+            finally:
+                _held.semaphore = None
+
+    results = [None] * len(items)
+    max_workers = min(get_max_in_flight(backend), len(items))
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+        futures = {executor.submit(run_one, item): index for index, item in enumerate(items)}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                results[index] = future.result()
+                if on_complete:
+                    on_complete(index, results[index], done)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
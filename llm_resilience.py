@@ -0,0 +1,266 @@
+import os
+import time
+import random
+import threading
+
+import llm_concurrency
+
+# --- RATE LIMITS ---
+# Requests per minute for each (backend, model) pair; 0 disables the limiter.
+# Gemini quotas are per model, so every model gets its own bucket at this rate.
+RATE_LIMIT_RPM = {
+    "gemini": float(os.getenv("LLM_RATE_LIMIT_RPM_GEMINI", "60")),
+    "ollama": float(os.getenv("LLM_RATE_LIMIT_RPM_OLLAMA", "0")),
+}
+RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "5"))
+
+# --- RETRIES ---
+# Retryable errors (quota, 5xx, timeouts, refused connections) are retried with
+# full-jitter exponential backoff: sleep uniform(0, min(max, base * 2**attempt)).
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+
+# --- CIRCUIT BREAKER ---
+# After BREAKER_FAILURES consecutive retryable failures a backend is treated as
+# down: calls fail immediately for BREAKER_RESET_SECONDS, then one trial call
+# is let through (half-open) to decide whether to close the circuit again.
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Matched against the exception's class hierarchy so google.api_core and
+# requests exceptions are recognised without importing either package here.
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway",
+    "ConnectionError", "Timeout", "ChunkedEncodingError",
+}
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "retries": 0, "gave_up": 0, "fast_failures": 0, "throttled_seconds": 0.0}
+
+
+def _count(counter, amount=1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while its circuit breaker is open."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity` saved up."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available. Returns the time waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed."""
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold or BREAKER_FAILURES)
+        self.reset_seconds = BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raises CircuitOpenError if the backend should not be called right now."""
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+        _count("fast_failures")
+        raise CircuitOpenError(
+            f"{self.name} is unavailable after {self.failures} consecutive failures; "
+            f"not retrying for another {retry_in:.0f}s."
+        )
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """Ends a half-open trial that failed for a reason unrelated to availability."""
+        with self.lock:
+            self.trial_in_flight = False
+
+
+_limiters = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(backend, model_name):
+    """Shared bucket for one backend/model, or None if that backend is unlimited."""
+    rpm = RATE_LIMIT_RPM.get(backend, 0)
+    if rpm <= 0:
+        return None
+    key = (backend, model_name)
+    with _registry_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(rpm / 60.0, RATE_LIMIT_BURST)
+        return _limiters[key]
+
+
+def get_breaker(backend, label=None):
+    """Shared circuit breaker for one backend (a service is up or down for all its models)."""
+    with _registry_lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker(label or backend)
+        return _breakers[backend]
+
+
+def is_retryable(error):
+    """True for quota, server-side, timeout and connection errors; False for bad requests etc."""
+    for attr in ("status_code", "code"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+            return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _before_attempt(breaker, limiter):
+    breaker.before_call()
+    if limiter is not None:
+        waited = limiter.acquire()
+        if waited:
+            _count("throttled_seconds", waited)
+
+
+def _after_failure(breaker, error, attempt):
+    """Records the failure and returns True if the call should be retried (after sleeping)."""
+    if is_retryable(error):
+        breaker.record_failure()
+    else:
+        breaker.release_trial()
+        return False
+    if attempt >= MAX_RETRIES or breaker.state == "open":
+        _count("gave_up")
+        return False
+    delay = backoff_delay(attempt)
+    print(f"LLM call failed ({error}); retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+    _count("retries")
+    # Don't keep a run_concurrently slot busy while waiting
+    with llm_concurrency.released_slot():
+        time.sleep(delay)
+    return True
+
+
+def call_with_retries(backend, model_name, fn, label=None):
+    """
+    Calls fn() under the backend/model rate limit and the backend's circuit
+    breaker, retrying retryable errors with jittered backoff. Raises
+    CircuitOpenError while the backend is considered down.
+    """
+    breaker = get_breaker(backend, label)
+    limiter = get_rate_limiter(backend, model_name)
+    _count("calls")
+    attempt = 0
+    while True:
+        _before_attempt(breaker, limiter)
+        try:
+            result = fn()
+        except Exception as e:
+            if not _after_failure(breaker, e, attempt):
+                raise
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def stream_with_retries(backend, model_name, stream_fn, label=None):
+    """
+    Streaming counterpart of call_with_retries. A stream is only retried if it
+    fails before yielding its first token; later failures propagate, since the
+    caller has already consumed part of the answer.
+    """
+    breaker = get_breaker(backend, label)
+    limiter = get_rate_limiter(backend, model_name)
+    _count("calls")
+    attempt = 0
+    while True:
+        _before_attempt(breaker, limiter)
+        started = False
+        try:
+            for token in stream_fn():
+                if not started:
+                    started = True
+                    breaker.record_success()
+                yield token
+        except Exception as e:
+            if started:
+                raise
+            if not _after_failure(breaker, e, attempt):
+                raise
+            attempt += 1
+            continue
+        if not started:
+            breaker.record_success()
+        return
+
+
+def get_resilience_stats():
+    """Retry / throttling counters for this process plus each backend's breaker state."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["throttled_seconds"] = round(stats["throttled_seconds"], 2)
+    with _registry_lock:
+        breakers = dict(_breakers)
+    stats["breakers"] = {name: breaker.state for name, breaker in breakers.items()}
+    return stats
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+
+# --- ROUTING CONFIGURATION ---
+# Each LLM call carries a purpose (the pipeline stage). Routes map a purpose to
+# a model tier and a generation budget, so cheap structured stages run on small
+# fast models and only description / chat use the selected or a larger model.
+LLM_ROUTING_ENABLED = os.getenv("LLM_ROUTING_ENABLED", "1") != "0"
+# Optional JSON file with per-purpose overrides, e.g. {"headings": {"tier": "default"}}.
+LLM_ROUTES_FILE = os.getenv("LLM_ROUTES_FILE", "")
+
+# Model per tier and mode; "default" (or an empty setting) keeps the caller's model.
+# Offline tiers only apply when that model is installed in Ollama.
+TIER_MODELS = {
+    "online": {
+        "fast": os.getenv("LLM_FAST_GEMINI_MODEL", "gemini-2.5-flash-lite"),
+        "large": os.getenv("LLM_LARGE_GEMINI_MODEL", "gemini-3-pro-preview"),
+    },
+    "offline": {
+        "fast": os.getenv("OLLAMA_FAST_MODEL", "gemma3:1b"),
+        "large": os.getenv("OLLAMA_LARGE_MODEL", ""),
+    },
+}
+# Gemini thinking models spend part of max_output_tokens on reasoning, so a token
+# cap is only sent to Gemini for the (non-thinking) fast tier.
+GEMINI_TOKEN_CAP_TIERS = {"fast"}
+
+# tier, max_tokens (None = no cap), temperature (None = model default), timeout in seconds
+DEFAULT_ROUTE = {"tier": "default", "max_tokens": None, "temperature": None, "timeout": None}
+ROUTES = {
+    "classification":       {"tier": "fast", "max_tokens": 256, "temperature": 0.0, "timeout": 30},
+    "headings":             {"tier": "fast", "max_tokens": 400, "temperature": 0.2, "timeout": 45},
+    "question":             {"tier": "fast", "max_tokens": 256, "temperature": 0.3, "timeout": 30},
+    "questions_batch":      {"tier": "fast", "max_tokens": 4096, "temperature": 0.3, "timeout": 120},
+    "question_fused":       {"tier": "fast", "max_tokens": 512, "temperature": 0.4, "timeout": 45},
+    "questions_batch_fused": {"tier": "fast", "max_tokens": 8192, "temperature": 0.4, "timeout": 180},
+    "script":               {"tier": "fast", "max_tokens": 300, "temperature": 0.5, "timeout": 30},
+    "translation":          {"tier": "default", "max_tokens": 4096, "temperature": 0.0, "timeout": 180},
+    "answer_extraction":    {"tier": "fast", "max_tokens": 32, "temperature": 0.0, "timeout": 20},
+    "key_columns":          {"tier": "fast", "max_tokens": 100, "temperature": 0.0, "timeout": 20},
+    "visualization_config": {"tier": "fast", "max_tokens": 1500, "temperature": 0.2, "timeout": 60},
+    "description":          {"tier": "default", "max_tokens": 400, "temperature": 0.7, "timeout": 90},
+    "summary":              {"tier": "default", "max_tokens": 1024, "temperature": 0.5, "timeout": 120},
+    "chat":                 {"tier": "large", "max_tokens": None, "temperature": 0.7, "timeout": 180},
+}
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _load_route_overrides():
+    if not LLM_ROUTES_FILE:
+        return
+    try:
+        with open(LLM_ROUTES_FILE, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not load LLM routes from {LLM_ROUTES_FILE}: {e}")
+        return
+    for purpose, fields in overrides.items():
+        ROUTES[purpose] = {**ROUTES.get(purpose, DEFAULT_ROUTE), **fields}
+
+
+_load_route_overrides()
+
+
+def get_route(purpose):
+    """The full route (tier and budget) for a purpose; unknown purposes get DEFAULT_ROUTE."""
+    if not LLM_ROUTING_ENABLED:
+        return dict(DEFAULT_ROUTE)
+    return {**DEFAULT_ROUTE, **ROUTES.get(purpose or "", {})}
+
+
+def route_model(mode, purpose, default_model):
+    """Model for a purpose in the given mode ('online' / 'offline'), or default_model."""
+    tier = get_route(purpose)["tier"]
+    return TIER_MODELS.get(mode, {}).get(tier) or default_model
+
+
+def record_route(purpose, model_name):
+    """Counts a call routed to model_name (shown in the admin performance panel)."""
+    with _stats_lock:
+        key = f"{purpose or '(none)'} -> {model_name}"
+        _stats[key] = _stats.get(key, 0) + 1
+
+
+def generation_options(backend_name, model_name, purpose, budgets=None):
+    """
+    Per-call generation budget for a purpose: max_tokens, temperature and
+    timeout (None = backend default), with budgets[purpose] overriding the
+    route. The Gemini token cap only applies when the call runs on the
+    fast-tier model.
+    """
+    route = {**get_route(purpose), **(budgets or {}).get(purpose or "", {})}
+    options = {key: route[key] for key in ("max_tokens", "temperature", "timeout")}
+    if backend_name == "gemini":
+        fast_model = TIER_MODELS["online"].get("fast")
+        if not (route["tier"] in GEMINI_TOKEN_CAP_TIERS and model_name == fast_model):
+            options["max_tokens"] = None
+    return options
+
+
+def get_routing_stats():
+    """How many calls each purpose sent to each model in this process."""
+    with _stats_lock:
+        return dict(_stats)
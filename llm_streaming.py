@@ -0,0 +1,172 @@
+import json
+
+import http_client
+
+
+class OllamaAPIError(RuntimeError):
+    """Error response from Ollama; status_code is None for errors reported inside a stream."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def record_ollama_usage(body, usage):
+    """
+    Copies Ollama's prompt_eval_count / eval_count into a usage dict, plus the
+    prompt evaluation (prefill) time in ms. Cached prompt tokens are not counted.
+    """
+    if usage is None:
+        return
+    if body.get("prompt_eval_count") is not None:
+        usage["prompt_tokens"] = body["prompt_eval_count"]
+    if body.get("eval_count") is not None:
+        usage["response_tokens"] = body["eval_count"]
+    if body.get("prompt_eval_duration") is not None:
+        usage["prefill_ms"] = round(body["prompt_eval_duration"] / 1e6, 1)
+
+
+def record_gemini_usage(response, usage):
+    """Copies Gemini's usage_metadata token counts into a usage dict."""
+    metadata = getattr(response, "usage_metadata", None)
+    if usage is None or metadata is None:
+        return
+    if getattr(metadata, "prompt_token_count", None):
+        usage["prompt_tokens"] = metadata.prompt_token_count
+    if getattr(metadata, "candidates_token_count", None):
+        usage["response_tokens"] = metadata.candidates_token_count
+
+
+def stream_ollama(api_url, model_name, prompt, usage=None, keep_alive=None, format=None, options=None, timeout=None,
+                  messages=None, context=None):
+    """
+    Yields response tokens from Ollama's /api/generate as they arrive.
+    The read timeout applies between chunks rather than to the whole answer.
+    Closing the generator closes the HTTP connection, which stops generation.
+    Token counts from the final chunk are stored in usage (a dict) if given.
+    format ("json" or a JSON schema) constrains the output; options are
+    Ollama model options (num_predict, temperature, ...); timeout overrides
+    the pool's default (connect, read) timeout. With messages the request is
+    an /api/chat one; context continues from previously evaluated tokens.
+    """
+    payload = {
+        "model": model_name,
+        "stream": True
+    }
+    if messages:
+        payload["messages"] = messages
+    else:
+        payload["prompt"] = prompt
+    if context:
+        payload["context"] = context
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    if format:
+        payload["format"] = format
+    if options:
+        payload["options"] = options
+    kwargs = {"timeout": timeout} if timeout else {}
+    with http_client.post(api_url, json=payload, stream=True, **kwargs) as response:
+        if response.status_code != 200:
+            raise OllamaAPIError(f"Ollama API error: {response.status_code}", response.status_code)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise OllamaAPIError(f"Ollama API error: {chunk['error']}")
+            token = chunk.get("response") or (chunk.get("message") or {}).get("content", "")
+            if token:
+                yield token
+            if chunk.get("done"):
+                record_ollama_usage(chunk, usage)
+                break
+
+
+def stream_gemini(gemini_model, prompt, usage=None, generation_config=None, request_options=None):
+    """Yields text chunks from a Gemini GenerativeModel using stream=True."""
+    response = gemini_model.generate_content(
+        prompt, stream=True, generation_config=generation_config, request_options=request_options
+    )
+    for chunk in response:
+        record_gemini_usage(chunk, usage)
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. safety metadata only)
+            continue
+        if text:
+            yield text
+
+
+class JsonCompletionTracker:
+    """
+    Incrementally scans streamed text and reports where the first complete
+    top-level JSON object or array ends, honouring strings and escapes.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+        self.consumed = 0
+
+    def feed(self, chunk):
+        """Returns the end offset (in the whole stream) of the JSON value, or -1."""
+        for i, ch in enumerate(chunk):
+            if not self.started:
+                if ch in "{[":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    end = self.consumed + i + 1
+                    self.consumed += len(chunk)
+                    return end
+        self.consumed += len(chunk)
+        return -1
+
+
+def stop_at_complete_json(tokens):
+    """
+    Passes tokens through until a complete JSON object/array has been seen,
+    then stops (closing the upstream stream) so trailing chatter is skipped.
+    """
+    tracker = JsonCompletionTracker()
+    try:
+        for token in tokens:
+            start = tracker.consumed
+            end = tracker.feed(token)
+            if end != -1:
+                yield token[:end - start]
+                return
+            yield token
+    finally:
+        close = getattr(tokens, "close", None)
+        if close:
+            close()
+
+
+def collect_stream(tokens, on_text=None):
+    """Joins a token stream, calling on_text(text_so_far) after every token."""
+    text = ""
+    for token in tokens:
+        text += token
+        if on_text:
+            on_text(text)
+    return text
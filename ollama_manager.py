@@ -0,0 +1,164 @@
+import os
+import re
+import time
+import threading
+
+import http_client
+import llm_backend
+import llm_routing
+import ollama_pool
+
+# --- WARM-UP CONFIGURATION ---
+# Loading a model from disk can take longer than a normal request's read
+# timeout, so warm-up requests get their own (generous) timeout.
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "600"))
+# Unload the previously selected model when switching (frees RAM/VRAM on small machines).
+OLLAMA_UNLOAD_ON_SWITCH = os.getenv("OLLAMA_UNLOAD_ON_SWITCH", "0") != "0"
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def parse_duration(value):
+    """Seconds for an Ollama keep_alive value ('30m', '1h', '90s', '300', -1 = forever)."""
+    value = str(value).strip()
+    if re.fullmatch(r"-?\d+(\.\d+)?", value):
+        return float(value)
+    total = 0.0
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)([hms])", value):
+        total += float(amount) * {"h": 3600, "m": 60, "s": 1}[unit]
+    return total
+
+
+def _set_state(model_name, **fields):
+    with _states_lock:
+        state = _states.setdefault(model_name, {"status": "unknown"})
+        state.update(fields)
+        return dict(state)
+
+
+def get_model_state(model_name):
+    """Warm-up state of a model: status unknown / loading / ready / failed, plus timings."""
+    with _states_lock:
+        return dict(_states.get(model_name, {"status": "unknown"}))
+
+
+def _warm_up_endpoint(base_url, model_name):
+    # An empty prompt makes Ollama load the model (and reset its keep_alive) without generating.
+    response = http_client.post(
+        f"{base_url}/api/generate",
+        json={"model": model_name, "prompt": "", "keep_alive": llm_backend.OLLAMA_KEEP_ALIVE},
+        timeout=(http_client.HTTP_CONNECT_TIMEOUT, OLLAMA_WARMUP_TIMEOUT)
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Ollama API error at {base_url}: {response.status_code} {response.text[:200]}")
+
+
+def _warm_up(model_name):
+    """Loads the model on every healthy pool endpoint that has it (in parallel); ready once any is."""
+    start = time.perf_counter()
+    pool = ollama_pool.get_pool()
+    endpoints = [e for e in pool.endpoints if e.healthy and e.has_model(model_name)] or pool.endpoints
+    errors = []
+
+    def warm(endpoint):
+        try:
+            _warm_up_endpoint(endpoint.url, model_name)
+            endpoint.loaded.add(model_name)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=warm, args=(endpoint,), daemon=True) for endpoint in endpoints]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) == len(endpoints):
+        _set_state(model_name, status="failed", error=str(errors[0]), last_warmed=time.time())
+        print(f"Ollama warm-up failed for '{model_name}': {errors[0]}")
+        return
+    load_seconds = round(time.perf_counter() - start, 2)
+    _set_state(model_name, status="ready", load_seconds=load_seconds, last_warmed=time.time(), error=None)
+    print(f"Ollama model '{model_name}' warmed up on {len(endpoints) - len(errors)}/{len(endpoints)} endpoint(s) in {load_seconds}s")
+
+
+def start_warm_up(model_name, force=False):
+    """
+    Preloads a model in a background thread. Does nothing if it is already
+    loading, or was warmed recently enough that its keep_alive has not run
+    down (unless force is set). Returns the model's current state.
+    """
+    with _states_lock:
+        state = _states.setdefault(model_name, {"status": "unknown"})
+        if state["status"] == "loading":
+            return dict(state)
+        keep_alive = parse_duration(llm_backend.OLLAMA_KEEP_ALIVE)
+        refresh_after = keep_alive / 2 if keep_alive > 0 else float("inf")
+        recently_warmed = time.time() - state.get("last_warmed", 0) < refresh_after
+        if not force and state["status"] == "ready" and recently_warmed:
+            return dict(state)
+        if not force and state["status"] == "failed" and time.time() - state.get("last_warmed", 0) < 30:
+            return dict(state)
+        state.update(status="loading", started=time.time())
+        snapshot = dict(state)
+    threading.Thread(target=_warm_up, args=(model_name,), name=f"ollama-warmup-{model_name}", daemon=True).start()
+    return snapshot
+
+
+def warm_up_routed_models():
+    """Also preloads the installed offline models that llm_routing sends cheap stages to."""
+    if not llm_routing.LLM_ROUTING_ENABLED:
+        return
+    installed = llm_backend.get_installed_ollama_models()
+    for model_name in set(filter(None, llm_routing.TIER_MODELS["offline"].values())):
+        if model_name in installed:
+            start_warm_up(model_name)
+
+
+def unload_model(model_name):
+    """Asks every Ollama endpoint to drop a model from memory right away (keep_alive 0)."""
+    for endpoint in ollama_pool.get_pool().endpoints:
+        try:
+            http_client.post(f"{endpoint.url}/api/generate", json={"model": model_name, "keep_alive": 0})
+            endpoint.loaded.discard(model_name)
+        except Exception as e:
+            print(f"Could not unload Ollama model '{model_name}' at {endpoint.url}: {e}")
+    _set_state(model_name, status="unknown", last_warmed=0)
+
+
+def switch_model(previous_model, new_model):
+    """Starts warming the newly selected model and optionally unloads the old one."""
+    state = start_warm_up(new_model)
+    if OLLAMA_UNLOAD_ON_SWITCH and previous_model and previous_model != new_model:
+        threading.Thread(target=unload_model, args=(previous_model,), daemon=True).start()
+    return state
+
+
+def get_loaded_models():
+    """
+    Models the Ollama endpoints currently hold in memory (from /api/ps), each
+    tagged with its endpoint as "host"; unreachable endpoints are skipped.
+    """
+    models = []
+    for endpoint in ollama_pool.get_pool().endpoints:
+        try:
+            response = http_client.get(f"{endpoint.url}/api/ps", timeout=(2, 5))
+            if response.status_code != 200:
+                continue
+            models.extend({**model, "host": endpoint.url} for model in response.json().get("models", []))
+        except Exception:
+            continue
+    return models
+
+
+def describe_state(model_name):
+    """One-line load state for the UI."""
+    state = get_model_state(model_name)
+    status = state["status"]
+    if status == "loading":
+        return f"⏳ Loading '{model_name}' into memory..."
+    if status == "ready":
+        return f"🟢 '{model_name}' loaded and ready (load took {state.get('load_seconds', 0)}s)"
+    if status == "failed":
+        return f"🔴 Could not load '{model_name}': {state.get('error')}"
+    return f"⚪ '{model_name}' not loaded yet"
@@ -0,0 +1,247 @@
+import os
+import time
+import random
+import threading
+
+import http_client
+
+# --- POOL CONFIGURATION ---
+# OLLAMA_HOSTS is a comma-separated list of Ollama base URLs. Requests go to the
+# healthy endpoint with the fewest requests in flight, preferring endpoints that
+# already hold the model in memory and skipping ones that do not have it
+# installed. Without OLLAMA_HOSTS the pool is just OLLAMA_BASE_URL.
+OLLAMA_HOSTS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).split(",")
+    if url.strip()
+]
+# Background health checks (/api/ps and /api/tags) run only when there are several endpoints.
+OLLAMA_HEALTH_CHECK_SECONDS = float(os.getenv("OLLAMA_HEALTH_CHECK_SECONDS", "15"))
+# An endpoint that refused a connection is skipped for this long (or until a health check passes).
+OLLAMA_ENDPOINT_RETRY_SECONDS = float(os.getenv("OLLAMA_ENDPOINT_RETRY_SECONDS", "10"))
+# Model lists older than this are refreshed before they are used for routing decisions.
+MODEL_LIST_MAX_AGE = 60
+
+# Errors that mean "this endpoint is unreachable" (matched by class name, as in llm_resilience).
+FAILOVER_ERROR_NAMES = {"ConnectionError", "ConnectTimeout", "ConnectionRefusedError"}
+
+
+class NoHealthyEndpointError(RuntimeError):
+    """Raised when every Ollama endpoint has been tried (or is down) for a request."""
+
+
+class OllamaEndpoint:
+    """One Ollama server: in-flight count, health and the models it has installed / loaded."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.installed = None   # set of model names, None until the first health check
+        self.loaded = set()
+        self.checked = 0.0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def has_model(self, model_name):
+        return self.installed is None or model_name in self.installed
+
+    def snapshot(self):
+        return {
+            "url": self.url, "healthy": self.healthy, "outstanding": self.outstanding,
+            "requests": self.requests, "failures": self.failures,
+            "loaded": sorted(self.loaded), "installed": None if self.installed is None else len(self.installed),
+        }
+
+
+def _is_failover_error(error):
+    if getattr(error, "status_code", None) == 404:
+        return True  # model not found on this endpoint
+    return any(cls.__name__ in FAILOVER_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def _model_names(models):
+    names = set()
+    for model in models:
+        names.update(name for name in (model.get("name"), model.get("model")) if name)
+    return names
+
+
+class OllamaPool:
+    """Least-outstanding-requests balancer with model affinity and failover over Ollama endpoints."""
+
+    def __init__(self, urls):
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.lock = threading.Lock()
+        self.failovers = 0
+        self._checker = None
+
+    # --- endpoint selection ---
+    def _pick(self, model_name, exclude):
+        """Best endpoint for a model, or None once every endpoint has been tried."""
+        candidates = [e for e in self.endpoints if e.url not in exclude]
+        if not candidates:
+            return None
+        for narrow in (lambda e: e.healthy, lambda e: e.has_model(model_name), lambda e: model_name in e.loaded):
+            narrowed = [e for e in candidates if narrow(e)]
+            if narrowed:
+                candidates = narrowed
+        fewest = min(e.outstanding for e in candidates)
+        return random.choice([e for e in candidates if e.outstanding == fewest])
+
+    def _begin(self, model_name, exclude):
+        with self.lock:
+            endpoint = self._pick(model_name, exclude)
+            if endpoint is not None:
+                endpoint.outstanding += 1
+                endpoint.requests += 1
+            return endpoint
+
+    def _end(self, endpoint, model_name, error=None):
+        with self.lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.loaded.add(model_name)
+                return
+            endpoint.failures += 1
+            if getattr(error, "status_code", None) == 404:
+                if endpoint.installed is not None:
+                    endpoint.installed.discard(model_name)
+                endpoint.loaded.discard(model_name)
+            else:
+                endpoint.down_until = time.monotonic() + OLLAMA_ENDPOINT_RETRY_SECONDS
+
+    def _should_fail_over(self, error, tried):
+        if not _is_failover_error(error) or len(tried) >= len(self.endpoints):
+            return False
+        with self.lock:
+            self.failovers += 1
+        print(f"Ollama endpoint failed ({error}); failing over to another endpoint")
+        return True
+
+    # --- requests ---
+    def request(self, model_name, fn):
+        """
+        Calls fn(base_url) on the best endpoint for model_name. Connection
+        errors and "model not found" responses fail over to the next endpoint.
+        """
+        self.ensure_health_checks()
+        tried = set()
+        while True:
+            endpoint = self._begin(model_name, tried)
+            if endpoint is None:
+                raise NoHealthyEndpointError(f"No Ollama endpoint could serve '{model_name}'")
+            tried.add(endpoint.url)
+            try:
+                result = fn(endpoint.url)
+            except Exception as e:
+                self._end(endpoint, model_name, e)
+                if self._should_fail_over(e, tried):
+                    continue
+                raise
+            self._end(endpoint, model_name)
+            return result
+
+    def stream(self, model_name, stream_fn):
+        """
+        Streaming counterpart of request: yields from stream_fn(base_url).
+        Fails over only before the first token; the endpoint counts as busy
+        until the stream finishes or is closed.
+        """
+        self.ensure_health_checks()
+        tried = set()
+        while True:
+            endpoint = self._begin(model_name, tried)
+            if endpoint is None:
+                raise NoHealthyEndpointError(f"No Ollama endpoint could serve '{model_name}'")
+            tried.add(endpoint.url)
+            started = False
+            error = None
+            try:
+                for token in stream_fn(endpoint.url):
+                    started = True
+                    yield token
+            except Exception as e:
+                error = e
+                if not started and self._should_fail_over(e, tried):
+                    continue
+                raise
+            finally:
+                self._end(endpoint, model_name, error)
+            return
+
+    # --- health checks ---
+    def check_endpoint(self, endpoint):
+        """Refreshes one endpoint's health plus installed (/api/tags) and loaded (/api/ps) models."""
+        try:
+            tags = http_client.get(f"{endpoint.url}/api/tags", timeout=(2, 5))
+            ps = http_client.get(f"{endpoint.url}/api/ps", timeout=(2, 5))
+            if tags.status_code != 200 or ps.status_code != 200:
+                raise RuntimeError(f"status {tags.status_code}/{ps.status_code}")
+            installed = _model_names(tags.json().get("models", []))
+            loaded = _model_names(ps.json().get("models", []))
+        except Exception as e:
+            with self.lock:
+                endpoint.down_until = time.monotonic() + OLLAMA_ENDPOINT_RETRY_SECONDS
+                endpoint.checked = time.monotonic()
+            print(f"Ollama endpoint {endpoint.url} failed its health check: {e}")
+            return False
+        with self.lock:
+            endpoint.installed, endpoint.loaded = installed, loaded
+            endpoint.down_until = 0.0
+            endpoint.checked = time.monotonic()
+        return True
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            self.check_endpoint(endpoint)
+
+    def ensure_health_checks(self):
+        """Starts the background health checker (once) when the pool has several endpoints."""
+        if len(self.endpoints) < 2 or self._checker is not None:
+            return
+        with self.lock:
+            if self._checker is not None:
+                return
+            self._checker = threading.Thread(target=self._health_loop, name="ollama-health-check", daemon=True)
+        self._checker.start()
+
+    def _health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(OLLAMA_HEALTH_CHECK_SECONDS)
+
+    def installed_models(self):
+        """Union of the models installed on reachable endpoints (refreshing stale lists first)."""
+        names = set()
+        for endpoint in self.endpoints:
+            if time.monotonic() - endpoint.checked > MODEL_LIST_MAX_AGE:
+                self.check_endpoint(endpoint)
+            if endpoint.healthy and endpoint.installed:
+                names |= endpoint.installed
+        return names
+
+    def get_stats(self):
+        with self.lock:
+            return {"failovers": self.failovers, "endpoints": [e.snapshot() for e in self.endpoints]}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool over OLLAMA_HOSTS."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OllamaPool(OLLAMA_HOSTS)
+        return _pool
+
+
+def get_pool_stats():
+    return get_pool().get_stats()
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# --- SHARED PREFIX CONFIGURATION ---
+# Per-column question prompts and per-question script prompts share a long
+# prefix (survey description + instructions). Offline, that prefix is passed
+# separately so Ollama evaluates it once per session instead of on every call:
+#   chat    - prefix as the system message of /api/chat; Ollama keeps the KV cache
+#             of the common message prefix between calls (default)
+#   context - the prefix is evaluated once via /api/generate and its returned
+#             "context" tokens are carried into every follow-up call
+#   off     - prefix and prompt are concatenated into one /api/generate prompt
+OLLAMA_PREFIX_MODE = os.getenv("OLLAMA_PREFIX_MODE", "chat")
+PREFIX_MODES = ("chat", "context", "off")
+# Evaluated prefix contexts kept per (model, prefix).
+PREFIX_CONTEXT_CACHE_SIZE = int(os.getenv("OLLAMA_PREFIX_CONTEXT_CACHE_SIZE", "32"))
+
+_lock = threading.Lock()
+_contexts = OrderedDict()
+_key_locks = {}
+_context_unsupported = set()  # models whose responses carried no "context"
+_stats = {}
+
+
+def get_mode(model_name):
+    """The prefix mode to use for a model (context falls back to off if Ollama returned no context)."""
+    mode = OLLAMA_PREFIX_MODE if OLLAMA_PREFIX_MODE in PREFIX_MODES else "chat"
+    if mode == "context" and model_name in _context_unsupported:
+        return "off"
+    return mode
+
+
+def request_fields(mode, prompt, prefix, context=None):
+    """(API path, prompt fields) of an Ollama request whose prompt starts with prefix."""
+    if not prefix or mode == "off":
+        return "/api/generate", {"prompt": (prefix or "") + prompt}
+    if mode == "chat":
+        return "/api/chat", {"messages": [
+            {"role": "system", "content": prefix},
+            {"role": "user", "content": prompt.lstrip()},
+        ]}
+    return "/api/generate", {"prompt": prompt.lstrip(), "context": context}
+
+
+def response_text(body):
+    """Response text of an /api/generate or /api/chat body (or stream chunk)."""
+    if "message" in body:
+        return (body.get("message") or {}).get("content", "")
+    return body.get("response", "")
+
+
+def _context_key(model_name, prefix):
+    return (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+
+
+def get_context(model_name, prefix, prime_fn):
+    """
+    Evaluated context tokens for prefix, calling prime_fn() -> (context, prefill_ms)
+    once per (model, prefix). Returns None (and switches the model to "off") if
+    Ollama does not return a context.
+    """
+    key = _context_key(model_name, prefix)
+    with _lock:
+        if key in _contexts:
+            _contexts.move_to_end(key)
+            return _contexts[key]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # Concurrent calls with the same prefix wait for a single priming request.
+    with key_lock:
+        with _lock:
+            if key in _contexts:
+                return _contexts[key]
+        context, prefill_ms = prime_fn()
+        with _lock:
+            _key_locks.pop(key, None)
+            if not context:
+                _context_unsupported.add(model_name)
+                print(f"Ollama returned no context for '{model_name}'; using concatenated prompts")
+                return None
+            _contexts[key] = context
+            while len(_contexts) > PREFIX_CONTEXT_CACHE_SIZE:
+                _contexts.popitem(last=False)
+            _count("context", "primes", 1)
+            _count("context", "prime_ms", prefill_ms or 0)
+        return context
+
+
+def _count(mode, counter, amount):
+    counters = _stats.setdefault(mode, {"calls": 0, "prefill_ms": 0.0, "prompt_tokens": 0, "primes": 0, "prime_ms": 0.0})
+    counters[counter] += amount
+
+
+def record_call(mode, usage):
+    """Adds one prefixed call's prefill time / evaluated prompt tokens (from usage) to the stats."""
+    with _lock:
+        _count(mode, "calls", 1)
+        _count(mode, "prefill_ms", usage.get("prefill_ms") or 0)
+        _count(mode, "prompt_tokens", usage.get("prompt_tokens") or 0)
+
+
+def get_prefix_stats():
+    """Per-mode call counts with total and average prefill time for prefixed Ollama calls."""
+    with _lock:
+        stats = {mode: dict(counters) for mode, counters in _stats.items()}
+    for counters in stats.values():
+        counters["prefill_ms"] = round(counters["prefill_ms"], 1)
+        counters["prime_ms"] = round(counters["prime_ms"], 1)
+        counters["avg_prefill_ms"] = round(counters["prefill_ms"] / counters["calls"], 1) if counters["calls"] else None
+    return stats
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
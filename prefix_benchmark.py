@@ -0,0 +1,83 @@
+"""
+Measures Ollama prefill (prompt evaluation) time for the per-column question
+prompts of one survey with each shared-prefix mode (see ollama_prefix).
+
+    python prefix_benchmark.py                           # default survey, all modes
+    python prefix_benchmark.py --model gemma3:latest --modes off,chat
+    python prefix_benchmark.py --description "..." --headers "Name,Age,Village"
+
+Responses are never cached. Note that Ollama may already reuse a prefix for
+back-to-back prompts in "off" mode; interleaving with other sessions (what the
+prefix modes protect against) is simulated with --interleave.
+"""
+import time
+import argparse
+
+import llm_backend
+import ollama_prefix
+import survey_generation
+
+DEFAULT_DESCRIPTION = (
+    "Survey Design: Household survey of PM Awas Yojana (Gramin) beneficiaries at district level, "
+    "monitoring construction progress of sanctioned houses, instalment releases and amenities such as "
+    "toilets, LPG connections and electricity, to support monitoring and evaluation of the scheme."
+)
+DEFAULT_HEADERS = [
+    "District", "Block", "Gram_Panchayat", "Household_ID", "Head_of_Household_Name", "Aadhaar_Number",
+    "Sanction_Date", "Instalments_Received", "Construction_Stage", "Toilet_Available",
+    "LPG_Connection", "Electricity_Connection",
+]
+OTHER_SESSION_DESCRIPTION = "Survey Design: Annual state-level survey of school enrolment and mid-day meal coverage."
+
+
+def run_mode(backend, mode, description, headers, interleave):
+    """Generates every column's question in one mode; returns that mode's prefix stats plus wall time."""
+    ollama_prefix.OLLAMA_PREFIX_MODE = mode
+    ollama_prefix.reset_stats()
+    prefix = survey_generation.build_question_prefix(description)
+    other_prefix = survey_generation.build_question_prefix(OTHER_SESSION_DESCRIPTION)
+    start = time.perf_counter()
+    for header in headers:
+        backend.generate(survey_generation.build_question_suffix(header), purpose="prefix_benchmark",
+                         use_cache=False, schema=survey_generation.QUESTION_SCHEMA, prefix=prefix)
+        if interleave:
+            # Another session's call between ours evicts a naively cached prompt prefix.
+            backend.generate(survey_generation.build_question_suffix(header), purpose="prefix_benchmark_other",
+                             use_cache=False, schema=survey_generation.QUESTION_SCHEMA, prefix=other_prefix)
+    wall_s = time.perf_counter() - start
+    stats = ollama_prefix.get_prefix_stats().get(mode, {})
+    if interleave:
+        # Both sessions are counted; report this survey's share.
+        for key in ("calls", "prefill_ms", "prompt_tokens"):
+            stats[key] = stats.get(key, 0) / 2
+    return {"mode": mode, "wall_s": wall_s, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama prefill time per survey for each prefix mode.")
+    parser.add_argument("--model", default=llm_backend.DEFAULT_OLLAMA_MODEL, help="Ollama model to benchmark")
+    parser.add_argument("--description", default=DEFAULT_DESCRIPTION, help="survey description (shared prefix)")
+    parser.add_argument("--headers", help="comma-separated column headers")
+    parser.add_argument("--modes", default=",".join(ollama_prefix.PREFIX_MODES), help="modes to compare")
+    parser.add_argument("--interleave", action="store_true", help="interleave calls from a second survey")
+    args = parser.parse_args()
+
+    headers = [h.strip() for h in args.headers.split(",")] if args.headers else DEFAULT_HEADERS
+    backend = llm_backend.get_backend("offline", args.model)
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"Running {len(headers)} columns in '{mode}' mode...")
+        results.append(run_mode(backend, mode, args.description, headers, args.interleave))
+
+    baseline = next((r for r in results if r["mode"] == "off"), None)
+    header = f"{'mode':<8} {'calls':>6} {'prefill ms':>11} {'prompt tok':>11} {'prime ms':>9} {'wall s':>8} {'saved ms':>9}"
+    print("\n" + header + "\n" + "-" * len(header))
+    for r in results:
+        spent = r.get("prefill_ms", 0) + r.get("prime_ms", 0)
+        saved = f"{baseline.get('prefill_ms', 0) - spent:,.0f}" if baseline and r is not baseline else "-"
+        print(f"{r['mode']:<8} {r.get('calls', 0):>6.0f} {r.get('prefill_ms', 0):>11,.0f} {r.get('prompt_tokens', 0):>11,.0f} "
+              f"{r.get('prime_ms', 0):>9,.0f} {r['wall_s']:>8.1f} {saved:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import threading
+from datetime import datetime
+
+# --- PROMPT LOG CONFIGURATION ---
+# Active file: prompt_logs/prompts_YYYYMMDD.jsonl. Closed files (previous days,
+# or parts rotated out at PROMPT_LOG_MAX_BYTES) are gzipped next to it as
+# prompts_YYYYMMDD.jsonl.gz / prompts_YYYYMMDD.N.jsonl.gz.
+PROMPT_LOG_DIR = os.getenv("PROMPT_LOG_DIR", "prompt_logs")
+PROMPT_LOG_ENABLED = os.getenv("PROMPT_LOG_ENABLED", "1") != "0"
+# Set PROMPT_LOG_ASYNC=0 to write synchronously on the calling thread.
+PROMPT_LOG_ASYNC = os.getenv("PROMPT_LOG_ASYNC", "1") != "0"
+PROMPT_LOG_BATCH_SIZE = int(os.getenv("PROMPT_LOG_BATCH_SIZE", "50"))
+PROMPT_LOG_FLUSH_SECONDS = float(os.getenv("PROMPT_LOG_FLUSH_SECONDS", "2"))
+PROMPT_LOG_QUEUE_SIZE = int(os.getenv("PROMPT_LOG_QUEUE_SIZE", "10000"))
+PROMPT_LOG_MAX_BYTES = int(os.getenv("PROMPT_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+
+_write_lock = threading.Lock()
+_writer = None
+_writer_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"records": 0, "written": 0, "dropped": 0, "batches": 0, "rotations": 0}
+_STOP = object()
+
+
+def _count(counter, amount=1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+
+def log_filename(day=None):
+    day = day or datetime.now()
+    return os.path.join(PROMPT_LOG_DIR, f"prompts_{day.strftime('%Y%m%d')}.jsonl")
+
+
+def _compress(path):
+    """Gzips a closed log file in place (path -> path.gz) and removes the original."""
+    try:
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+    except OSError as e:
+        print(f"Could not compress prompt log {path}: {e}")
+
+
+def _rotate_for_size(path):
+    """Moves a full active file to the next free prompts_YYYYMMDD.N.jsonl and gzips it."""
+    base = path[:-len(".jsonl")]
+    part = 1
+    while os.path.exists(f"{base}.{part}.jsonl") or os.path.exists(f"{base}.{part}.jsonl.gz"):
+        part += 1
+    rotated = f"{base}.{part}.jsonl"
+    os.replace(path, rotated)
+    _compress(rotated)
+    _count("rotations")
+
+
+def _compress_stale_logs(current_path):
+    """Gzips any uncompressed log file other than the active one (e.g. from earlier days)."""
+    for path in glob.glob(os.path.join(PROMPT_LOG_DIR, "prompts_*.jsonl")):
+        if os.path.abspath(path) != os.path.abspath(current_path):
+            _compress(path)
+            _count("rotations")
+
+
+def _write_lines(lines):
+    """Appends lines to today's file, rotating by date and size. Runs under _write_lock."""
+    os.makedirs(PROMPT_LOG_DIR, exist_ok=True)
+    path = log_filename()
+    if os.path.exists(path) and os.path.getsize(path) >= PROMPT_LOG_MAX_BYTES:
+        _rotate_for_size(path)
+    with open(path, "a", encoding="utf-8") as log_file:
+        log_file.writelines(lines)
+    _count("written", len(lines))
+    _count("batches")
+    return path
+
+
+class _PromptLogWriter(threading.Thread):
+    """Drains the record queue, writing a batch every PROMPT_LOG_BATCH_SIZE records or PROMPT_LOG_FLUSH_SECONDS."""
+
+    def __init__(self):
+        super().__init__(name="prompt-log-writer", daemon=True)
+        self.queue = queue.Queue(maxsize=PROMPT_LOG_QUEUE_SIZE)
+        self.current_path = None
+
+    def run(self):
+        batch = []
+        deadline = time.monotonic() + PROMPT_LOG_FLUSH_SECONDS
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if isinstance(item, threading.Event):
+                self._flush(batch)
+                batch = []
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= PROMPT_LOG_BATCH_SIZE or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + PROMPT_LOG_FLUSH_SECONDS
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            with _write_lock:
+                path = _write_lines(batch)
+                if path != self.current_path:
+                    # First write, or the date changed: close out older files.
+                    _compress_stale_logs(path)
+                    self.current_path = path
+        except OSError as e:
+            _count("dropped", len(batch))
+            print(f"Could not write prompt log: {e}")
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = _PromptLogWriter()
+                writer.start()
+                atexit.register(shutdown)
+                _writer = writer
+    return _writer
+
+
+def log_record(record):
+    """
+    Queues one record (a JSON-serialisable dict) for today's prompt log. The
+    background writer does the disk I/O; if its queue is full the record is
+    dropped (and counted) rather than blocking the LLM call.
+    """
+    if not PROMPT_LOG_ENABLED:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    _count("records")
+    if not PROMPT_LOG_ASYNC:
+        with _write_lock:
+            _write_lines([line])
+        return
+    try:
+        _get_writer().queue.put_nowait(line)
+    except queue.Full:
+        _count("dropped")
+
+
+def flush(timeout=5.0):
+    """Blocks until every record queued so far has been written (or timeout)."""
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return True
+    done = threading.Event()
+    try:
+        writer.queue.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+
+def shutdown(timeout=5.0):
+    """Writes any pending records and stops the writer (registered with atexit)."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is None or not writer.is_alive():
+        return
+    try:
+        writer.queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    writer.join(timeout)
+
+
+def get_log_stats():
+    """Counters for this process: queued records, written, dropped, batches, rotations."""
+    with _stats_lock:
+        stats = dict(_stats)
+    writer = _writer
+    stats["pending"] = writer.queue.qsize() if writer is not None else 0
+    return stats
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used when the backend reports none."""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+class LLMCallRecord:
+    """
+    Telemetry for one LLM call. Backends fill in usage (prompt_tokens /
+    response_tokens as reported by the API) and clear cache_hit when the
+    model is actually called; finish() writes the record.
+    """
+
+    def __init__(self, backend, model_name, purpose, prompt, streamed=False):
+        self.backend = backend
+        self.model_name = model_name
+        self.purpose = purpose or ""
+        self.prompt = prompt
+        self.streamed = streamed
+        self.cache_hit = True
+        self.usage = {}
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.timestamp = datetime.now().isoformat()
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, response_text, outcome=None, error=None):
+        """Builds and logs the record. outcome defaults to ok / empty / error."""
+        latency = time.perf_counter() - self.started
+        if error is not None:
+            outcome = "error"
+        elif outcome is None:
+            outcome = "ok" if response_text else "empty"
+        ttft = self.first_token_at - self.started if self.first_token_at is not None else None
+        if ttft is None and not self.streamed and outcome == "ok":
+            ttft = latency
+
+        prompt_tokens = self.usage.get("prompt_tokens")
+        response_tokens = self.usage.get("response_tokens")
+        estimated = prompt_tokens is None or response_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(self.prompt)
+        if response_tokens is None:
+            response_tokens = estimate_tokens(response_text)
+
+        record = {
+            "timestamp": self.timestamp,
+            "backend": self.backend,
+            "model": self.model_name,
+            "purpose": self.purpose,
+            "prompt": self.prompt,
+            "latency_ms": round(latency * 1000, 1),
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "tokens_estimated": estimated,
+            "response_chars": len(response_text or ""),
+            "cache_hit": self.cache_hit,
+            "streamed": self.streamed,
+            "outcome": outcome,
+        }
+        for key in ("prefill_ms", "prefix_mode"):
+            if self.usage.get(key) is not None:
+                record[key] = self.usage[key]
+        if error is not None:
+            record["error"] = str(error)
+        try:
+            log_record(record)
+        except OSError as e:
+            print(f"Could not write prompt log: {e}")
+        return record
@@ -0,0 +1,141 @@
+"""
+Aggregates prompt_logs/*.jsonl into per-purpose / per-model latency and token stats.
+
+    python prompt_report.py                      # all logs, grouped by purpose and model
+    python prompt_report.py --since 20250101 --by purpose
+    python prompt_report.py --dir other_logs --by model
+"""
+import os
+import glob
+import gzip
+import json
+import argparse
+from collections import defaultdict
+
+import prompt_log
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def iter_records(log_dir, since=None):
+    """Yields every record from the daily log files (plain and rotated .gz), oldest first."""
+    paths = glob.glob(os.path.join(log_dir, "prompts_*.jsonl")) + glob.glob(os.path.join(log_dir, "prompts_*.jsonl.gz"))
+    for path in sorted(paths):
+        day = os.path.basename(path)[len("prompts_"):len("prompts_") + 8]
+        if since and day < since:
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def group_key(record, by):
+    purpose = record.get("purpose") or "(none)"
+    model = record.get("model") or "(unknown)"
+    if by == "purpose":
+        return (purpose,)
+    if by == "model":
+        return (model,)
+    return (purpose, model)
+
+
+def aggregate(records, by="purpose_model"):
+    """
+    Returns one summary dict per group, sorted by total latency (the stage that
+    dominates wall-clock time first). Records from before telemetry existed
+    count as calls but do not contribute latency or token figures.
+    """
+    groups = defaultdict(lambda: {"calls": 0, "cache_hits": 0, "errors": 0,
+                                  "latencies": [], "ttfts": [], "prefills": [],
+                                  "prompt_tokens": 0, "response_tokens": 0})
+    for record in records:
+        group = groups[group_key(record, by)]
+        group["calls"] += 1
+        if record.get("cache_hit"):
+            group["cache_hits"] += 1
+        if record.get("outcome") == "error":
+            group["errors"] += 1
+        if record.get("latency_ms") is not None:
+            group["latencies"].append(record["latency_ms"])
+        if record.get("ttft_ms") is not None:
+            group["ttfts"].append(record["ttft_ms"])
+        if record.get("prefill_ms") is not None:
+            group["prefills"].append(record["prefill_ms"])
+        group["prompt_tokens"] += record.get("prompt_tokens") or 0
+        group["response_tokens"] += record.get("response_tokens") or 0
+
+    total_latency = sum(sum(g["latencies"]) for g in groups.values()) or 1
+    summaries = []
+    for key, group in groups.items():
+        summaries.append({
+            "group": " / ".join(key),
+            "calls": group["calls"],
+            "cache_hits": group["cache_hits"],
+            "errors": group["errors"],
+            "p50_ms": percentile(group["latencies"], 50),
+            "p95_ms": percentile(group["latencies"], 95),
+            "p50_ttft_ms": percentile(group["ttfts"], 50),
+            "p50_prefill_ms": percentile(group["prefills"], 50),
+            "total_s": sum(group["latencies"]) / 1000,
+            "share": sum(group["latencies"]) / total_latency,
+            "prompt_tokens": group["prompt_tokens"],
+            "response_tokens": group["response_tokens"],
+        })
+    summaries.sort(key=lambda s: s["total_s"], reverse=True)
+    return summaries
+
+
+def format_report(summaries):
+    def ms(value):
+        return "-" if value is None else f"{value:,.0f}"
+
+    header = (f"{'group':<48} {'calls':>6} {'hits':>5} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p50 ttft':>9} {'prefill':>8} {'total s':>9} {'share':>6} {'prompt tok':>11} {'resp tok':>10}")
+    lines = [header, "-" * len(header)]
+    for s in summaries:
+        lines.append(
+            f"{s['group'][:48]:<48} {s['calls']:>6} {s['cache_hits']:>5} {s['errors']:>5} "
+            f"{ms(s['p50_ms']):>9} {ms(s['p95_ms']):>9} {ms(s['p50_ttft_ms']):>9} {ms(s['p50_prefill_ms']):>8} "
+            f"{s['total_s']:>9.1f} {s['share']:>6.1%} {s['prompt_tokens']:>11,} {s['response_tokens']:>10,}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise LLM call latency and tokens from prompt logs.")
+    parser.add_argument("--dir", default=prompt_log.PROMPT_LOG_DIR, help="prompt log directory")
+    parser.add_argument("--since", help="only include logs from this day on (YYYYMMDD)")
+    parser.add_argument("--by", choices=["purpose_model", "purpose", "model"], default="purpose_model",
+                        help="grouping for the report")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+    prompt_log.flush()
+
+    summaries = aggregate(iter_records(args.dir, args.since), args.by)
+    if not summaries:
+        print(f"No prompt log records found in {args.dir}")
+        return
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print(format_report(summaries))
+
+
+if __name__ == "__main__":
+    main()
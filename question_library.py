@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+import survey_generation
+
+# --- QUESTION LIBRARY CONFIGURATION ---
+# Questions of surveys the user has saved or deployed (their survey_jsons/
+# file, passed to accept_survey) are stored by normalised column header, once
+# per sector and once sector-independent, so recurring columns (age,
+# household_size, district_name, ...) are filled from the library and only
+# novel headers are sent to the LLM. Unreviewed job output is never imported.
+QUESTION_LIBRARY_PATH = os.getenv("QUESTION_LIBRARY_PATH", "question_library.db")
+QUESTION_LIBRARY_ENABLED = os.getenv("QUESTION_LIBRARY_ENABLED", "1") != "0"
+# Where the blueprints of saved surveys (for the sector) are read from.
+SURVEY_RESPONSES_DIR = "survey_responses"
+QUESTION_KEYS = ["question", "description", "type"]
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"lookups": 0, "hits": 0, "sector_hits": 0, "added": 0, "files_imported": 0}
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def _get_connection():
+    """Opens (once per process) the SQLite store and creates the tables."""
+    global _conn
+    if _conn is None:
+        db_dir = os.path.dirname(QUESTION_LIBRARY_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _conn = sqlite3.connect(QUESTION_LIBRARY_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS library_questions (
+                header_key TEXT NOT NULL,
+                sector TEXT NOT NULL,
+                question TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (header_key, sector)
+            )
+        """)
+        # Accepted survey files already imported, so each one is read once (again only if it changes).
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS library_sources (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+
+def normalize_header(header):
+    """Library key of a column header: 'HouseholdSize', 'Household Size ' and 'household-size' -> 'household_size'."""
+    return _NON_WORD.sub("_", _CAMEL.sub(r"\1_\2", str(header).strip()).lower()).strip("_")
+
+
+def _store(conn, questions, sector):
+    """
+    Upserts (column, question) pairs under their sector and sector-independently.
+    Placeholder questions (survey_generation.default_question) are skipped.
+    """
+    now = time.time()
+    added = 0
+    for question in questions:
+        key = normalize_header(question.get("column", ""))
+        if not key or any(not isinstance(question.get(k), str) or not question[k].strip() for k in QUESTION_KEYS):
+            continue
+        if {k: question[k] for k in QUESTION_KEYS} == survey_generation.default_question(question["column"]):
+            continue
+        value = json.dumps({k: question[k] for k in QUESTION_KEYS}, ensure_ascii=False)
+        for qualifier in {sector or "", ""}:
+            conn.execute(
+                "INSERT INTO library_questions (header_key, sector, question, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (header_key, sector) DO UPDATE SET question = excluded.question, "
+                "uses = uses + 1, updated_at = excluded.updated_at",
+                (key, qualifier, value, now)
+            )
+        added += 1
+    return added
+
+
+def _survey_sector(stem):
+    """Sector classification of a saved survey, from its blueprint (survey_responses/<stem>.json)."""
+    try:
+        with open(os.path.join(SURVEY_RESPONSES_DIR, f"{stem}.json"), "r", encoding="utf-8") as f:
+            return (json.load(f).get("classifications") or {}).get("sectoral")
+    except (OSError, json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _survey_columns(stem):
+    """Column headers of a saved survey's CSV, used to label questions from before they carried "column"."""
+    try:
+        with open(os.path.join(SURVEY_RESPONSES_DIR, f"{stem}.csv"), "r", encoding="utf-8") as f:
+            return [h.strip() for h in f.readline().strip().split(",")]
+    except OSError:
+        return None
+
+
+def _load_survey_questions(path, stem):
+    with open(path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    if not isinstance(questions, list):
+        return []
+    questions = [q for q in questions if isinstance(q, dict)]
+    if questions and not all(q.get("column") for q in questions):
+        columns = _survey_columns(stem)
+        if not columns or len(columns) != len(questions):
+            return []
+        questions = [{"column": column, **q} for column, q in zip(columns, questions)]
+    return questions
+
+
+def accept_survey(json_path):
+    """
+    Imports the questions of a survey the user has saved or deployed
+    (survey_jsons/<name>.json), unless that file was imported unchanged before.
+    """
+    if not QUESTION_LIBRARY_ENABLED or not json_path:
+        return
+    stem = os.path.splitext(os.path.basename(json_path))[0]
+    try:
+        mtime = os.path.getmtime(json_path)
+        with _lock:
+            conn = _get_connection()
+            known = conn.execute("SELECT mtime FROM library_sources WHERE path = ?", (json_path,)).fetchone()
+            if known and known[0] == mtime:
+                return
+            _stats["added"] += _store(conn, _load_survey_questions(json_path, stem), _survey_sector(stem))
+            conn.execute("INSERT OR REPLACE INTO library_sources (path, mtime) VALUES (?, ?)", (json_path, mtime))
+            conn.commit()
+            _stats["files_imported"] += 1
+    except (OSError, json.JSONDecodeError, sqlite3.Error) as e:
+        print(f"Could not import {json_path} into the question library: {e}")
+
+
+def lookup(headers, sector=None):
+    """
+    Library questions for the given column headers: {header: question} for
+    every header whose normalised key is known, preferring the entry for the
+    survey's sector over the sector-independent one.
+    """
+    if not QUESTION_LIBRARY_ENABLED or not headers:
+        return {}
+    try:
+        keys = {header: normalize_header(header) for header in headers}
+        with _lock:
+            conn = _get_connection()
+            placeholders = ",".join("?" * len(set(keys.values())))
+            rows = conn.execute(
+                f"SELECT header_key, sector, question FROM library_questions WHERE header_key IN ({placeholders}) "
+                "AND sector IN (?, '')",
+                (*set(keys.values()), sector or "")
+            ).fetchall()
+            by_key = {}
+            for key, row_sector, question in rows:
+                if key not in by_key or row_sector:
+                    by_key[key] = (row_sector, json.loads(question))
+            found = {header: by_key[key][1] for header, key in keys.items() if key in by_key}
+            _stats["lookups"] += len(headers)
+            _stats["hits"] += len(found)
+            _stats["sector_hits"] += sum(1 for key in keys.values() if key in by_key and by_key[key][0])
+        return found
+    except sqlite3.Error as e:
+        print(f"Question library unavailable: {e}")
+        return {}
+
+
+def get_library_stats():
+    """Lookup / hit counters for this process plus the number of stored questions."""
+    with _lock:
+        stats = dict(_stats)
+        try:
+            stats["entries"] = _get_connection().execute(
+                "SELECT COUNT(*) FROM library_questions WHERE sector = ''"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = None
+    stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+    return stats
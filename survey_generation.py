@@ -0,0 +1,355 @@
+import os
+import json
+
+import json_extract
+import llm_concurrency
+
+# "batched" asks for every column in one LLM call and retries only the columns
+# that come back missing or malformed; "per_column" makes one call per column.
+QUESTION_GENERATION_STRATEGY = os.getenv("QUESTION_GENERATION_STRATEGY", "batched")
+# Set QUESTION_GENERATION_CONCURRENT=0 to fall back to one-column-at-a-time generation.
+QUESTION_GENERATION_CONCURRENT = os.getenv("QUESTION_GENERATION_CONCURRENT", "1") != "0"
+# Fused mode asks for each question's conversational script step ("say" /
+# "explain") in the same call as the question itself, so the script needs no
+# separate call per question. Set QUESTION_SCRIPT_FUSED=0 for separate passes.
+QUESTION_SCRIPT_FUSED = os.getenv("QUESTION_SCRIPT_FUSED", "1") != "0"
+
+QUESTION_KEYS = ["question", "description", "type"]
+QUESTION_TYPES = ["text", "yes/no", "rating_1_10"]
+
+# JSON schemas for structured output (passed to the backend and used to validate replies).
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string", "minLength": 1},
+        "description": {"type": "string", "minLength": 1},
+        "type": {"type": "string", "enum": QUESTION_TYPES},
+    },
+    "required": QUESTION_KEYS,
+}
+BATCH_QUESTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"column": {"type": "string"}, **QUESTION_SCHEMA["properties"]},
+        "required": ["column", *QUESTION_KEYS],
+    },
+}
+SCRIPT_KEYS = ["say", "explain", "question_key"]
+SCRIPT_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "string", "minLength": 1} for key in SCRIPT_KEYS},
+    "required": SCRIPT_KEYS,
+}
+# Fused question + script step; "question_key" is the question text itself.
+FUSED_STEP_KEYS = ["say", "explain"]
+FUSED_QUESTION_KEYS = QUESTION_KEYS + FUSED_STEP_KEYS
+FUSED_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {**QUESTION_SCHEMA["properties"], **{key: {"type": "string", "minLength": 1} for key in FUSED_STEP_KEYS}},
+    "required": FUSED_QUESTION_KEYS,
+}
+BATCH_FUSED_QUESTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"column": {"type": "string"}, **FUSED_QUESTION_SCHEMA["properties"]},
+        "required": ["column", *FUSED_QUESTION_KEYS],
+    },
+}
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM returns nothing at all (connection / API failure)."""
+
+
+def default_question(header):
+    """Fallback question used when the LLM output for a column is unusable."""
+    return {
+        "question": header.replace('_', ' ').title(),
+        "description": "Please provide your input for this question.",
+        "type": "text"
+    }
+
+
+def _mode(fused):
+    """(schema, keys, purpose suffix) of plain or fused question generation."""
+    if fused:
+        return FUSED_QUESTION_SCHEMA, FUSED_QUESTION_KEYS, "_fused"
+    return QUESTION_SCHEMA, QUESTION_KEYS, ""
+
+
+FUSED_KEYS_TEXT = """"say" (a friendly, conversational way to ask the question) and "explain" (a slightly more detailed explanation of the question if the respondent asks for one)"""
+
+
+# Per-column and per-question prompts are split into a prefix shared by every
+# call for a survey and a short per-item suffix, so offline backends can reuse
+# the evaluated prefix (see ollama_prefix).
+def build_question_prefix(survey_description, fused=False):
+    if fused:
+        return f"""Given a survey about '{survey_description}', generate a JSON object for a single survey question based on the data field given below. The JSON object must have ONLY five keys: "question", "description", "type" (choose from 'text', 'yes/no', or 'rating_1_10'), {FUSED_KEYS_TEXT}."""
+    return f"""Given a survey about '{survey_description}', generate a JSON object for a single survey question based on the data field given below. The JSON object must have ONLY three keys: "question", "description", and "type" (choose from 'text', 'yes/no', or 'rating_1_10')."""
+
+
+def build_question_suffix(header):
+    return f"""
+
+Data field: '{header}'"""
+
+
+SCRIPT_PROMPT_PREFIX = """You are creating a single step for a conversational survey. Based on the question details given below, create a JSON object with three keys:
+1. "say": A friendly, conversational way to ask this question.
+2. "explain": A slightly more detailed explanation of the question if the user asks for one.
+3. "question_key": The original question text to use as a key for saving the answer.
+The final output must be a single, valid JSON object for this one question."""
+
+
+def build_script_suffix(question_data):
+    return f"""
+
+Question Details: {json.dumps(question_data, ensure_ascii=False)}"""
+
+
+def build_batch_question_prompt(survey_description, headers, fused=False):
+    field_lines = "\n".join(f"{i}. {header}" for i, header in enumerate(headers, 1))
+    if fused:
+        keys_text = f"""ONLY six keys: "column" (the data field name exactly as given above), "question", "description", "type" (choose from 'text', 'yes/no', or 'rating_1_10'), {FUSED_KEYS_TEXT}"""
+    else:
+        keys_text = """ONLY four keys: "column" (the data field name exactly as given above), "question", "description", and "type" (choose from 'text', 'yes/no', or 'rating_1_10')"""
+    return f"""Given a survey about '{survey_description}', generate one survey question for each of the following data fields.
+
+Data fields (in order):
+{field_lines}
+
+Return ONLY a JSON array with exactly {len(headers)} objects, in the same order as the data fields. Each object must have {keys_text}."""
+
+
+def parse_question_response(response_text, fused=False):
+    """Parses one question object; returns None if it is not valid or incomplete."""
+    schema, keys, suffix = _mode(fused)
+    question_json = json_extract.parse_json(response_text, schema, purpose="question" + suffix)
+    if question_json is None:
+        return None
+    return {k: question_json[k] for k in keys}
+
+
+def parse_batch_response(response_text, headers, fused=False):
+    """
+    Parses the batched JSON array and aligns it with headers. Items are matched
+    by their "column" key, falling back to position when the array has exactly
+    one item per header. Missing or malformed entries come back as None.
+    """
+    schema, keys, suffix = _mode(fused)
+    results = [None] * len(headers)
+    # Items are validated one by one so a single bad entry only costs that column.
+    items = json_extract.parse_json(response_text, {"type": "array"}, purpose="questions_batch" + suffix)
+    if items is None:
+        return results
+
+    index_by_column = {}
+    for i, header in enumerate(headers):
+        index_by_column.setdefault(header, i)
+        index_by_column.setdefault(header.strip().lower(), i)
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        item, errors = json_extract.conform(item, schema)
+        if errors:
+            continue
+        column = item.get("column")
+        index = None
+        if isinstance(column, str):
+            index = index_by_column.get(column, index_by_column.get(column.strip().lower()))
+        if index is None and len(items) == len(headers):
+            index = position
+        if index is not None and results[index] is None:
+            results[index] = {k: item[k] for k in keys}
+    return results
+
+
+def generate_question(header, survey_description, generate_fn, fused=False):
+    """
+    Generates the question (with its "say" / "explain" script step when
+    fused) for one column. Returns (question, warning) where warning is None
+    on success or explains why the default question was used.
+    """
+    schema, _, suffix = _mode(fused)
+    response_text = generate_fn(
+        build_question_suffix(header), purpose="question" + suffix, schema=schema,
+        prefix=build_question_prefix(survey_description, fused)
+    )
+    if not response_text:
+        raise LLMUnavailableError("LLM returned empty response")
+
+    question_json = parse_question_response(response_text, fused)
+    if question_json is None:
+        return default_question(header), f"LLM returned incomplete data for '{header}'. Using a default question."
+    return question_json, None
+
+
+def _generate_per_column(headers, survey_description, generate_fn, backend, on_progress, concurrent, done_offset, total, fused):
+    """Runs generate_question for each header; returns results in header order."""
+    def generate_one(header):
+        return generate_question(header, survey_description, generate_fn, fused)
+
+    if concurrent and len(headers) > 1:
+        results = []
+        if backend == "ollama":
+            # The first call evaluates the shared prompt prefix; the parallel
+            # calls after it then reuse it instead of each evaluating it again.
+            results.append(generate_one(headers[0]))
+            if on_progress:
+                on_progress(done_offset + 1, total, f"Generated question for '{headers[0]}'")
+        first = len(results)
+
+        def on_complete(index, result, done):
+            if on_progress:
+                on_progress(done_offset + first + done, total, f"Generated question for '{headers[first + index]}'")
+        return results + llm_concurrency.run_concurrently(generate_one, headers[first:], backend, on_complete=on_complete)
+
+    results = []
+    for i, header in enumerate(headers):
+        results.append(generate_one(header))
+        if on_progress:
+            on_progress(done_offset + i + 1, total, f"Generated question for '{header}'")
+    return results
+
+
+def generate_questions(headers, survey_description, generate_fn, backend, on_progress=None,
+                       strategy=None, concurrent=None, previous_questions=None, library_questions=None,
+                       fused=None):
+    """
+    Generates one question per column header, preserving column order. Each
+    question carries the "column" it was generated for.
+
+    generate_fn(prompt, purpose=..., schema=..., prefix=None) -> response text
+    (or None on failure); schema is the JSON schema for the backend's
+    structured output and prefix the prompt part shared by all columns.
+    With the "batched" strategy all columns are requested in a single call and
+    only missing/malformed columns are retried individually; otherwise every
+    column gets its own call. Per-column calls run in parallel (bounded by the
+    backend's max-in-flight limit) when concurrent. on_progress(done, total,
+    message) is called from the calling thread. previous_questions are the
+    questions generated earlier for the same survey: columns found there are
+    reused as-is, so after column edits only new or renamed columns reach the
+    LLM and deleted ones are dropped. library_questions ({header: question},
+    see question_library) fill the remaining columns they cover. When fused,
+    generated questions also carry their "say" / "explain" script step (see
+    split_script_steps); reused ones do not. Returns (questions, warnings).
+    """
+    headers = list(headers)
+    total = len(headers)
+    if strategy is None:
+        strategy = QUESTION_GENERATION_STRATEGY
+    if concurrent is None:
+        concurrent = QUESTION_GENERATION_CONCURRENT
+    if fused is None:
+        fused = QUESTION_SCRIPT_FUSED
+    _, _, suffix = _mode(fused)
+
+    questions = [None] * total
+    warnings = []
+    reusable = {
+        q["column"]: q for q in previous_questions or []
+        if isinstance(q, dict) and q.get("column") and not json_extract.validate(q, QUESTION_SCHEMA)
+    }
+    library_questions = library_questions or {}
+    reused = from_library = 0
+    for index, header in enumerate(headers):
+        if header in reusable:
+            questions[index] = {k: reusable[header][k] for k in QUESTION_KEYS}
+            reused += 1
+        elif header in library_questions:
+            questions[index] = {k: library_questions[header][k] for k in QUESTION_KEYS}
+            from_library += 1
+    pending = [i for i in range(total) if questions[i] is None]
+    if reused or from_library:
+        print(f"Question generation: {reused} unchanged and {from_library} library questions reused, {len(pending)}/{total} columns left")
+        if on_progress:
+            on_progress(total - len(pending), total, "Reused known questions")
+
+    if strategy == "batched" and len(pending) > 1:
+        batch_headers = [headers[i] for i in pending]
+        response_text = generate_fn(build_batch_question_prompt(survey_description, batch_headers, fused),
+                                    purpose="questions_batch" + suffix,
+                                    schema=BATCH_FUSED_QUESTION_SCHEMA if fused else BATCH_QUESTION_SCHEMA)
+        if not response_text:
+            raise LLMUnavailableError("LLM returned empty response")
+        for index, question_json in zip(pending, parse_batch_response(response_text, batch_headers, fused)):
+            questions[index] = question_json
+        batch_size = len(pending)
+        pending = [i for i in pending if questions[i] is None]
+        if on_progress:
+            on_progress(total - len(pending), total, "Generated questions in one batch")
+        if pending:
+            json_extract.record_retry("questions_batch" + suffix)
+            print(f"Batched question generation: retrying {len(pending)}/{batch_size} columns individually")
+
+    if pending:
+        pending_headers = [headers[i] for i in pending]
+        results = _generate_per_column(
+            pending_headers, survey_description, generate_fn, backend,
+            on_progress, concurrent, total - len(pending), total, fused
+        )
+        for index, (question_json, warning) in zip(pending, results):
+            questions[index] = question_json
+            if warning:
+                warnings.append(warning)
+
+    return [{"column": header, **question} for header, question in zip(headers, questions)], warnings
+
+
+def default_script_step(question_data):
+    """Fallback script step used when the LLM output for a question is unusable."""
+    return {
+        "say": question_data['question'],
+        "explain": question_data.get('description', 'No further details.'),
+        "question_key": question_data['question']
+    }
+
+
+def split_script_steps(questions):
+    """
+    Separates fused script steps from generated questions. Returns
+    (questions, script): the questions with only "column" and QUESTION_KEYS,
+    and per question its script step, or None where the question came
+    without one (reused, library or default questions).
+    """
+    plain = []
+    script = []
+    for question in questions:
+        plain.append({k: question[k] for k in ["column", *QUESTION_KEYS] if k in question})
+        if all(isinstance(question.get(k), str) and question[k].strip() for k in FUSED_STEP_KEYS):
+            script.append({"say": question["say"], "explain": question["explain"], "question_key": question["question"]})
+        else:
+            script.append(None)
+    return plain, script
+
+
+def generate_script(questions, generate_json_fn, on_progress=None):
+    """
+    Generates one conversational script step per question, in order.
+
+    generate_json_fn(prompt, schema, purpose=..., prefix=None) -> parsed JSON
+    (or None / an exception on failure); failed steps fall back to
+    default_script_step. on_progress(done, total, message) is called after
+    each question. Returns (script, warnings).
+    """
+    script = []
+    warnings = []
+    for i, question_data in enumerate(questions):
+        try:
+            script_part = generate_json_fn(
+                build_script_suffix({k: question_data[k] for k in QUESTION_KEYS if k in question_data}), SCRIPT_SCHEMA,
+                purpose="script", prefix=SCRIPT_PROMPT_PREFIX
+            )
+            if script_part is None:
+                raise ValueError("LLM did not return a valid script step")
+            script.append(script_part)
+        except Exception as e:
+            warnings.append(f"Failed to generate script for a question ({e}). Using default format.")
+            script.append(default_script_step(question_data))
+        if on_progress:
+            on_progress(i + 1, len(questions), f"Generated script for question {i + 1}")
+    return script, warnings
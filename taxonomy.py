@@ -0,0 +1,416 @@
+import os
+import re
+import json
+import math
+import time
+import bisect
+import threading
+from types import MappingProxyType
+
+import numpy as np
+
+# --- LOCAL CLASSIFIER CONFIGURATION ---
+# A TF-IDF index over json_data/classify.json answers the classification stage
+# locally when every core category is matched confidently; anything ambiguous
+# falls back to the LLM. Set TAXONOMY_FAST_PATH=0 to always use the LLM.
+CLASSIFY_PATH = os.getenv("TAXONOMY_CLASSIFY_PATH", "json_data/classify.json")
+FAST_PATH_ENABLED = os.getenv("TAXONOMY_FAST_PATH", "1") != "0"
+# Cosine score the best option must reach, and how far (relative to its own
+# score) it must lead the runner-up, for a category to count as confident.
+MIN_SCORE = float(os.getenv("TAXONOMY_MIN_SCORE", "0.12"))
+MIN_MARGIN = float(os.getenv("TAXONOMY_MIN_MARGIN", "0.35"))
+
+# Categories that must be confidently matched to skip the LLM. The others
+# rarely have explicit evidence in a query: with no evidence they take
+# DEFAULT_OPTIONS, but conflicting evidence still sends the query to the LLM.
+CORE_CATEGORIES = ["level_based", "purpose_based", "sectoral"]
+DEFAULT_OPTIONS = {
+    "methodology_based": "Sample",
+    "geographical": "Topographical",
+    "frequency_based": "Ad hoc",
+    "data_collection_method": "Quantitative",
+}
+
+# Everyday words people use in survey queries, added to each option's
+# description and data variables from classify.json.
+OPTION_KEYWORDS = {
+    "level_based": {
+        "Central": ["national", "nationwide", "country", "countrywide", "all india", "central government", "union government"],
+        "State": ["state", "statewide", "state government", "state level"],
+        "Union Territory": ["union territory", "ut", "delhi", "ladakh", "puducherry", "chandigarh", "lakshadweep", "andaman"],
+        "District": ["district", "districts", "block", "tehsil", "taluka", "collector", "district level"],
+        "Urban Local Body": ["city", "cities", "town", "urban", "municipal", "municipality", "corporation", "ward", "slum"],
+        "Village": ["village", "villages", "gram", "panchayat", "rural", "hamlet", "gram sabha"],
+    },
+    "methodology_based": {
+        "Census": ["census", "every household", "complete enumeration", "enumerate", "headcount", "all households"],
+        "Sample": ["sample", "sampling", "respondents", "questionnaire", "feedback", "opinion", "poll"],
+        "Administrative": ["records", "register", "registry", "administrative", "registered", "mis", "database"],
+    },
+    "purpose_based": {
+        "Regulatory": ["compliance", "regulation", "regulatory", "enforcement", "licence", "license", "inspection", "audit"],
+        "Policy Planning": ["planning", "plan", "new scheme", "design policy", "allocation", "needs assessment", "baseline"],
+        "Monitoring & Evaluation": ["feedback", "evaluate", "evaluation", "impact", "monitor", "monitoring", "effectiveness",
+                                    "satisfaction", "assessment", "progress", "implementation", "beneficiaries"],
+        "Research & Academic": ["research", "study", "academic", "thesis", "university", "causal", "analysis"],
+    },
+    "sectoral": {
+        "Agriculture": ["farmer", "farmers", "farming", "crop", "crops", "agriculture", "agricultural", "irrigation", "kisan", "harvest"],
+        "Health & Nutrition": ["health", "hospital", "clinic", "doctor", "nutrition", "disease", "vaccination", "maternal",
+                               "healthcare", "patients", "anganwadi"],
+        "Education": ["school", "schools", "student", "students", "teacher", "teachers", "education", "college", "literacy", "learning"],
+        "Labour": ["employment", "unemployment", "job", "jobs", "worker", "workers", "wage", "wages", "labour", "labor", "mgnrega"],
+        "Industry": ["industry", "industrial", "factory", "factories", "manufacturing", "msme", "enterprise", "enterprises", "business"],
+        "Housing": ["housing", "house", "houses", "home", "homes", "shelter", "rent", "awas", "dwelling"],
+        "Social Welfare": ["welfare", "pension", "disability", "disabled", "ration", "caste", "tribal", "women empowerment",
+                           "elderly", "widow", "social security"],
+        "Environment": ["environment", "environmental", "pollution", "plastic", "climate", "renewable", "waste", "forest",
+                        "air quality", "water quality", "solar", "green"],
+    },
+    "geographical": {
+        "Topographical": ["terrain", "elevation", "map", "mapping", "topography"],
+        "Geological": ["geology", "mineral", "minerals", "mining", "rock", "earthquake"],
+        "Archaeological": ["monument", "monuments", "heritage", "archaeology", "archaeological", "ancient"],
+        "Botanical & Zoological": ["flora", "fauna", "wildlife", "species", "biodiversity", "plants", "animals"],
+    },
+    "frequency_based": {
+        "Decennial": ["decennial", "every ten years", "ten yearly"],
+        "Quinquennial": ["quinquennial", "every five years", "five yearly"],
+        "Annual": ["annual", "annually", "yearly", "every year"],
+        "Periodic": ["periodic", "quarterly", "monthly", "biannual", "regular intervals"],
+        "Ad hoc": ["one time", "adhoc", "ad hoc", "special", "rapid"],
+    },
+    "data_collection_method": {
+        "Quantitative": ["quantitative", "numbers", "statistics", "count", "measure", "rating", "ratings"],
+        "Qualitative": ["qualitative", "interview", "interviews", "perception", "perceptions", "experience", "experiences",
+                        "opinion", "opinions", "reasons", "open ended", "focus group"],
+        "Mixed Methods": ["mixed", "mixed methods", "both quantitative and qualitative"],
+    },
+}
+
+# Term weights: the option's own name and curated keywords count more than
+# the words pulled from its description and data variables.
+NAME_WEIGHT = 6
+KEYWORD_WEIGHT = 4
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "with", "by", "at", "from", "as", "is", "are",
+    "be", "this", "that", "it", "its", "their", "such", "e", "g", "eg", "etc", "about", "into", "on", "how",
+    "design", "create", "collect", "collecting", "conduct", "data", "india", "indian", "government", "govt",
+    "level", "related", "including", "often", "used", "use", "per", "type", "total", "number", "name",
+    "survey", "surveys", "wise",
+}
+
+# --- VARIABLE INDEX CONFIGURATION ---
+# Token weights of a variable: words of its own name, and words of the
+# option(s) it is listed under (name and description).
+VARIABLE_NAME_WEIGHT = 1.0
+VARIABLE_CONTEXT_WEIGHT = 0.3
+# A partially typed last word matches vocabulary tokens it is a prefix of, at this weight.
+PREFIX_MATCH_WEIGHT = 0.8
+# Variables listed under one of the survey's classified options rank this much higher.
+CLASSIFIED_BOOST = 1.5
+# Results scoring below this fraction of the best match are dropped (mere context matches).
+MIN_RELATIVE_SCORE = 0.35
+# Example variables per classified option, in prompt order; options whose
+# variables are grouped ({subgroup: [...]}) contribute EXAMPLES_PER_GROUP per group.
+EXAMPLE_COUNTS = (("level_based", 3), ("methodology_based", 3), ("sectoral", 5), ("purpose_based", 3))
+EXAMPLES_PER_GROUP = 2
+MAX_PROMPT_VARIABLES = 15
+
+_stats_lock = threading.Lock()
+_stats = {"fast_path": 0, "llm_fallback": 0, "fast_path_seconds": 0.0}
+
+
+def _stem(token):
+    if token.endswith(("ss", "us", "is")):
+        return token
+    for suffix in ("ies", "ing", "es", "ed", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return token
+
+
+def tokenize(text):
+    """Lowercased, stopword-free, lightly stemmed word tokens (underscores split words)."""
+    words = re.findall(r"[a-z0-9]+", text.lower().replace("_", " "))
+    return [_stem(w) for w in words if w not in STOPWORDS and len(w) > 1]
+
+
+def _flatten_variables(data_variables):
+    """classify.json stores data_variables as a list or as {subgroup: [variables]}."""
+    if isinstance(data_variables, dict):
+        names = []
+        for group, variables in data_variables.items():
+            names.append(group)
+            names.extend(variables)
+        return names
+    return list(data_variables or [])
+
+
+def _option_terms(category, option, details):
+    terms = tokenize(option) * NAME_WEIGHT
+    for keyword in OPTION_KEYWORDS.get(category, {}).get(option, []):
+        terms.extend(tokenize(keyword) * KEYWORD_WEIGHT)
+    terms.extend(tokenize(details.get("description", "")))
+    for variable in _flatten_variables(details.get("data_variables")):
+        terms.extend(tokenize(variable))
+    return terms
+
+
+class TaxonomyClassifier:
+    """
+    Local keyword / TF-IDF classifier for the categories in classify.json.
+    All categories share one vocabulary so a query is tokenised and vectorised
+    once. Each category has its own IDF; the L2-normalised TF-IDF rows of every
+    option (pre-multiplied by their category's IDF) are stacked into a single
+    matrix, so scoring a query is one mat-vec plus one norm per category.
+    """
+
+    def __init__(self, classify_data):
+        docs = {
+            category: [_option_terms(category, option, details) for option, details in options.items()]
+            for category, options in classify_data.items()
+        }
+        terms = sorted({t for category_docs in docs.values() for doc in category_docs for t in doc})
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.categories = list(classify_data)
+        self.options = {category: list(options) for category, options in classify_data.items()}
+        idfs, rows, self.row_ranges = [], [], {}
+        for category, category_docs in docs.items():
+            counts = np.zeros((len(category_docs), len(self.vocab)))
+            for row, doc in enumerate(category_docs):
+                np.add.at(counts[row], [self.vocab[t] for t in doc], 1)
+            df = (counts > 0).sum(axis=0)
+            # Smoothed IDF within the category (terms shared by every option carry
+            # little weight); terms the category never uses get 0 so they are ignored.
+            idf = np.where(df > 0, np.log((1 + len(category_docs)) / (1 + df)) + 1, 0.0)
+            weights = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0) * idf
+            norms = np.linalg.norm(weights, axis=1, keepdims=True)
+            self.row_ranges[category] = (len(rows), len(rows) + len(category_docs))
+            rows.extend(weights / np.where(norms == 0, 1, norms) * idf)
+            idfs.append(idf)
+        self.idf = np.array(idfs)      # categories x vocabulary
+        self.matrix = np.array(rows)   # all options x vocabulary
+
+    def _query_terms(self, query):
+        """Sparse query vector: (vocabulary ids, sublinear tf weights)."""
+        counts = {}
+        for token in tokenize(query):
+            index = self.vocab.get(token)
+            if index is not None:
+                counts[index] = counts.get(index, 0) + 1
+        ids = list(counts)
+        return ids, np.array([1 + math.log(counts[i]) for i in ids])
+
+    def score(self, query):
+        """
+        Returns {category: {"option", "score", "margin", "confident"}}: the best
+        option's cosine score and its lead over the runner-up relative to that score.
+        """
+        ids, tf = self._query_terms(query)
+        if ids:
+            raw_scores = (self.matrix[:, ids] @ tf).tolist()
+            query_norms = np.linalg.norm(self.idf[:, ids] * tf, axis=1).tolist()
+        else:
+            raw_scores = [0.0] * len(self.matrix)
+            query_norms = [0.0] * len(self.categories)
+        results = {}
+        for category, query_norm in zip(self.categories, query_norms):
+            start, end = self.row_ranges[category]
+            scores = [score / query_norm if query_norm else 0.0 for score in raw_scores[start:end]]
+            order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+            best = scores[order[0]]
+            second = scores[order[1]] if len(order) > 1 else 0.0
+            margin = (best - second) / best if best > 0 else 0.0
+            results[category] = {
+                "option": self.options[category][order[0]],
+                "score": round(best, 4),
+                "margin": round(margin, 4),
+                "confident": best >= MIN_SCORE and margin >= MIN_MARGIN,
+            }
+        return results
+
+    def classify(self, query):
+        """
+        Returns the classifications dict (same shape as the LLM's), or None when
+        a core category lacks a confident match or any category has conflicting
+        evidence. Non-core categories with no evidence use DEFAULT_OPTIONS.
+        """
+        classifications = {}
+        for category, result in self.score(query).items():
+            if result["confident"]:
+                classifications[category] = result["option"]
+            elif category in CORE_CATEGORIES or result["score"] >= MIN_SCORE:
+                return None
+            else:
+                classifications[category] = DEFAULT_OPTIONS.get(category, result["option"])
+        return classifications
+
+
+class TaxonomyIndex:
+    """
+    Immutable search index over the data variables of classify.json: the
+    flattened variables and prompt examples of every (category, option), and
+    an inverted token index over variable names and their options' names and
+    descriptions. Lookups are ranked by summed IDF-weighted token matches.
+    """
+
+    def __init__(self, classify_data):
+        contexts = {}      # variable -> [(category, option, context text)]
+        option_variables, examples = {}, {}
+        example_counts = dict(EXAMPLE_COUNTS)
+        for category, options in classify_data.items():
+            for option, details in options.items():
+                data_variables = details.get("data_variables") or []
+                if isinstance(data_variables, dict):
+                    flat = tuple(v for group in data_variables.values() for v in group)
+                    option_examples = tuple(v for group in data_variables.values() for v in group[:EXAMPLES_PER_GROUP])
+                else:
+                    flat = tuple(data_variables)
+                    option_examples = flat[:example_counts.get(category, 3)]
+                option_variables[(category, option)] = flat
+                examples[(category, option)] = option_examples
+                for variable in flat:
+                    contexts.setdefault(variable, []).append((category, option, f"{option} {details.get('description', '')}"))
+
+        self.variables = tuple(contexts)
+        self.memberships = tuple(frozenset((c, o) for c, o, _ in contexts[v]) for v in self.variables)
+        postings = {}
+        for i, variable in enumerate(self.variables):
+            weights = {}
+            for _, _, context in contexts[variable]:
+                for token in tokenize(context):
+                    weights[token] = VARIABLE_CONTEXT_WEIGHT
+            for token in tokenize(variable):
+                weights[token] = weights.get(token, 0.0) + VARIABLE_NAME_WEIGHT
+            for token, weight in weights.items():
+                postings.setdefault(token, []).append((i, weight))
+        total = len(self.variables)
+        self.idf = MappingProxyType({t: math.log(1 + total / len(p)) for t, p in postings.items()})
+        self.postings = MappingProxyType({t: tuple(p) for t, p in postings.items()})
+        self.vocabulary = tuple(sorted(postings))
+        self.option_variables = MappingProxyType(option_variables)
+        self.option_examples = MappingProxyType(examples)
+
+    def examples(self, classifications):
+        """Example variables for the classified options (level, methodology, sector, purpose)."""
+        found = []
+        for category, _ in EXAMPLE_COUNTS:
+            found.extend(self.option_examples.get((category, classifications.get(category)), ()))
+        return found[:MAX_PROMPT_VARIABLES]
+
+    def _prefix_tokens(self, partial):
+        start = bisect.bisect_left(self.vocabulary, partial)
+        end = bisect.bisect_left(self.vocabulary, partial + "\uffff")
+        return self.vocabulary[start:end]
+
+    def search(self, text, classifications=None, limit=10, exclude=(), prefix=False):
+        """
+        Variables ranked by relevance to text. With prefix, the last word may be
+        partially typed (typeahead). Variables under the survey's classified
+        options are boosted; names in exclude (any spelling) are skipped.
+        """
+        tokens = tokenize(text)
+        scores = {}
+        for token in tokens:
+            for i, weight in self.postings.get(token, ()):
+                scores[i] = scores.get(i, 0.0) + self.idf[token] * weight
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        if prefix and words and len(words[-1]) >= 2:
+            for token in self._prefix_tokens(words[-1]):
+                if token in tokens:
+                    continue
+                for i, weight in self.postings[token]:
+                    scores[i] = scores.get(i, 0.0) + self.idf[token] * weight * PREFIX_MATCH_WEIGHT
+        if classifications:
+            chosen = set(classifications.items())
+            for i in scores:
+                if self.memberships[i] & chosen:
+                    scores[i] *= CLASSIFIED_BOOST
+        excluded = {tuple(tokenize(name)) for name in exclude}
+        ranked = sorted(scores, key=lambda i: (-scores[i], len(self.variables[i])))
+        cutoff = scores[ranked[0]] * MIN_RELATIVE_SCORE if ranked else 0.0
+        results = [
+            self.variables[i] for i in ranked
+            if scores[i] >= cutoff and tuple(tokenize(self.variables[i])) not in excluded
+        ]
+        return results[:limit]
+
+    def relevant_variables(self, query, classifications, limit=MAX_PROMPT_VARIABLES):
+        """Variables for a headings prompt: the best matches for the query, then the classified options' examples."""
+        found = []
+        for variable in self.search(query, classifications, limit=limit - 5) + self.examples(classifications):
+            if variable not in found:
+                found.append(variable)
+        return found[:limit]
+
+
+_classifier = None
+_index = None
+_classifier_lock = threading.Lock()
+_classify_data = None
+
+
+def _load_classify_data():
+    global _classify_data
+    if _classify_data is None:
+        with open(CLASSIFY_PATH, "r", encoding="utf-8") as f:
+            _classify_data = json.load(f)
+    return _classify_data
+
+
+def get_classifier():
+    """Builds the classifier from classify.json once per process."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = TaxonomyClassifier(_load_classify_data())
+    return _classifier
+
+
+def get_index():
+    """Builds the variable index from classify.json once per process."""
+    global _index
+    if _index is None:
+        with _classifier_lock:
+            if _index is None:
+                _index = TaxonomyIndex(_load_classify_data())
+    return _index
+
+
+def suggest_columns(text, exclude=(), classifications=None, limit=10):
+    """Typeahead column suggestions from the taxonomy for partially typed text (no LLM call)."""
+    return get_index().search(text, classifications, limit=limit, exclude=exclude, prefix=True)
+
+
+def fast_classify(query):
+    """
+    Classifies the query locally, returning None (and counting an LLM
+    fallback) when it is ambiguous or the fast path is disabled.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    start = time.perf_counter()
+    classifications = get_classifier().classify(query)
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        if classifications is None:
+            _stats["llm_fallback"] += 1
+        else:
+            _stats["fast_path"] += 1
+            _stats["fast_path_seconds"] += elapsed
+    return classifications
+
+
+def get_fast_path_stats():
+    """How often the classification stage was answered locally vs. by the LLM."""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["fast_path"] + stats["llm_fallback"]
+    stats["fast_path_rate"] = stats["fast_path"] / total if total else 0.0
+    stats["avg_fast_path_us"] = (
+        round(stats.pop("fast_path_seconds") / stats["fast_path"] * 1e6, 1) if stats["fast_path"] else 0.0
+    )
+    return stats
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# --- TRANSLATION CONFIGURATION ---
+# Surveys are generated in English. On deploy, their questions, conversational
+# script and form labels are translated into every target language and written
+# as one bundle per language, so a session in another language needs no LLM
+# call. Every translated string is kept in a segment-level translation memory:
+# unchanged strings are never sent for translation again.
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", "translation_memory.db")
+SOURCE_LANGUAGE = "en"
+TARGET_LANGUAGES = [lang.strip() for lang in os.getenv("TRANSLATION_LANGUAGES", "hi").split(",") if lang.strip()]
+LANGUAGE_NAMES = {"en": "English", "hi": "Hindi"}
+# Segments sent per translation call.
+TRANSLATION_BATCH_SIZE = int(os.getenv("TRANSLATION_BATCH_SIZE", "40"))
+SURVEY_BUNDLES_DIR = "survey_bundles"
+
+# Fixed texts of the survey form (answer values stay in English).
+FORM_LABELS = {
+    "select": "Select:",
+    "rating": "Rating:",
+    "answer": "Answer:",
+    "submit": "Submit Survey",
+    "yes": "Yes",
+    "no": "No",
+}
+
+TRANSLATION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, "text": {"type": "string", "minLength": 1}},
+        "required": ["id", "text"],
+    },
+}
+
+_lock = threading.Lock()
+_bundle_locks = {}  # survey_id -> lock, so builds of one survey never interleave
+_conn = None
+_stats = {"segments": 0, "memory_hits": 0, "translated": 0, "failed": 0, "calls": 0, "bundles": 0}
+
+
+def _get_connection():
+    """Opens (once per process) the SQLite translation memory and creates the table."""
+    global _conn
+    if _conn is None:
+        db_dir = os.path.dirname(TRANSLATION_MEMORY_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _conn = sqlite3.connect(TRANSLATION_MEMORY_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                source_hash TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (source_hash, lang)
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+
+def _segment_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_translation_prompt(segments, lang):
+    lines = "\n".join(json.dumps({"id": i, "text": text}, ensure_ascii=False) for i, text in enumerate(segments))
+    return f"""Translate each of the following survey texts from English into {LANGUAGE_NAMES.get(lang, lang)}. Keep the meaning, tone and any placeholders or numbers unchanged, and use simple words a household respondent would understand.
+
+Texts (one JSON object per line):
+{lines}
+
+Return ONLY a JSON array with one object per text, each with the keys "id" (the id given above) and "text" (the translation)."""
+
+
+def _translate_batch(segments, lang, generate_json_fn):
+    """Translates one batch; returns {source: translation} for the segments that came back."""
+    with _lock:
+        _stats["calls"] += 1
+    try:
+        items = generate_json_fn(build_translation_prompt(segments, lang), TRANSLATION_SCHEMA, purpose="translation")
+    except Exception as e:
+        print(f"Translation into {lang} failed: {e}")
+        return {}
+    translated = {}
+    for item in items or []:
+        if 0 <= item["id"] < len(segments) and item["text"].strip():
+            translated[segments[item["id"]]] = item["text"].strip()
+    return translated
+
+
+def translate_segments(segments, lang, generate_json_fn):
+    """
+    Translations of segments into lang as {source: translation}. Segments
+    found in the translation memory are reused; the rest are translated in
+    batches of TRANSLATION_BATCH_SIZE via generate_json_fn(prompt, schema,
+    purpose=...) and stored. Segments that could not be translated are
+    missing from the result (and tried again next time).
+    """
+    unique = list(dict.fromkeys(s for s in segments if isinstance(s, str) and s.strip()))
+    if not unique or lang == SOURCE_LANGUAGE:
+        return {s: s for s in unique}
+    hashes = {s: _segment_hash(s) for s in unique}
+    found = {}
+    with _lock:
+        conn = _get_connection()
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT source, target FROM translations WHERE lang = ? AND source_hash IN ({placeholders})",
+                (lang, *[hashes[s] for s in chunk])
+            ).fetchall()
+            found.update(rows)
+        _stats["segments"] += len(unique)
+        _stats["memory_hits"] += len(found)
+
+    pending = [s for s in unique if s not in found]
+    for start in range(0, len(pending), TRANSLATION_BATCH_SIZE):
+        batch = pending[start:start + TRANSLATION_BATCH_SIZE]
+        translated = _translate_batch(batch, lang, generate_json_fn)
+        now = time.time()
+        with _lock:
+            conn = _get_connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO translations (source_hash, lang, source, target, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(hashes[source], lang, source, target, now) for source, target in translated.items()]
+            )
+            conn.commit()
+            _stats["translated"] += len(translated)
+            _stats["failed"] += len(batch) - len(translated)
+        found.update(translated)
+    return found
+
+
+def bundle_path(survey_id, lang):
+    return os.path.join(SURVEY_BUNDLES_DIR, f"survey_{survey_id}_{lang}.json")
+
+
+def build_bundles(survey_id, json_path, generate_json_fn, languages=None, on_progress=None):
+    """
+    Writes survey_bundles/survey_<id>_<lang>.json for every target language:
+    the survey's questions, its conversational script (if it has one) and the
+    form labels, translated. "column", "type" and the script's "question_key"
+    stay in English so answers are saved under the same keys in every
+    language. on_progress(done, total, message) is called after each
+    language. Builds of the same survey run one at a time and read the script
+    only once they hold its lock, so the last build always has the newest
+    script. Returns {lang: bundle_path}.
+    """
+    with _lock:
+        survey_lock = _bundle_locks.setdefault(survey_id, threading.Lock())
+    with survey_lock:
+        return _build_bundles(survey_id, json_path, generate_json_fn, languages, on_progress)
+
+
+def _build_bundles(survey_id, json_path, generate_json_fn, languages, on_progress):
+    with open(json_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    try:
+        with open(os.path.join("survey_scripts", f"script_{survey_id}.json"), "r", encoding="utf-8") as f:
+            script = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        script = []
+
+    segments = [q.get(k) for q in questions for k in ("question", "description")]
+    segments += [s.get(k) for s in script for k in ("say", "explain")]
+    segments += list(FORM_LABELS.values())
+
+    os.makedirs(SURVEY_BUNDLES_DIR, exist_ok=True)
+    paths = {}
+    languages = [lang for lang in languages or TARGET_LANGUAGES if lang != SOURCE_LANGUAGE]
+    for lang in languages:
+        translations = translate_segments(segments, lang, generate_json_fn)
+
+        def tr(text):
+            return translations.get(text, text)
+        bundle = {
+            "survey_id": survey_id,
+            "lang": lang,
+            "questions": [{**q, "question": tr(q.get("question", "")), "description": tr(q.get("description", ""))} for q in questions],
+            "script": [{**s, "say": tr(s.get("say", "")), "explain": tr(s.get("explain", ""))} for s in script],
+            "labels": {key: tr(label) for key, label in FORM_LABELS.items()},
+        }
+        paths[lang] = bundle_path(survey_id, lang)
+        with open(paths[lang], "w", encoding="utf-8") as f:
+            json.dump(bundle, f, indent=2, ensure_ascii=False)
+        with _lock:
+            _stats["bundles"] += 1
+        if on_progress:
+            on_progress(len(paths), len(languages), f"Translated the survey into {LANGUAGE_NAMES.get(lang, lang)}")
+    return paths
+
+
+def load_bundle(survey_id, lang):
+    """The survey's bundle for lang, or None (source language or not built yet)."""
+    if not lang or lang == SOURCE_LANGUAGE:
+        return None
+    try:
+        with open(bundle_path(survey_id, lang), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def get_translation_stats():
+    """Segment / memory-hit counters for this process plus the number of stored translations."""
+    with _lock:
+        stats = dict(_stats)
+        try:
+            stats["entries"] = _get_connection().execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = None
+    stats["hit_rate"] = round(stats["memory_hits"] / stats["segments"], 3) if stats["segments"] else 0.0
+    return stats